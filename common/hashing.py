@@ -0,0 +1,23 @@
+"""
+Content hashes shared by the preprocessing, evaluation and training scripts
+Enrichment checkpoints, evaluation predictions and training caches are keyed on them, so every stage
+imports them from here: a copy that drifted would stop keys matching without any error
+"""
+import hashlib
+
+HASH_BLOCK_BYTES = 16 * 2 ** 20
+
+
+def question_hash(question: str) -> str:
+    """Identifies a question across runs and stages; whitespace and case differences don't matter"""
+    normalized = " ".join(question.split()).lower()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file's contents, read in blocks so multi-GB model files are never held in memory"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Inference performance benchmark for GGUF quantizations
+For every model and thread count, a fresh process loads the GGUF and measures load time, resident
+memory, prompt-eval tokens/s at several prompt lengths (from a bare evaluation question up to the
+server's SYSTEM_PROMPT plus chat history), time-to-first-token and decode tokens/s. The report is
+written next to run_eval.py's ROUGE-L results and joined with them, one row per model, thread
+count and prompt
+
+    python bench_gguf.py --model SFT_F16=models/hypnos-sft-f16.gguf \\
+                         --model SFT_Q4_K_M=models/hypnos-sft-q4_k_m.gguf --threads 4,8
+"""
+import argparse
+import ast
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from run_eval import PROMPT_TEMPLATE, parse_model
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server', 'server.py')
+DEFAULT_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sleepqa_data', 'sleep-train-enriched.json')
+
+
+def server_system_prompt(path: str = SERVER_PATH) -> str:
+    """SYSTEM_PROMPT as defined in server.py, read from the source since importing it starts the server"""
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "SYSTEM_PROMPT" for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError(f"SYSTEM_PROMPT not found in {path}")
+
+
+def format_turn(role: str, content: str) -> str:
+    """Same Gemma chat turn as server.format_turn"""
+    return f"<start_of_turn>{role}\n{content.strip()}<end_of_turn>\n"
+
+
+def build_prompts(data_path: str, history_turns: List[int]) -> Dict[str, Dict]:
+    """
+    Benchmark prompts, shortest first:
+    - question: the evaluation prompt of run_eval.py
+    - system: the server's first turn, SYSTEM_PROMPT plus a question
+    - history_N: SYSTEM_PROMPT, N earlier user/model exchanges and the new question
+    Server-style prompts are kept as turns and tokenized like the server (BOS + turns + reply prefix)
+    """
+    with open(data_path, 'r', encoding='utf-8') as f:
+        pairs = [(d["question"], d["answer"]) for d in json.load(f) if d.get("question") and d.get("answer")]
+    question = pairs[0][0]
+    system_turn = format_turn("system", server_system_prompt())
+
+    prompts = {"question": {"text": PROMPT_TEMPLATE.format(question=question)}}
+    prompts["system"] = {"turns": [system_turn, format_turn("user", question)]}
+    for n in history_turns:
+        turns = [system_turn]
+        for past_question, past_answer in pairs[1:n + 1]:
+            turns += [format_turn("user", past_question), format_turn("model", past_answer)]
+        prompts[f"history_{n}"] = {"turns": turns + [format_turn("user", question)]}
+    return prompts
+
+
+def rss_mb() -> Tuple[Optional[float], float]:
+    """(current, peak) resident memory of this process in MB; current is only available on Linux"""
+    current = None
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+    return current, peak
+
+
+def measure(model_path: str, threads: int, n_ctx: int, n_gpu_layers: int, prompts: Dict[str, Dict],
+            decode_tokens: int, repeats: int) -> Dict:
+    """Runs in a fresh process, so load time and memory are those of this model alone"""
+    import numpy as np
+    from llama_cpp import Llama, LogitsProcessorList
+
+    start = time.perf_counter()
+    llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=threads, n_threads_batch=threads,
+                n_gpu_layers=n_gpu_layers, verbose=False)
+    load_seconds = time.perf_counter() - start
+    rss_loaded, _ = rss_mb()
+
+    eos = llm.token_eos()
+
+    def suppress_eos(input_ids, scores):
+        # Every run decodes exactly decode_tokens, so rates are comparable across models
+        scores[eos] = -np.inf
+        return scores
+
+    bos = llm.tokenize(b"", add_bos=True)
+
+    def tokenize(prompt: Dict) -> List[int]:
+        if "text" in prompt:
+            return llm.tokenize(prompt["text"].encode("utf-8"), add_bos=False, special=True)
+        tokens = list(bos)
+        for turn in prompt["turns"] + ["<start_of_turn>model\n"]:
+            tokens += llm.tokenize(turn.encode("utf-8"), add_bos=False, special=True)
+        return tokens
+
+    # Untimed warm-up: the first evaluation also pages the memory-mapped weights in
+    llm.reset()
+    llm.eval(tokenize(prompts["question"])[:8])
+
+    results = []
+    for name, prompt in prompts.items():
+        tokens = tokenize(prompt)
+        if len(tokens) + decode_tokens > n_ctx:
+            print(f"   ⚠️ Skipping {name}: {len(tokens)} prompt tokens don't fit in n_ctx={n_ctx}")
+            continue
+        prompt_rates, ttfts, decode_rates = [], [], []
+        for _ in range(repeats):
+            llm.reset()
+            start = time.perf_counter()
+            llm.eval(tokens)
+            prompt_rates.append(len(tokens) / (time.perf_counter() - start))
+
+            # reset() drops the evaluated prompt, so time-to-first-token includes prompt evaluation
+            llm.reset()
+            start = time.perf_counter()
+            first = None
+            n_generated = 0
+            for _ in llm.create_completion(tokens, max_tokens=decode_tokens, temperature=0.0, stream=True,
+                                           logits_processor=LogitsProcessorList([suppress_eos])):
+                n_generated += 1
+                if first is None:
+                    first = time.perf_counter()
+            end = time.perf_counter()
+            if first is not None:
+                ttfts.append((first - start) * 1000)
+            if n_generated > 1:
+                decode_rates.append((n_generated - 1) / (end - first))
+
+        results.append({
+            "prompt": name,
+            "prompt_tokens": len(tokens),
+            "prompt_eval_tok_s": round(statistics.median(prompt_rates), 2),
+            "ttft_ms": round(statistics.median(ttfts), 1) if ttfts else None,
+            "decode_tok_s": round(statistics.median(decode_rates), 2) if decode_rates else None
+        })
+
+    _, rss_peak = rss_mb()
+    return {
+        "load_seconds": round(load_seconds, 3),
+        "rss_loaded_mb": round(rss_loaded, 1) if rss_loaded is not None else None,
+        "rss_peak_mb": round(rss_peak, 1),
+        "prompts": results
+    }
+
+
+def load_rouge_results(path: str) -> Dict[str, Dict]:
+    """run_eval.py results by label and by model path, so benchmark rows can be joined with quality"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+    by_key = {}
+    for result in results:
+        by_key[result["label"]] = result
+        by_key[os.path.abspath(result["model_path"])] = result
+    return by_key
+
+
+def report_rows(runs: List[Dict]) -> List[Dict]:
+    """One flat row per model, thread count and prompt"""
+    rows = []
+    for run in runs:
+        for prompt in run["prompts"]:
+            row = {key: value for key, value in run.items() if key != "prompts"}
+            row.update(prompt)
+            rows.append(row)
+    return rows
+
+
+def write_report(runs: List[Dict], output_dir: str):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "bench_results.json"), 'w', encoding='utf-8') as f:
+        json.dump(runs, f, indent=2)
+    rows = report_rows(runs)
+    if rows:
+        with open(os.path.join(output_dir, "bench_results.csv"), 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def parse_threads(value: str) -> List[int]:
+    return sorted({int(n) for n in value.split(",") if n.strip()})
+
+
+def main():
+    cpu_count = os.cpu_count() or 4
+    parser = argparse.ArgumentParser(description='Benchmark load time, memory and speed of GGUF quantizations')
+    parser.add_argument(
+        '--model',
+        action='append',
+        required=True,
+        help='LABEL=path/to/model.gguf (repeatable); use the same labels as run_eval.py to join ROUGE-L'
+    )
+    parser.add_argument(
+        '--threads',
+        type=parse_threads,
+        default=parse_threads(f"{max(1, cpu_count // 2)},{cpu_count}"),
+        help='Comma-separated thread counts (default: half and all cores)'
+    )
+    parser.add_argument(
+        '--history-turns',
+        type=lambda value: [int(n) for n in value.split(",")],
+        default=[2, 6],
+        help='Earlier exchanges in the history prompts, comma-separated (default: 2,6)'
+    )
+    parser.add_argument(
+        '--decode-tokens',
+        type=int,
+        default=64,
+        help='Tokens generated per decode measurement (default: 64)'
+    )
+    parser.add_argument(
+        '--repeats',
+        type=int,
+        default=3,
+        help='Runs per prompt, the median is reported (default: 3)'
+    )
+    parser.add_argument(
+        '--n-ctx',
+        type=int,
+        default=2048,
+        help='Context window, as N_CTX on the server (default: 2048)'
+    )
+    parser.add_argument(
+        '--n-gpu-layers',
+        type=int,
+        default=0,
+        help='Layers offloaded to the GPU (default: 0)'
+    )
+    parser.add_argument(
+        '--data',
+        default=DEFAULT_DATA,
+        help='Q&A pairs used for the questions and history (default: sleepqa_data/sleep-train-enriched.json)'
+    )
+    parser.add_argument(
+        '--output-dir',
+        default='eval_runs',
+        help='Where to write bench_results.json and bench_results.csv (default: eval_runs)'
+    )
+    parser.add_argument(
+        '--rouge-results',
+        help='run_eval.py results to join (default: results.json in the output directory)'
+    )
+    args = parser.parse_args()
+
+    prompts = build_prompts(args.data, args.history_turns)
+    rouge = load_rouge_results(args.rouge_results or os.path.join(args.output_dir, "results.json"))
+    # A fresh interpreter per measurement, so memory and load time are not shared between models
+    context = multiprocessing.get_context("spawn")
+
+    print("\n⏱️ GGUF Inference Benchmark\n" + "─" * 50)
+    runs = []
+    for label, model_path in map(parse_model, args.model):
+        if not os.path.exists(model_path):
+            print(f"❌ Model file not found: {model_path}")
+            continue
+        quality = rouge.get(label) or rouge.get(os.path.abspath(model_path)) or {}
+        for threads in args.threads:
+            print(f"🔬 {label} with {threads} thread(s)...")
+            with context.Pool(1) as pool:
+                measured = pool.apply(measure, (model_path, threads, args.n_ctx, args.n_gpu_layers, prompts,
+                                                args.decode_tokens, args.repeats))
+            run = {
+                "label": label,
+                "model_path": model_path,
+                "model_size_mb": round(os.path.getsize(model_path) / 2 ** 20, 1),
+                "threads": threads,
+                "rougeL": quality.get("rougeL"),
+                "rougeL_ci_low": quality.get("ci_low"),
+                "rougeL_ci_high": quality.get("ci_high"),
+                **measured
+            }
+            runs.append(run)
+            print(f"   load {run['load_seconds']:.2f}s  rss {run['rss_loaded_mb']} MB (peak {run['rss_peak_mb']} MB)")
+            for prompt in run["prompts"]:
+                print(f"   {prompt['prompt']:<12} {prompt['prompt_tokens']:>5} tok  "
+                      f"prompt {prompt['prompt_eval_tok_s']:>8.1f} tok/s  ttft {prompt['ttft_ms']} ms  "
+                      f"decode {prompt['decode_tok_s']} tok/s")
+            # Written after every run, so an interrupted benchmark keeps what it measured
+            write_report(runs, args.output_dir)
+
+    if runs:
+        print(f"📋 Report saved to {args.output_dir}/bench_results.json and bench_results.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+ROUGE-L scoring and bootstrap confidence intervals for the GGUF evaluation
+Every prediction is tokenized and scored once; the bootstrap then only resamples the per-sample
+scores, so a 1000-resample CI takes milliseconds instead of 1000 full ROUGE passes
+
+    from rouge_eval import rouge_l, rouge_ci
+    score = rouge_l(preds, refs)
+    lo, hi = rouge_ci(preds, refs, boot=1000)
+"""
+import re
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Resampled indices are drawn in chunks of at most this many, to bound memory on large test sets
+BOOTSTRAP_CHUNK_ELEMENTS = 4_000_000
+
+
+def tokenize(text: str) -> List[str]:
+    """The rouge_score default tokenizer (as used by evaluate's "rouge"): lowercase alphanumeric runs, no stemming"""
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).split()
+
+
+def lcs_length(a: Sequence[str], b: Sequence[str]) -> int:
+    """Length of the longest common subsequence, with a single DP row"""
+    if len(a) < len(b):
+        a, b = b, a
+    row = [0] * (len(b) + 1)
+    for token in a:
+        previous_diagonal = 0
+        for j, other in enumerate(b, 1):
+            above = row[j]
+            row[j] = previous_diagonal + 1 if token == other else max(row[j - 1], above)
+            previous_diagonal = above
+    return row[-1]
+
+
+def rouge_l_f(prediction: str, reference: str) -> float:
+    """LCS-based ROUGE-L F-measure of one prediction against its reference"""
+    pred_tokens, ref_tokens = tokenize(prediction), tokenize(reference)
+    if not pred_tokens or not ref_tokens:
+        return 0.0
+    lcs = lcs_length(pred_tokens, ref_tokens)
+    if lcs == 0:
+        return 0.0
+    precision, recall = lcs / len(pred_tokens), lcs / len(ref_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+
+def rouge_l_scores(preds: Sequence[str], refs: Sequence[str]) -> np.ndarray:
+    """Per-sample ROUGE-L F, computed once per prediction"""
+    if len(preds) != len(refs):
+        raise ValueError(f"{len(preds)} predictions for {len(refs)} references")
+    return np.array([rouge_l_f(p, r) for p, r in zip(preds, refs)], dtype=np.float64)
+
+
+def rouge_l(preds: Sequence[str], refs: Sequence[str]) -> float:
+    """Corpus ROUGE-L: the mean per-sample F, which is what evaluate's aggregated "rougeL" estimates"""
+    scores = rouge_l_scores(preds, refs)
+    return float(scores.mean()) if len(scores) else 0.0
+
+
+def bootstrap_ci(scores: np.ndarray, boot: int = 1000, conf: float = 0.95, seed: int = 0) -> Tuple[float, float]:
+    """Percentile bootstrap interval of the mean score, resampling an index matrix with a seeded RNG"""
+    n = len(scores)
+    if n == 0:
+        return 0.0, 0.0
+    rng = np.random.default_rng(seed)
+    rows_per_chunk = max(1, BOOTSTRAP_CHUNK_ELEMENTS // n)
+    means = np.empty(boot, dtype=np.float64)
+    for start in range(0, boot, rows_per_chunk):
+        rows = min(rows_per_chunk, boot - start)
+        means[start:start + rows] = scores[rng.integers(0, n, size=(rows, n))].mean(axis=1)
+    lo, hi = np.percentile(means, [(1 - conf) * 50, 100 - (1 - conf) * 50])
+    return float(lo), float(hi)
+
+
+def rouge_ci(preds: Sequence[str], refs: Sequence[str], boot: int = 1000, conf: float = 0.95,
+             seed: int = 0) -> Tuple[float, float]:
+    return bootstrap_ci(rouge_l_scores(preds, refs), boot=boot, conf=conf, seed=seed)
+
+
+def summarize(preds: Sequence[str], refs: Sequence[str], boot: int = 1000, conf: float = 0.95,
+              seed: int = 0) -> Dict:
+    """ROUGE-L with its CI and the average prediction length in words, as printed by the notebook"""
+    scores = rouge_l_scores(preds, refs)
+    lo, hi = bootstrap_ci(scores, boot=boot, conf=conf, seed=seed)
+    return {
+        "rougeL": float(scores.mean()) if len(scores) else 0.0,
+        "ci_low": lo,
+        "ci_high": hi,
+        "avg_len": float(np.mean([len(p.split()) for p in preds])) if len(preds) else 0.0,
+        "n": len(scores)
+    }
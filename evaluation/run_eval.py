@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Parallel, resumable evaluation of GGUF models on the SleepQA test set
+The test questions are sharded across a pool of processes, each with its own Llama instance and an
+equal share of the CPU threads (the weights are memory-mapped, so the processes share them in RAM).
+Predictions are appended to a JSONL file per (model file hash, prompt template, generation
+parameters) as shards finish: an interrupted run picks up where it stopped, and re-scoring a model
+that was already evaluated with the same settings never regenerates anything
+
+    python run_eval.py --model Baseline=models/gemma-3-1b-it.gguf \\
+                       --model SFT_Quantized=models/hypnos-sft-q4_k_m.gguf \\
+                       --model DPO_Quantized=models/hypnos-dpo-q4_k_m.gguf \\
+                       --test-json ../sleepqa_data/sleep-test-enriched-cleaned.json --workers 4
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import signal
+import sys
+import time
+from functools import partial
+from multiprocessing import Pool
+from typing import Dict, List, Tuple
+
+from rouge_eval import summarize
+
+# The question and file hashes every stage keys on live in common/ at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.hashing import file_sha256, question_hash
+
+PROMPT_TEMPLATE = (
+    "<bos><start_of_turn>user\n{question} (Respond in one sentence)"
+    "<end_of_turn>\n<start_of_turn>model\n"
+)
+STOP = ["<end_of_turn>"]
+
+_llm = None  # The worker process's model, loaded once by _init_worker
+
+
+def cached_file_sha256(path: str, cache_dir: str) -> str:
+    """
+    Content hash of a model file. Hashing a multi-GB GGUF takes a while, so the result is remembered
+    for as long as the file's size and modification time are unchanged
+    """
+    index_path = os.path.join(cache_dir, "file_hashes.json")
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    stat = os.stat(path)
+    entry = index.get(os.path.abspath(path))
+    if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+        return entry["sha256"]
+
+    print(f"🔑 Hashing {path}...")
+    sha256 = file_sha256(path)
+    index[os.path.abspath(path)] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256}
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, index_path)
+    return sha256
+
+
+def run_key(model_sha256: str, template: str, params: Dict) -> str:
+    """Everything that determines the predictions; the model file's name and location don't"""
+    payload = json.dumps({"model": model_sha256, "template": template, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class PredictionStore:
+    def __init__(self, run_dir: str, run_info: Dict):
+        """Append-only predictions.jsonl of one run, keyed by question hash, plus run.json describing the run"""
+        os.makedirs(run_dir, exist_ok=True)
+        self.path = os.path.join(run_dir, "predictions.jsonl")
+        with open(os.path.join(run_dir, "run.json"), 'w', encoding='utf-8') as f:
+            json.dump(run_info, f, indent=2)
+        self.predictions = self._load()
+
+    def _load(self) -> Dict[str, str]:
+        predictions = {}
+        if not os.path.exists(self.path):
+            return predictions
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            # A crash can leave a torn last line; cut it so appends start on a fresh line
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                f.truncate(end)
+        for line in data[:end].decode("utf-8").splitlines():
+            if line.strip():
+                record = json.loads(line)
+                predictions[record["question_hash"]] = record["prediction"]
+        return predictions
+
+    def append(self, records: List[Dict]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        for record in records:
+            self.predictions[record["question_hash"]] = record["prediction"]
+
+
+def _init_worker(model_path: str, n_ctx: int, n_threads: int, n_gpu_layers: int):
+    global _llm
+    # Ctrl-C is handled by the parent, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from llama_cpp import Llama
+    _llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, n_gpu_layers=n_gpu_layers, verbose=False)
+
+
+def _generate_shard(shard: List[Tuple[str, str]], template: str, params: Dict) -> List[Dict]:
+    records = []
+    for key, question in shard:
+        start = time.perf_counter()
+        out = _llm(template.format(question=question), max_tokens=params["max_tokens"],
+                   temperature=params["temperature"], stop=params["stop"])
+        records.append({
+            "question_hash": key,
+            "question": question,
+            "prediction": out["choices"][0]["text"].strip(),
+            "seconds": round(time.perf_counter() - start, 3)
+        })
+    return records
+
+
+def generate_missing(label: str, model_path: str, store: PredictionStore, questions: List[str], template: str,
+                     params: Dict, workers: int, threads: int, shard_size: int, n_gpu_layers: int):
+    """Generate predictions for the questions not in the store yet, saving every shard as it finishes"""
+    pending = {}
+    for question in questions:
+        key = question_hash(question)
+        if key not in store.predictions:
+            pending.setdefault(key, question)
+    pending = list(pending.items())
+    if not pending:
+        print(f"♻️ {label}: all {len(questions)} predictions cached")
+        return
+    print(f"🚀 {label}: generating {len(pending)} predictions ({len(store.predictions)} cached)")
+
+    shards = [pending[i:i + shard_size] for i in range(0, len(pending), shard_size)]
+    workers = max(1, min(workers, len(shards)))
+    threads_per_worker = max(1, threads // workers)
+    print(f"⚡ {workers} worker(s) x {threads_per_worker} thread(s)")
+
+    start = time.perf_counter()
+    done = 0
+    pool = Pool(
+        processes=workers,
+        initializer=_init_worker,
+        initargs=(model_path, params["n_ctx"], threads_per_worker, n_gpu_layers)
+    )
+    try:
+        for records in pool.imap_unordered(partial(_generate_shard, template=template, params=params), shards):
+            store.append(records)
+            done += len(records)
+            rate = done / (time.perf_counter() - start)
+            print(f"   {done}/{len(pending)} ({rate:.2f} answers/s) e.g. {records[0]['prediction'][:80]}")
+    except KeyboardInterrupt:
+        # Workers would otherwise carry on with their queued shards
+        pool.terminate()
+        print(f"\n⏸️ Interrupted - {done} new predictions saved to {store.path}, rerun to continue")
+        raise
+    pool.close()
+    pool.join()
+
+
+def parse_model(spec: str) -> Tuple[str, str]:
+    """LABEL=path/to/model.gguf, or just the path (labelled by its file name)"""
+    label, sep, path = spec.partition("=")
+    if not sep:
+        path = spec
+        label = os.path.splitext(os.path.basename(spec))[0]
+    return label, path
+
+
+def write_results(results: List[Dict], output_dir: str):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "results.json"), 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    with open(os.path.join(output_dir, "results.csv"), 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"📋 Results saved to {output_dir}/results.json and results.csv")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate GGUF models on the SleepQA test set with ROUGE-L')
+    parser.add_argument(
+        '--model',
+        action='append',
+        required=True,
+        help='LABEL=path/to/model.gguf (repeatable)'
+    )
+    parser.add_argument(
+        '--test-json',
+        default=os.path.join(os.path.dirname(__file__), '..', 'sleepqa_data', 'sleep-test-enriched-cleaned.json'),
+        help='Test set with question/answer items (default: sleepqa_data/sleep-test-enriched-cleaned.json)'
+    )
+    parser.add_argument(
+        '--subset',
+        type=int,
+        default=0,
+        help='Only evaluate the first N questions (default: 0 = all)'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=2,
+        help='Model processes per GGUF; use 1 when offloading to a GPU (default: 2)'
+    )
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=os.cpu_count() or 4,
+        help='CPU threads split across the workers (default: all cores)'
+    )
+    parser.add_argument(
+        '--shard-size',
+        type=int,
+        default=8,
+        help='Questions per task sent to a worker; predictions are saved after each (default: 8)'
+    )
+    parser.add_argument(
+        '--n-ctx',
+        type=int,
+        default=512,
+        help='Context window (default: 512)'
+    )
+    parser.add_argument(
+        '--n-gpu-layers',
+        type=int,
+        default=0,
+        help='Layers offloaded to the GPU (default: 0)'
+    )
+    parser.add_argument(
+        '--max-tokens',
+        type=int,
+        default=128,
+        help='Maximum tokens per answer (default: 128)'
+    )
+    parser.add_argument(
+        '--temperature',
+        type=float,
+        default=0.0,
+        help='Sampling temperature (default: 0.0, greedy)'
+    )
+    parser.add_argument(
+        '--template-file',
+        help='Prompt template with a {question} placeholder (default: the Gemma chat turn used in training)'
+    )
+    parser.add_argument(
+        '--boot',
+        type=int,
+        default=1000,
+        help='Bootstrap resamples for the ROUGE-L confidence interval (default: 1000)'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Bootstrap seed (default: 0)'
+    )
+    parser.add_argument(
+        '--output-dir',
+        default='eval_runs',
+        help='Where to write results.json and results.csv (default: eval_runs)'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        help='Prediction cache, shareable between output directories (default: <output-dir>/cache)'
+    )
+    args = parser.parse_args()
+
+    template = PROMPT_TEMPLATE
+    if args.template_file:
+        with open(args.template_file, 'r', encoding='utf-8') as f:
+            template = f.read()
+    params = {"max_tokens": args.max_tokens, "temperature": args.temperature, "stop": STOP, "n_ctx": args.n_ctx}
+    cache_dir = args.cache_dir or os.path.join(args.output_dir, "cache")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    with open(args.test_json, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    items = [(d["question"], d["answer"]) for d in data]
+    if args.subset > 0:
+        items = items[:args.subset]
+    questions, references = zip(*items)
+
+    print("\n🧪 GGUF Model Evaluation\n" + "─" * 50)
+    print(f"{len(questions)} test questions\n")
+
+    results = []
+    for label, model_path in map(parse_model, args.model):
+        if not os.path.exists(model_path):
+            print(f"❌ Model file not found: {model_path}")
+            continue
+        model_sha256 = cached_file_sha256(model_path, cache_dir)
+        key = run_key(model_sha256, template, params)
+        store = PredictionStore(os.path.join(cache_dir, key), {
+            "model_path": os.path.abspath(model_path),
+            "model_sha256": model_sha256,
+            "template": template,
+            "params": params
+        })
+        generate_missing(label, model_path, store, list(questions), template, params,
+                         args.workers, args.threads, args.shard_size, args.n_gpu_layers)
+
+        preds = [store.predictions[question_hash(q)] for q in questions]
+        summary = summarize(preds, references, boot=args.boot, seed=args.seed)
+        print(f"\n{label:<12} ROUGE‑L {summary['rougeL']:.4f} "
+              f"[{summary['ci_low']:.4f}, {summary['ci_high']:.4f}]  len={summary['avg_len']:.1f}\n")
+        results.append({"label": label, "model_path": model_path, "run_key": key, **summary})
+
+    if results:
+        write_results(results, args.output_dir)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        raise SystemExit(130)
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from completion_cache import CompletionCache, completion_key
+
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+MAX_REQUESTS_PER_FILE = 50000  # Provider limits per batch input file
+MAX_BYTES_PER_FILE = 190 * 2 ** 20
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def response_content(response: Dict) -> Optional[str]:
+    """The first choice's message text from a batch output line's response, or None if it has none"""
+    choices = (response.get("body") or {}).get("choices") or [None]
+    content = ((choices[0] or {}).get("message") or {}).get("content")
+    return content.strip() if isinstance(content, str) else None
+
+
+class BatchRunner:
+    def __init__(self, openai_client, model_key: str, work_dir: str, poll_seconds: float = 30.0,
+                 completion_window: str = "24h", cache: CompletionCache = None):
+        """
+        Runs chat completions through the provider's Batch API instead of one call per request:
+        requests are written to batch JSONL files, uploaded and submitted, polled until done, and the
+        results are returned by custom_id. Submitted batch ids are kept in work_dir, so rerunning
+        after an interruption picks the same batches up instead of paying for them again.
+        """
+        self.client = openai_client
+        self.model_key = model_key
+        self.work_dir = work_dir
+        self.poll_seconds = poll_seconds
+        self.completion_window = completion_window
+        self.cache = cache
+        os.makedirs(work_dir, exist_ok=True)
+        self.state_path = os.path.join(work_dir, "batches.json")
+
+    def run(self, requests: Iterable[Tuple[str, Dict]]) -> Dict[str, Optional[str]]:
+        """
+        requests yields (custom_id, dict(messages, max_tokens, temperature)) pairs. They are written to the
+        batch files as they come, so only their cache keys are held while the batches run.
+        Returns custom_id -> response text, or None for requests that failed.
+        """
+        results = {}
+        pending = {}  # custom_id -> cache key of the submitted requests
+        paths = self._write_input_files(requests, results, pending)
+        if results:
+            print(f"🗄️ {len(results)} requests answered from the cache")
+        if not pending:
+            return results
+
+        batch_ids = [self._submit(path) for path in paths]
+        batches = self._wait(batch_ids)
+
+        for batch in batches:
+            if batch.status != "completed":
+                print(f"❌ Batch {batch.id} ended as {batch.status}")
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    results.update(self._read_results(file_id, pending))
+
+        failed = [custom_id for custom_id in pending if results.get(custom_id) is None]
+        if failed:
+            print(f"⚠️ {len(failed)} requests failed in the batch, falling back for those items")
+        return results
+
+    def _cache_key(self, request: Dict) -> str:
+        return completion_key(self.model_key, request["messages"], request["temperature"], request["max_tokens"])
+
+    def _write_input_files(self, requests: Iterable[Tuple[str, Dict]], results: Dict[str, Optional[str]],
+                           pending: Dict[str, str]) -> List[str]:
+        """
+        Provider-style batch input: one POST /v1/chat/completions per line, split to stay within file limits.
+        Lines are streamed to disk; each file is named by the hash of its content once it is complete, so a
+        rerun with the same requests finds its submitted batches. Cached requests go straight into results
+        """
+        paths = []
+        tmp_path = os.path.join(self.work_dir, "batch_input.jsonl.tmp")
+        out, digest, n_lines, size = None, None, 0, 0
+
+        def close_file():
+            out.close()
+            path = os.path.join(self.work_dir, f"batch_input_{digest.hexdigest()[:16]}.jsonl")
+            os.replace(tmp_path, path)
+            paths.append(path)
+
+        for custom_id, request in requests:
+            if custom_id in pending or custom_id in results:
+                continue  # A repeated question; custom_ids must be unique within a batch
+            key = self._cache_key(request)
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is not None:
+                results[custom_id] = cached
+                continue
+            pending[custom_id] = key
+
+            line = (json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": CHAT_COMPLETIONS_URL,
+                "body": {"model": self.model_key, **request}
+            }, ensure_ascii=False) + "\n").encode("utf-8")
+            if out is not None and (n_lines >= MAX_REQUESTS_PER_FILE or size + len(line) > MAX_BYTES_PER_FILE):
+                close_file()
+                out = None
+            if out is None:
+                out, digest, n_lines, size = open(tmp_path, 'wb'), hashlib.sha256(), 0, 0
+            out.write(line)
+            digest.update(line)
+            n_lines += 1
+            size += len(line)
+        if out is not None:
+            close_file()
+        if pending:
+            print(f"📝 Wrote {len(pending)} requests to {len(paths)} batch file(s) in {self.work_dir}")
+        return paths
+
+    def _load_state(self) -> Dict[str, str]:
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_state(self, state: Dict[str, str]):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _submit(self, path: str) -> str:
+        """Upload an input file and create its batch, unless the same file was already submitted"""
+        name = os.path.basename(path)
+        state = self._load_state()
+        batch_id = state.get(name)
+        if batch_id:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status not in ("failed", "expired", "cancelled"):
+                print(f"♻️ {name} already submitted as {batch_id} ({batch.status})")
+                return batch_id
+
+        with open(path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=CHAT_COMPLETIONS_URL,
+            completion_window=self.completion_window
+        )
+        state[name] = batch.id
+        self._save_state(state)
+        print(f"📤 Submitted {name} as batch {batch.id}")
+        return batch.id
+
+    def _wait(self, batch_ids: List[str]) -> List:
+        """Poll until every batch reaches a terminal status"""
+        while True:
+            batches = [self.client.batches.retrieve(batch_id) for batch_id in batch_ids]
+            done = [batch for batch in batches if batch.status in TERMINAL_STATUSES]
+            total = sum(batch.request_counts.total for batch in batches if batch.request_counts)
+            completed = sum(batch.request_counts.completed for batch in batches if batch.request_counts)
+            print(f"⏳ {len(done)}/{len(batches)} batches finished, {completed}/{total} requests completed")
+            if len(done) == len(batches):
+                return batches
+            time.sleep(self.poll_seconds)
+
+    def _read_results(self, file_id: str, requests: Dict[str, str]) -> Dict[str, Optional[str]]:
+        """Response text by custom_id from a batch output (or error) file; successes are cached under the request's key"""
+        results = {}
+        text = self.client.files.content(file_id).text
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            custom_id = record.get("custom_id")
+            if custom_id not in requests:
+                continue
+            response = record.get("response") or {}
+            content = response_content(response) if response.get("status_code") == 200 else None
+            if record.get("error") or not content:
+                # Errors, refusals and tool calls without text are left to the caller's fallback
+                results.setdefault(custom_id, None)
+                continue
+            results[custom_id] = content
+            if self.cache is not None:
+                self.cache.put(requests[custom_id], self.model_key, content)
+        return results
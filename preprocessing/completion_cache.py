@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+def completion_key(model_key: str, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+    """Content address of a chat completion request: everything that determines the response"""
+    payload = json.dumps(
+        {"model": model_key, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    def __init__(self, cache_dir: str, max_size_mb: float = 1024):
+        """
+        On-disk cache of chat completion responses in SQLite, keyed by completion_key().
+        Re-running an enrichment with the same prompts, model and parameters costs no API calls.
+        Once the stored responses exceed max_size_mb, the least recently used ones are evicted.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, "completions.sqlite3")
+        self.max_size_bytes = int(max_size_mb * 2 ** 20)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, response TEXT NOT NULL, "
+            "size INTEGER NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_last_access ON completions(last_access)")
+        self._conn.commit()
+        self._size_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model_key: str, response: str):
+        size = len(response.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, response, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_key, response, size, now, now)
+            )
+            self._size_bytes += size - (previous[0] if previous else 0)
+            if self._size_bytes > self.max_size_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            return {
+                "entries": count,
+                "size_mb": round(self._size_bytes / 2 ** 20, 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self):
+        """Delete least recently used responses until the cache is back under 90% of its size limit"""
+        target = self.max_size_bytes * 0.9
+        rows = self._conn.execute("SELECT key, size FROM completions ORDER BY last_access ASC")
+        evicted = []
+        for key, size in rows:
+            if self._size_bytes <= target:
+                break
+            evicted.append((key,))
+            self._size_bytes -= size
+        self._conn.executemany("DELETE FROM completions WHERE key = ?", evicted)
+        self.evictions += len(evicted)
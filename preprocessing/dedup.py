@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate detection for SleepQA datasets with MinHash signatures and a banded LSH index
+Paraphrased questions are found within a split and across splits in roughly linear time; the
+filtered datasets and an overlap report are written next to each other
+
+    # Drop duplicates from the training split and anything that leaks into the test split
+    python dedup.py ../sleepqa_data/sleep-train-enriched.json --against ../sleepqa_data/sleep-test-enriched-cleaned.json
+
+    # Before enrichment, on the raw SleepQA TSV
+    python dedup.py sleep-data.csv --output-dir deduped
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+# LSH candidates are checked against their exact signature similarity, so a false positive only costs a
+# comparison while a false negative is a missed duplicate
+FALSE_POSITIVE_WEIGHT = 0.1
+FALSE_NEGATIVE_WEIGHT = 0.9
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase words only, so punctuation and spacing differences don't count"""
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def shingles(text: str, size: int) -> List[str]:
+    """Character n-grams of the normalized text; questions are too short for word n-grams"""
+    text = normalize_text(text)
+    if len(text) <= size:
+        return [text]
+    return [text[i:i + size] for i in range(len(text) - size + 1)]
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        """num_perm universal hash functions (a * x + b) mod p over 32-bit shingle hashes"""
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        """The minimum of every hash function over the text's shingles (uint32, num_perm values)"""
+        hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in set(shingles(text, self.shingle_size))],
+                          dtype=np.uint64)
+        # uint64 overflow wraps, which only changes which (still universal) hash functions are used
+        permuted = (np.outer(self.a, hashes) + self.b[:, None]) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=1).astype(np.uint32)
+
+
+def signature_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Fraction of equal MinHash values, an unbiased estimate of the shingle sets' Jaccard similarity"""
+    return float(np.mean(a == b))
+
+
+def lsh_params(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    Bands and rows per band (bands * rows <= num_perm) with the least weighted error, as in datasketch:
+    two signatures share a bucket with probability 1 - (1 - s^rows)^bands, integrated below the
+    threshold for false positives and above it for false negatives. Weighting false negatives higher
+    turns the S-curve below the threshold, so pairs right at it are still found
+    """
+    below = np.linspace(0.0, threshold, 201)
+    above = np.linspace(threshold, 1.0, 201)
+
+    def area(x: np.ndarray, y: np.ndarray) -> float:
+        return float(np.sum((y[1:] + y[:-1]) / 2 * np.diff(x)))
+
+    best, best_error = None, None
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            false_positive = area(below, 1 - (1 - below ** rows) ** bands)
+            false_negative = area(above, (1 - above ** rows) ** bands)
+            error = FALSE_POSITIVE_WEIGHT * false_positive + FALSE_NEGATIVE_WEIGHT * false_negative
+            if best_error is None or error < best_error:
+                best, best_error = (bands, rows), error
+    return best
+
+
+class LSHIndex:
+    def __init__(self, num_perm: int, threshold: float):
+        """Banded index of MinHash signatures; only items sharing a band are compared"""
+        self.bands, self.rows = lsh_params(num_perm, threshold)
+        self.threshold = threshold
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = {}
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, key, signature: np.ndarray):
+        self.signatures[key] = signature
+        for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+            bucket.setdefault(band_key, []).append(key)
+
+    def best_match(self, signature: np.ndarray) -> Optional[Tuple[object, float]]:
+        """The most similar indexed key at or above the threshold, with its similarity"""
+        candidates = set()
+        for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(band_key, ()))
+        best = None
+        for key in candidates:
+            similarity = signature_similarity(signature, self.signatures[key])
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (key, similarity)
+        return best
+
+
+def is_json(path: str) -> bool:
+    return path.lower().endswith(".json")
+
+
+def read_dataset(path: str) -> List:
+    """Items of a JSON array (dicts), or the rows of a SleepQA TSV (question, answer)"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if is_json(path):
+            return json.load(f)
+        return [row for row in csv.reader(f, delimiter='\t') if row]
+
+
+def write_dataset(path: str, items: List):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if is_json(path):
+            json.dump(items, f, indent=2, ensure_ascii=False)
+        else:
+            csv.writer(f, delimiter='\t', lineterminator='\n').writerows(items)
+
+
+def item_text(item, field: str) -> str:
+    if isinstance(item, dict):
+        return str(item.get(field) or "")
+    return item[0] if field == "question" else (item[1] if len(item) > 1 else "")
+
+
+def deduplicate(inputs: List[str], against: List[str] = (), field: str = "question", threshold: float = 0.8,
+                num_perm: int = 128, shingle_size: int = 5) -> Tuple[Dict[str, List], Dict]:
+    """
+    Filter each input file in order. An item is dropped if it is a near-duplicate of an item already
+    kept (from the same file or an earlier input) or of any item in the reference files, which are
+    never filtered. Returns (kept items by input path, report)
+    """
+    hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+    index = LSHIndex(num_perm, threshold)
+    texts = {}
+    report = {
+        "params": {"field": field, "threshold": threshold, "num_perm": num_perm, "shingle_size": shingle_size,
+                   "bands": index.bands, "rows": index.rows},
+        "files": {},
+        "duplicates": [],
+        "overlaps": []
+    }
+
+    for path in against:
+        items = read_dataset(path)
+        for i, item in enumerate(items):
+            texts[(path, i)] = item_text(item, field)
+            index.add((path, i), hasher.signature(texts[(path, i)]))
+        report["files"][path] = {"items": len(items), "reference": True}
+        print(f"📚 Indexed {len(items)} reference items from {path}")
+
+    kept_by_path = {}
+    for path in inputs:
+        items = read_dataset(path)
+        kept = []
+        n_duplicates = n_overlaps = 0
+        for i, item in enumerate(items):
+            text = item_text(item, field)
+            signature = hasher.signature(text)
+            match = index.best_match(signature)
+            if match is None:
+                # Only kept items are indexed, so every cluster is represented by its first item
+                texts[(path, i)] = text
+                index.add((path, i), signature)
+                kept.append(item)
+                continue
+
+            (match_path, match_index), similarity = match
+            entry = {
+                "file": path, "index": i, "text": text,
+                "match": {"file": match_path, "index": match_index, "text": texts[(match_path, match_index)]},
+                "similarity": round(similarity, 3)
+            }
+            if match_path == path:
+                report["duplicates"].append(entry)
+                n_duplicates += 1
+            else:
+                report["overlaps"].append(entry)
+                n_overlaps += 1
+
+        kept_by_path[path] = kept
+        report["files"][path] = {"items": len(items), "kept": len(kept), "duplicates": n_duplicates,
+                                 "overlaps": n_overlaps}
+        print(f"🔍 {path}: {len(items)} items, {n_duplicates} near-duplicates within the split, "
+              f"{n_overlaps} overlapping other splits, {len(kept)} kept")
+
+    return kept_by_path, report
+
+
+def dedup_output_path(path: str, output_dir: Optional[str]) -> str:
+    """x.json -> x.dedup.json, in output_dir if given"""
+    stem, ext = os.path.splitext(os.path.basename(path))
+    return os.path.join(output_dir or os.path.dirname(path), f"{stem}.dedup{ext}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find and drop near-duplicate questions in SleepQA datasets')
+    parser.add_argument(
+        'inputs',
+        nargs='+',
+        help='JSON or TSV datasets to filter, in priority order (earlier files keep their items)'
+    )
+    parser.add_argument(
+        '--against',
+        nargs='*',
+        default=[],
+        help='Reference splits (e.g. the test set) that are never filtered; input items overlapping them are dropped'
+    )
+    parser.add_argument(
+        '--field',
+        default='question',
+        help='Field compared between items (default: question)'
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.8,
+        help='Estimated Jaccard similarity of character shingles at which items are duplicates (default: 0.8)'
+    )
+    parser.add_argument(
+        '--num-perm',
+        type=int,
+        default=128,
+        help='MinHash permutations per signature (default: 128)'
+    )
+    parser.add_argument(
+        '--shingle-size',
+        type=int,
+        default=5,
+        help='Characters per shingle (default: 5)'
+    )
+    parser.add_argument(
+        '--output-dir',
+        help='Where to write the filtered datasets and the report (default: next to each input)'
+    )
+    parser.add_argument(
+        '--report',
+        help='Overlap report path (default: dedup_report.json in the output directory)'
+    )
+    args = parser.parse_args()
+
+    kept_by_path, report = deduplicate(args.inputs, args.against, field=args.field, threshold=args.threshold,
+                                       num_perm=args.num_perm, shingle_size=args.shingle_size)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    for path, kept in kept_by_path.items():
+        output_path = dedup_output_path(path, args.output_dir)
+        write_dataset(output_path, kept)
+        report["files"][path]["output"] = output_path
+        print(f"💾 Saved {len(kept)} items to {output_path}")
+
+    report_path = args.report or os.path.join(args.output_dir or os.path.dirname(args.inputs[0]), "dedup_report.json")
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"📋 Report with {len(report['duplicates'])} duplicates and {len(report['overlaps'])} overlaps "
+          f"saved to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
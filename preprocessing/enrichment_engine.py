@@ -0,0 +1,164 @@
+import itertools
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional
+
+import openai
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        """Refills continuously at per_minute / 60 per second, holding at most one minute's worth"""
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0):
+        """Block until amount can be taken. Amounts above the capacity wait for a full bucket"""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                wait = (amount - self.available) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, amount: float):
+        """Give back (negative) or take (positive) tokens once the real cost of a call is known"""
+        with self._lock:
+            self._refill()
+            self.available = min(self.capacity, self.available - amount)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+class RateLimiter:
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        """Requests-per-minute and tokens-per-minute limits (0 = unlimited)"""
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+
+    def acquire(self, estimated_tokens: int):
+        if self.requests is not None:
+            self.requests.acquire()
+        if self.tokens is not None:
+            self.tokens.acquire(estimated_tokens)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        if self.tokens is not None and actual_tokens is not None:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections are worth retrying"""
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """The server's Retry-After (or retry-after-ms) hint, if the error carries one"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # HTTP-date form, fall back to exponential backoff
+        return None
+    return None
+
+
+class EnrichmentEngine:
+    def __init__(self, concurrency: int = 8, rpm: float = 0, tpm: float = 0,
+                 max_retries: int = 6, backoff_seconds: float = 1.0, max_backoff_seconds: float = 60.0):
+        """
+        Runs API calls on a thread pool within request and token rate limits.
+        Retryable failures (429, 5xx, connection errors) are retried with the server's Retry-After
+        or jittered exponential backoff, up to max_retries times.
+        """
+        if max_retries < 0:
+            raise ValueError(f"max_retries must be 0 or more, got {max_retries}")
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rpm, tpm)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="enrich")
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.tokens_used = 0
+
+    def call(self, request: Callable, estimated_tokens: int = 0):
+        """
+        Run request() within the rate limits, retrying retryable errors.
+        The response's usage.total_tokens, if present, corrects the token budget.
+        """
+        # Always at least one attempt; every iteration returns, raises or retries
+        for attempt in itertools.count():
+            self.limiter.acquire(estimated_tokens)
+            try:
+                response = request()
+            except Exception as e:
+                self.limiter.record_usage(estimated_tokens, 0)
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    with self._stats_lock:
+                        self.failures += 1
+                    raise
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt)
+                    delay *= random.uniform(0.5, 1.0)
+                with self._stats_lock:
+                    self.retries += 1
+                print(f"   ⏳ {type(e).__name__}, retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+                continue
+
+            usage = getattr(response, "usage", None)
+            actual_tokens = getattr(usage, "total_tokens", None)
+            self.limiter.record_usage(estimated_tokens, actual_tokens)
+            with self._stats_lock:
+                self.calls += 1
+                self.tokens_used += actual_tokens or 0
+            return response
+
+    def map(self, fn: Callable, items: Iterable) -> Iterator:
+        """
+        Like map(fn, items), running fn concurrently but yielding results in input order.
+        Items are consumed lazily, with at most twice the concurrency in flight.
+        """
+        pending = deque()
+        for item in items:
+            pending.append(self._executor.submit(fn, item))
+            if len(pending) >= 2 * self.concurrency:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def summary(self) -> str:
+        with self._stats_lock:
+            return f"{self.calls} calls, {self.retries} retries, {self.failures} failures, {self.tokens_used} tokens"
+
+    def cancel(self):
+        """Drop calls that haven't started; the ones in flight finish on their own"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
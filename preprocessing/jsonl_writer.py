@@ -0,0 +1,110 @@
+import json
+import os
+import sys
+from typing import Dict, Iterator, List, Set
+
+# The question and file hashes every stage keys on live in common/ at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.hashing import question_hash  # Also imported from here by the enrichers
+
+
+def checkpoint_path_for(output_path: str) -> str:
+    """The JSONL checkpoint written while producing output_path (x.json -> x.jsonl)"""
+    return os.path.splitext(output_path)[0] + ".jsonl"
+
+
+def read_jsonl(path: str) -> Iterator[Dict]:
+    """Records of a JSONL file, skipping a torn last line left by a crash"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def is_failed(record: Dict) -> bool:
+    """Records whose API calls failed are saved with "enriched": false and retried by --resume"""
+    return record.get("enriched") is False
+
+
+def completed_hashes(path: str) -> Set[str]:
+    """Question hashes of the records already in a checkpoint; failed records don't count as done"""
+    if not os.path.exists(path):
+        return set()
+    return {
+        question_hash(record["question"]) for record in read_jsonl(path)
+        if record.get("question") and not is_failed(record)
+    }
+
+
+class JsonlWriter:
+    def __init__(self, path: str):
+        """
+        Append-only JSONL output: one record per line, flushed and fsynced after each batch,
+        so a crash loses at most the batch being written and no earlier output is ever rewritten.
+        """
+        self.path = path
+        self._drop_torn_line()
+        self._file = open(path, 'a', encoding='utf-8')
+        self.written = 0
+
+    def write_batch(self, records: List[Dict]):
+        if not records:
+            return
+        self._file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.written += len(records)
+
+    def close(self):
+        self._file.close()
+
+    def _drop_torn_line(self):
+        """Cut a partial last line (from a crash mid-write) so appended records start on a fresh line"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            f.seek(0)
+            data = f.read()
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def finalize_jsonl(jsonl_path: str, json_path: str) -> int:
+    """
+    Convert a JSONL checkpoint into the JSON array the training notebooks load.
+    Records are streamed, and a question written twice (e.g. by overlapping runs, or a failed item
+    retried by --resume) is kept once: the first successful record, else the last failed one.
+    Returns the number of records written.
+    """
+    # First pass: which record to keep for every question, as (record index, failed)
+    keep = {}
+    for index, record in enumerate(read_jsonl(jsonl_path)):
+        key = question_hash(record.get("question", ""))
+        if key not in keep or keep[key][1]:
+            keep[key] = (index, is_failed(record))
+
+    count = 0
+    tmp_path = json_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as out:
+        out.write("[")
+        for index, record in enumerate(read_jsonl(jsonl_path)):
+            if keep[question_hash(record.get("question", ""))][0] != index:
+                continue
+            out.write(",\n" if count else "\n")
+            out.write("  " + json.dumps(record, indent=2, ensure_ascii=False).replace("\n", "\n  "))
+            count += 1
+        out.write("\n]\n" if count else "]\n")
+    # Replace the old file only once the new one is complete
+    os.replace(tmp_path, json_path)
+    return count
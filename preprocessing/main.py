@@ -6,10 +6,14 @@ Supports both SFT and DPO data generation
 """
 import json
 import os
+import sys
 import argparse
 from dotenv import load_dotenv
 from sleepqa_enricher import SleepQADataEnricher
 from sleepqa_enricher_dpo import SleepQADataEnricherDPO
+from enrichment_engine import EnrichmentEngine
+from jsonl_writer import finalize_jsonl
+from completion_cache import CompletionCache
 
 load_dotenv()
 
@@ -23,10 +27,18 @@ def parse_command_line_arguments():
             # SFT mode (enrich CSV data)
             python main.py --sft --csv sleep-data.csv
             python main.py --sft --csv sleep-data.csv --batch-size 5 --max-items 100
+            python main.py --sft --csv sleep-data.csv --concurrency 16 --rpm 3000 --tpm 250000
             
             # DPO mode (generate chosen/rejected pairs from JSON)
             python main.py --dpo --json enriched-sleep-data.json
             python main.py --dpo --json enriched-sleep-data.json --max-items 50
+            
+            # Batch API mode for large offline jobs (submit, poll, merge by custom_id)
+            python main.py --dpo --json enriched-sleep-data.json --output dpo.json --batch-api
+            
+            # Continue an interrupted run, then (if it never finished) convert its checkpoint
+            python main.py --sft --csv sleep-data.csv --output enriched.json --resume
+            python main.py --finalize enriched.jsonl
                     """
     )
     # python main.py --dpo --json /Users/AdminDK/HYPNOS/data/sleep-train-enriched.json --max-items 5
@@ -44,6 +56,12 @@ def parse_command_line_arguments():
         action='store_true',
         help='DPO mode: generate chosen/rejected response pairs from JSON data'
     )
+    mode_group.add_argument(
+        '--finalize', 
+        type=str, 
+        metavar='JSONL',
+        help='Convert a JSONL checkpoint into the JSON array used for training (no API calls)'
+    )
     
     # Input file arguments
     parser.add_argument(
@@ -72,16 +90,125 @@ def parse_command_line_arguments():
         help='Maximum number of items to process (default: process all items)'
     )
     
-    return parser.parse_args()
+    # Output arguments
+    parser.add_argument(
+        '--output', 
+        type=str, 
+        help='Output JSON path; progress is checkpointed to the same path with .jsonl (default: timestamped file)'
+    )
+    
+    parser.add_argument(
+        '--resume', 
+        action='store_true',
+        help='Continue from the --output checkpoint, skipping items already enriched'
+    )
+    
+    parser.add_argument(
+        '--seed', 
+        type=int, 
+        default=42,
+        help='Seed for --max-items sampling, keep it fixed when resuming (default: 42)'
+    )
+    
+    # Response cache arguments
+    parser.add_argument(
+        '--cache-dir', 
+        type=str, 
+        default=os.getenv('ENRICH_CACHE_DIR'),
+        help='Directory for the on-disk API response cache; identical requests are never paid for twice (default: off)'
+    )
+    
+    parser.add_argument(
+        '--cache-max-mb', 
+        type=float, 
+        default=1024,
+        help='Size limit of the response cache, least recently used responses are evicted (default: 1024)'
+    )
+    
+    # Batch API arguments
+    parser.add_argument(
+        '--batch-api', 
+        action='store_true',
+        help='Submit all requests as a Batch API job instead of individual calls (slower turnaround, cheaper at scale)'
+    )
+    
+    parser.add_argument(
+        '--poll-seconds', 
+        type=float, 
+        default=30,
+        help='Seconds between Batch API status checks (default: 30)'
+    )
+    
+    # API throughput arguments
+    parser.add_argument(
+        '--concurrency', 
+        type=int, 
+        default=8,
+        help='Number of API calls in flight at once (default: 8)'
+    )
+    
+    parser.add_argument(
+        '--rpm', 
+        type=float, 
+        default=500,
+        help='Maximum API requests per minute, 0 for no limit (default: 500)'
+    )
+    
+    parser.add_argument(
+        '--tpm', 
+        type=float, 
+        default=0,
+        help='Maximum API tokens per minute, 0 for no limit (default: 0)'
+    )
+    
+    parser.add_argument(
+        '--max-retries', 
+        type=int, 
+        default=6,
+        help='Retries for rate limited (429) and server (5xx) errors (default: 6)'
+    )
+    
+    parser.add_argument(
+        '--base-url', 
+        type=str, 
+        default=os.getenv('OPENAI_BASE_URL'),
+        help='OpenAI-compatible API base URL, e.g. http://localhost:8089/v1 for mock_openai_server.py'
+    )
+    
+    args = parser.parse_args()
+    if args.max_retries < 0:
+        parser.error("--max-retries must be 0 or more")
+    return args
+
+def finalize_checkpoint(jsonl_path, output_path=None):
+    """Write the JSON array for a checkpoint left by an interrupted run"""
+    if not os.path.exists(jsonl_path):
+        print(f"❌ Checkpoint not found: {jsonl_path}")
+        return
+    
+    output_path = output_path or os.path.splitext(jsonl_path)[0] + ".json"
+    total = finalize_jsonl(jsonl_path, output_path)
+    print(f"✅ Wrote {total} items from {jsonl_path} to {output_path}")
 
 def main():
+    args = parse_command_line_arguments()
+    if args.finalize:
+        finalize_checkpoint(args.finalize, args.output)
+        return
+    
     openai_api_key = os.getenv('OPENAI_API_KEY')
 
     if not openai_api_key:
         print("❌ No OpenAI API key found. Please set OPENAI_API_KEY in your .env file")
         return
 
-    args = parse_command_line_arguments()
+    engine = EnrichmentEngine(
+        concurrency=args.concurrency,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        max_retries=args.max_retries
+    )
+    cache = CompletionCache(args.cache_dir, max_size_mb=args.cache_max_mb) if args.cache_dir else None
     
     if args.sft:
         # SFT mode: enrich CSV data
@@ -89,9 +216,9 @@ def main():
             print("❌ CSV file path required for SFT mode. Use --csv <path>")
             return
     
-    csv_path = args.csv
-    batch_size = args.batch_size
-    max_items = args.max_items
+        csv_path = args.csv
+        batch_size = args.batch_size
+        max_items = args.max_items
     
         if not os.path.exists(csv_path):
             print(f"❌ CSV file not found: {csv_path}")
@@ -103,11 +230,16 @@ def main():
         print(f"   Batch size: {batch_size}")
         print(f"   Max items: {max_items if max_items else 'All items'}")
         
-        enricher = SleepQADataEnricher(openai_api_key=openai_api_key)
+        enricher = SleepQADataEnricher(openai_api_key=openai_api_key, base_url=args.base_url, engine=engine, cache=cache)
         output_path = enricher.enrich_dataset(
             csv_path=csv_path,
+            output_path=args.output,
             max_items=max_items,
-            batch_size=batch_size
+            batch_size=batch_size,
+            resume=args.resume,
+            seed=args.seed,
+            batch_api=args.batch_api,
+            poll_seconds=args.poll_seconds
         )
         
         if output_path and os.path.exists(output_path):
@@ -136,11 +268,16 @@ def main():
         print(f"   JSON file: {json_path}")
         print(f"   Max items: {max_items if max_items else 'All items'}")
         
-        dpo_enricher = SleepQADataEnricherDPO(openai_api_key=openai_api_key)
+        dpo_enricher = SleepQADataEnricherDPO(openai_api_key=openai_api_key, base_url=args.base_url, engine=engine, cache=cache)
         output_path = dpo_enricher.enrich_dataset_dpo(
             json_path=json_path,
+            output_path=args.output,
             max_items=max_items,
-            batch_size=args.batch_size
+            batch_size=args.batch_size,
+            resume=args.resume,
+            seed=args.seed,
+            batch_api=args.batch_api,
+            poll_seconds=args.poll_seconds
         )
         
         if output_path and os.path.exists(output_path):
@@ -153,4 +290,8 @@ def main():
             print(f"   Format: question, chosen, rejected, original_answer")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except KeyboardInterrupt:
+        # The enricher has already saved its progress and printed how to resume
+        sys.exit(130)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI chat completions API, for testing the enrichers without spending API budget.
+Replies are deterministic per request, and rate limit (429) and server (500) errors can be injected
+to exercise the engine's retries:
+
+    python mock_openai_server.py --port 8089 --latency 0.2 --rate-limit-rate 0.1 --error-rate 0.05
+    python main.py --sft --csv sleep-data.csv --base-url http://localhost:8089/v1 --concurrency 16
+
+The Batch API file contract is implemented too (POST /v1/files, POST /v1/batches, GET /v1/batches/{id},
+GET /v1/files/{id}/content); batches complete after --batch-seconds, and --error-rate also fails
+individual batch requests:
+
+    python main.py --dpo --json enriched.json --batch-api --poll-seconds 1 --base-url http://localhost:8089/v1
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_SENTENCES = (
+    "Keeping a regular sleep schedule helps your body clock settle into a steady rhythm.",
+    "Avoiding caffeine in the afternoon makes it easier to fall asleep at night.",
+    "A cool, dark and quiet bedroom supports deeper and more restful sleep.",
+    "Winding down without screens for an hour before bed helps you feel sleepy sooner.",
+    "If you can't sleep after twenty minutes, get up and do something calm until you feel tired."
+)
+
+
+class MockState:
+    def __init__(self, latency: float, error_rate: float, rate_limit_rate: float, retry_after: float, seed: int,
+                 batch_seconds: float = 2.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.batch_seconds = batch_seconds
+        self.files = {}  # file id -> (filename, bytes)
+        self.batches = {}  # batch id -> batch object
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+
+    def draw(self) -> float:
+        with self.lock:
+            self.requests += 1
+            return self.rng.random()
+
+
+def completion_response(body: dict) -> dict:
+    """A chat.completion object whose content only depends on the request messages"""
+    messages = body.get("messages", [])
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+    start = int(digest, 16) % len(_SENTENCES)
+    content = " ".join(_SENTENCES[(start + i) % len(_SENTENCES)] for i in range(2))
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"chatcmpl-mock-{digest[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+
+def run_batch(state: MockState, batch_id: str):
+    """Answer every line of the batch's input file, then mark it completed with an output file"""
+    batch = state.batches[batch_id]
+    batch["status"] = "in_progress"
+    batch["in_progress_at"] = int(time.time())
+    _, content = state.files[batch["input_file_id"]]
+    lines = [json.loads(line) for line in content.decode("utf-8").splitlines() if line.strip()]
+    batch["request_counts"]["total"] = len(lines)
+    time.sleep(state.batch_seconds)
+
+    outputs, errors = [], []
+    for line in lines:
+        if state.draw() < state.error_rate:
+            errors.append({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": line["custom_id"], "response": None,
+                           "error": {"code": "server_error", "message": "Injected failure"}})
+            batch["request_counts"]["failed"] += 1
+            continue
+        outputs.append({
+            "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+            "custom_id": line["custom_id"],
+            "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": completion_response(line["body"])},
+            "error": None
+        })
+        batch["request_counts"]["completed"] += 1
+
+    def store(records, name):
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        state.files[file_id] = (name, "".join(json.dumps(r) + "\n" for r in records).encode("utf-8"))
+        return file_id
+
+    batch["output_file_id"] = store(outputs, f"{batch_id}_output.jsonl") if outputs else None
+    batch["error_file_id"] = store(errors, f"{batch_id}_error.jsonl") if errors else None
+    batch["status"] = "completed"
+    batch["completed_at"] = int(time.time())
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    state: MockState = None
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 3 and parts[:2] == ["v1", "batches"] and parts[2] in self.state.batches:
+            return self._send(200, self.state.batches[parts[2]])
+        if len(parts) == 4 and parts[:2] == ["v1", "files"] and parts[3] == "content" and parts[2] in self.state.files:
+            return self._send_bytes(200, self.state.files[parts[2]][1], "application/jsonl")
+        self._send(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        if self.path.rstrip("/").endswith("/files"):
+            return self._upload_file(raw)
+        try:
+            body = json.loads(raw or b"{}")
+        except ValueError:
+            return self._send(400, {"error": {"message": "Invalid JSON", "type": "invalid_request_error"}})
+
+        if self.path.rstrip("/").endswith("/batches"):
+            return self._create_batch(body)
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+        state = self.state
+        roll = state.draw()
+        if roll < state.rate_limit_rate:
+            with state.lock:
+                state.rate_limited += 1
+            return self._send(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                              {"retry-after": str(state.retry_after)})
+        if roll < state.rate_limit_rate + state.error_rate:
+            with state.lock:
+                state.errors += 1
+            return self._send(500, {"error": {"message": "Internal server error", "type": "server_error"}})
+
+        time.sleep(state.latency)
+        self._send(200, completion_response(body))
+
+    def _upload_file(self, raw: bytes):
+        """multipart/form-data upload with a "file" part and a "purpose" field"""
+        message = BytesParser(policy=default_policy).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8") + raw
+        )
+        filename, content = "upload.jsonl", None
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "file":
+                filename = part.get_filename() or filename
+                content = part.get_payload(decode=True)
+        if content is None:
+            return self._send(400, {"error": {"message": "Missing file", "type": "invalid_request_error"}})
+
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        self.state.files[file_id] = (filename, content)
+        self._send(200, {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                         "filename": filename, "purpose": "batch", "status": "processed"})
+
+    def _create_batch(self, body: dict):
+        if body.get("input_file_id") not in self.state.files:
+            return self._send(400, {"error": {"message": "Unknown input_file_id", "type": "invalid_request_error"}})
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body.get("endpoint"),
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "validating",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0}
+        }
+        self.state.batches[batch_id] = batch
+        threading.Thread(target=run_batch, args=(self.state, batch_id), daemon=True).start()
+        self._send(200, batch)
+
+    def _send(self, status: int, payload: dict, headers: dict = None):
+        self._send_bytes(status, json.dumps(payload).encode("utf-8"), "application/json", headers)
+
+    def _send_bytes(self, status: int, data: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # One line per request would drown the enricher's own output
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock OpenAI chat completions server')
+    parser.add_argument('--port', type=int, default=8089, help='Port to listen on (default: 8089)')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds per successful completion (default: 0.2)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 500 (default: 0)')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of requests answered with 429 (default: 0)')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds sent with 429s (default: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the injected failures (default: 0)')
+    parser.add_argument('--batch-seconds', type=float, default=2.0, help='Time a batch takes to complete (default: 2)')
+    args = parser.parse_args()
+
+    MockHandler.state = MockState(args.latency, args.error_rate, args.rate_limit_rate, args.retry_after, args.seed,
+                                  args.batch_seconds)
+    httpd = ThreadingHTTPServer(("127.0.0.1", args.port), MockHandler)
+    print(f"🧪 Mock OpenAI API on http://127.0.0.1:{args.port}/v1")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        state = MockHandler.state
+        print(f"\n📊 {state.requests} requests, {state.rate_limited} rate limited, {state.errors} errors")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,50 @@
-import pandas as pd
+import csv
 import json
-import time
 import openai
-from typing import List, Dict
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
 import os
 from datetime import datetime
 import random
+from enrichment_engine import EnrichmentEngine
+from completion_cache import CompletionCache, completion_key
+from batch_api import BatchRunner
+from jsonl_writer import JsonlWriter, checkpoint_path_for, completed_hashes, finalize_jsonl, is_failed, question_hash
+from sleepqa_loader import FilteredItems, SleepQACsv, reservoir_sample
 
 class SleepQADataEnricher:
-    def __init__(self, openai_api_key: str, model_key: str = "gpt-3.5-turbo"):
+    def __init__(self, openai_api_key: str, model_key: str = "gpt-3.5-turbo", base_url: str = None,
+                 engine: EnrichmentEngine = None, cache: CompletionCache = None):
         """
         SleeQA Data Enricher using the GPT model
-        Current implementation saves to JSON in batches, for reducing the loading/saving from memory
+        Current implementation appends to a JSONL checkpoint in batches, so no output is ever re-read or rewritten
+        API calls run concurrently through the engine, within its rate limits
+        With a cache, responses to identical requests are reused instead of paid for again
         """
         openai.api_key = openai_api_key
-        self.openai_client = openai.OpenAI(api_key=openai_api_key)
+        # Retries are left to the engine, which backs off according to the rate limits
+        self.openai_client = openai.OpenAI(api_key=openai_api_key, base_url=base_url, max_retries=0)
         self.model_key = model_key
+        self.engine = engine or EnrichmentEngine()
+        self.cache = cache
 
-    def enrich_dataset(self, csv_path: str, output_path: str = None, batch_size: int = 10, max_items: int = None) -> str:
-        """Main function to enrich the entire dataset - memory efficient"""
+    def enrich_dataset(self, csv_path: str, output_path: str = None, batch_size: int = 10, max_items: int = None,
+                       resume: bool = False, seed: int = 42, batch_api: bool = False, poll_seconds: float = 30.0) -> str:
+        """
+        Main function to enrich the entire dataset - memory efficient
+        Results are appended to a JSONL checkpoint next to output_path and converted to the JSON array at the end;
+        with resume, items already in the checkpoint are skipped
+        With batch_api, all requests are submitted as one Batch API job instead of individual calls
+        """
         print("🚀 Starting dataset enrichment...")
         
         data = self._load_sleepqa_csv(csv_path)
+        try:
+            data, n_items = self._sample_items(data, max_items, seed)
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            print(f"❌ Error loading CSV: {e}")
+            return None
         
-        if max_items:
-            if max_items < len(data):
-                data = random.sample(data, max_items)
-                print(f"📝 Randomly sampled {max_items} items from {len(data)} total items")
-            else:
-                print(f"📝 Processing all {len(data)} items (max_items {max_items} >= total items)")
-        
-        if not data:
+        if not n_items:
             print("❌ No data to process")
             return None
         
@@ -38,90 +52,188 @@ class SleepQADataEnricher:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             output_path = f"enriched_sleepqa_{timestamp}.json"
         
-        print(f"📁 Will save to: {output_path}")
+        checkpoint_path = checkpoint_path_for(output_path)
+        pending = self._skip_completed(data, n_items, checkpoint_path, resume)
+        if pending is None:
+            return None
+        data, n_items = pending
         
-        n_batches = (len(data) + batch_size - 1) // batch_size
-        batch_number = 0
+        print(f"📁 Will save to: {output_path} (checkpoint: {checkpoint_path})")
 
-        for i in range(0, len(data), batch_size):
-            batch = data[i:i + batch_size]
-            batch_number += 1
-            print(f"\n📦 Processing batch {batch_number}/{n_batches}")
-
-            enriched_batch = []
-            for j, item in enumerate(batch):
-                item_index = i + j + 1
-                print(f"   Enriching {item_index}/{len(data)}: {item['question'][:50]}...")
-                
-                enriched_answer = self.enrich_answer_with_gpt(
-                    item['question'], 
-                    item['answer']
-                )
-                
-                formatted_item = {
-                    "question": item['question'],
-                    "answer": enriched_answer,
-                    "source": "sleepqa_enriched",
-                    "original_answer": item['answer']  
-                }
-                
-                enriched_batch.append(formatted_item)
-                time.sleep(0.5)  # Rate limiting between API calls
-            
-            # Save the entire batch at once
-            self._append_to_json_file(enriched_batch, output_path)
+        if batch_api:
+            records = self._enrich_with_batch_api(data, output_path, poll_seconds)
+        else:
+            print(f"⚡ Concurrency: {self.engine.concurrency}")
+            # Items are enriched concurrently and come back in order
+            records = self.engine.map(self._enrich_item, data)
+        self._write_checkpoint(records, n_items, checkpoint_path, batch_size, verb="Enriched")
         
+        total = finalize_jsonl(checkpoint_path, output_path)
         print(f"\n✅ Enrichment completed!")
-        print(f"📁 Saved {len(data)} enriched Q&A pairs to {output_path}")
+        self._print_usage()
+        print(f"📁 Saved {total} enriched Q&A pairs to {output_path}")
         print(f"💡 You can now use this file with your dataloader!")
         
         return output_path
- 
 
-    def _load_sleepqa_csv(self, csv_path: str) -> List[Dict]:
+    def _print_usage(self):
+        print(f"📈 API usage: {self.engine.summary()}")
+        if self.cache is not None:
+            stats = self.cache.stats()
+            print(f"🗄️ Cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries ({stats['size_mb']} MB)")
+
+    def _sample_items(self, data: Iterable[Dict], max_items: int, seed: int) -> Tuple[Iterable[Dict], int]:
+        """
+        Seeded reservoir sample of max_items, so a resumed run works through the same subset.
+        data is read in one pass and only the sample is held; without max_items it is passed through as is.
+        Returns (items, number of items)
+        """
+        if max_items:
+            sample, total = reservoir_sample(data, max_items, random.Random(seed))
+            if len(sample) < total:
+                print(f"📝 Randomly sampled {len(sample)} items from {total} total items (seed {seed})")
+            else:
+                print(f"📝 Processing all {total} items")
+            return sample, len(sample)
+        
+        total = len(data) if isinstance(data, list) else sum(1 for _ in data)
+        print(f"📝 Processing all {total} items")
+        return data, total
 
-        print(f"📊 Loading data from {csv_path}...")
+    def _skip_completed(self, data: Iterable[Dict], n_items: int, checkpoint_path: str,
+                        resume: bool) -> Optional[Tuple[Iterable[Dict], int]]:
+        """Items still to do and their count. Returns None if a checkpoint exists and resume wasn't asked for"""
+        if not os.path.exists(checkpoint_path):
+            return data, n_items
+        if not resume:
+            print(f"❌ Checkpoint {checkpoint_path} already exists")
+            print("💡 Use --resume to continue it, or delete it to start over")
+            return None
         
+        done = completed_hashes(checkpoint_path)
+        remaining = FilteredItems(data, lambda item: question_hash(item['question']) not in done)
+        if isinstance(data, list):
+            remaining = list(remaining)
+            n_remaining = len(remaining)
+        else:
+            # Streamed input: count in a separate pass rather than holding the remaining items
+            n_remaining = sum(1 for _ in remaining)
+        print(f"⏩ Resuming: {n_items - n_remaining} items already done, {n_remaining} to go")
+        return remaining, n_remaining
+
+    def _write_checkpoint(self, records: Iterator[Dict], n_items: int, checkpoint_path: str, batch_size: int, verb: str):
+        """Append records to the JSONL checkpoint in batches; on Ctrl-C the finished records are kept"""
+        writer = JsonlWriter(checkpoint_path)
+        n_batches = (n_items + batch_size - 1) // batch_size
+        batch_number = 0
+        batch = []
+        n_failed = 0
         try:
-            df = pd.read_csv(csv_path, sep='\t', header=None, names=['question', 'answer'])
-            print(f"✅ Loaded {len(df)} Q&A pairs")
-            
-            # Parse the answers (remove quotes and brackets)
-            def clean_answer(answer_str):
-                """Clean the answer format from SleepQA CSV"""
-                if pd.isna(answer_str):
-                    return ""
-                
-                answer = str(answer_str).strip()
-                # Remove outer quotes and brackets
-                if answer.startswith('"') and answer.endswith('"'):
-                    answer = answer[1:-1]
-                if answer.startswith('[') and answer.endswith(']'):
-                    answer = answer[1:-1]
-                # Remove inner quotes
-                answer = answer.strip('"').strip("'").strip()
-                return answer
-            
-            df['answer'] = df['answer'].apply(clean_answer)
-            
-            # Convert to list of dicts
-            data = []
-            for _, row in df.iterrows():
-                if row['question'] and row['answer']:  # Skip empty entries
-                    data.append({
-                        'question': row['question'].strip(),
-                        'answer': row['answer'].strip()
-                    })
-            
-            print(f"✅ Processed {len(data)} valid Q&A pairs")
-            return data
-            
-        except Exception as e:
-            print(f"❌ Error loading CSV: {e}")
-            return []
+            for item_index, record in enumerate(records, 1):
+                print(f"   {verb} {item_index}/{n_items}: {record['question'][:50]}...")
+                batch.append(record)
+                n_failed += is_failed(record)
+
+                if len(batch) == batch_size or item_index == n_items:
+                    batch_number += 1
+                    print(f"\n📦 Saving batch {batch_number}/{n_batches}")
+                    # Save the entire batch at once
+                    writer.write_batch(batch)
+                    batch = []
+            # Only non-empty if the input held fewer items than counted up front
+            writer.write_batch(batch)
+        except KeyboardInterrupt:
+            writer.write_batch(batch)
+            self.engine.cancel()
+            print(f"\n⏸️ Interrupted - {writer.written} items saved to {checkpoint_path}, rerun with --resume to continue")
+            raise
+        finally:
+            writer.close()
+        if n_failed:
+            print(f"⚠️ {n_failed} items failed and were saved with fallback answers, rerun with --resume to retry them")
+
+    def _enrich_item(self, item: Dict) -> Dict:
+        enriched_answer = self._complete_or_none(
+            self._enrichment_request(item['question'], item['answer']),
+            "enriching answer"
+        )
+        return self._enriched_record(item, enriched_answer)
+
+    def _enrich_with_batch_api(self, data: Iterable[Dict], output_path: str, poll_seconds: float) -> Iterator[Dict]:
+        """
+        Enrich every item in one Batch API job; items whose request failed keep their original answer.
+        data is streamed twice (it is a list or a re-iterable view): once into the batch files, once to merge the results
+        """
+        requests = (
+            (f"{question_hash(item['question'])}-answer", self._enrichment_request(item['question'], item['answer']))
+            for item in data
+        )
+        results = self._batch_runner(output_path, poll_seconds).run(requests)
+        for item in data:
+            yield self._enriched_record(item, results.get(f"{question_hash(item['question'])}-answer"))
+
+    def _batch_runner(self, output_path: str, poll_seconds: float) -> BatchRunner:
+        # Batch files and submitted batch ids live next to the output, so a rerun finds them
+        work_dir = os.path.splitext(output_path)[0] + "_batches"
+        return BatchRunner(self.openai_client, self.model_key, work_dir, poll_seconds=poll_seconds, cache=self.cache)
+
+    def _enriched_record(self, item: Dict, enriched_answer: Optional[str]) -> Dict:
+        """Without an enriched answer (the call failed), the original one is kept and the record is marked for --resume"""
+        record = {
+            "question": item['question'],
+            "answer": enriched_answer or item['answer'],
+            "source": "sleepqa_enriched",
+            "original_answer": item['answer']  
+        }
+        if not enriched_answer:
+            record["enriched"] = False
+        return record
+
+    def _create_completion(self, messages: List[Dict], max_tokens: int, temperature: float) -> str:
+        """One chat completion, served from the cache or rate limited and retried by the engine"""
+        key = None
+        if self.cache is not None:
+            key = completion_key(self.model_key, messages, temperature, max_tokens)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        # Rough prompt size (~4 characters per token) plus the completion budget
+        estimated_tokens = sum(len(message["content"]) for message in messages) // 4 + max_tokens
+        response = self.engine.call(
+            lambda: self.openai_client.chat.completions.create(
+                model=self.model_key,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature
+            ),
+            estimated_tokens
+        )
+        content = response.choices[0].message.content.strip()
+        if key is not None:
+            self.cache.put(key, self.model_key, content)
+        return content
+
+    def _load_sleepqa_csv(self, csv_path: str) -> SleepQACsv:
+        """Rows are parsed and cleaned lazily on every pass over the file, never loaded as a whole"""
+        print(f"📊 Streaming data from {csv_path}...")
+        return SleepQACsv(csv_path)
     
     def enrich_answer_with_gpt(self, question: str, original_answer: str) -> str:
+        enriched_answer = self._complete_or_none(self._enrichment_request(question, original_answer), "enriching answer")
+        return enriched_answer or original_answer
 
+    def _complete_or_none(self, request: Dict, action: str) -> Optional[str]:
+        """The completion for a request, or None if the call failed"""
+        try:
+            return self._create_completion(**request)
+            
+        except Exception as e:
+            print(f"❌ Error {action}: {e}")
+            return None
+
+    def _enrichment_request(self, question: str, original_answer: str) -> Dict:
+        """Chat completion parameters for enriching one answer"""
         prompt = f"""
                 You are a sleep expert. Given this question and brief answer, provide a full, detailed sentence that expands on the brief answer while keeping the same meaning and accuracy.
 
@@ -131,41 +243,11 @@ class SleepQADataEnricher:
                 Provide a complete, informative sentence that expands on the brief answer:
                 """
         
-        try:
-            response = self.openai_client.chat.completions.create(
-                model=self.model_key,
-                messages=[
-                    {"role": "system", "content": "You are a helpful sleep expert assistant. Provide clear, accurate, and detailed responses."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=200,
-                temperature=0.7
-            )
-            
-            enriched_answer = response.choices[0].message.content.strip()
-            return enriched_answer
-            
-        except Exception as e:
-            print(f"❌ Error enriching answer: {e}")
-            return original_answer
-    
-    def _append_to_json_file(self, new_items: List[Dict], file_path: str):
-        """Append new data to existing JSON file efficiently"""
-        try:
-            # Read existing data
-            if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-            else:
-                existing_data = []
-            
-            # Add new data
-            existing_data.extend(new_items)
-            
-            # Write back to file
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(existing_data, f, indent=2, ensure_ascii=False)
-                
-        except Exception as e:
-            print(f"❌ Error appending to JSON file: {e}")
-    
+        return dict(
+            messages=[
+                {"role": "system", "content": "You are a helpful sleep expert assistant. Provide clear, accurate, and detailed responses."},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=200,
+            temperature=0.7
+        )
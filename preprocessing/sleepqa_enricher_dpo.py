@@ -1,31 +1,33 @@
-from typing import List, Dict
+from typing import Iterator, List, Dict, Optional, Tuple
 import os
 from datetime import datetime
-import random
-import time
 import json
-from openai import OpenAI
 from sleepqa_enricher import SleepQADataEnricher
+from enrichment_engine import EnrichmentEngine
+from completion_cache import CompletionCache
+from jsonl_writer import checkpoint_path_for, finalize_jsonl, question_hash
+
+REJECTED_FALLBACK = "I don't know how to help with that."
 
 
 class SleepQADataEnricherDPO(SleepQADataEnricher):
-    def __init__(self, openai_api_key: str, model_key: str = "gpt-4o-mini"):
+    def __init__(self, openai_api_key: str, model_key: str = "gpt-4o-mini", base_url: str = None,
+                 engine: EnrichmentEngine = None, cache: CompletionCache = None):
         """DPO Data Enricher that generates chosen/rejected response pairs for DPO training"""
-        super().__init__(openai_api_key, model_key)
+        super().__init__(openai_api_key, model_key, base_url=base_url, engine=engine, cache=cache)
 
-    def enrich_dataset_dpo(self, json_path: str, output_path: str = None, batch_size: int = 10, max_items: int = None) -> str:
-        """Main function to enrich JSON dataset for DPO training - memory efficient with batching"""
+    def enrich_dataset_dpo(self, json_path: str, output_path: str = None, batch_size: int = 10, max_items: int = None,
+                           resume: bool = False, seed: int = 42, batch_api: bool = False, poll_seconds: float = 30.0) -> str:
+        """
+        Main function to enrich JSON dataset for DPO training - memory efficient with batching, resumable like enrich_dataset
+        With batch_api, the chosen and rejected requests of all items are submitted as one Batch API job
+        """
         print("🚀 Starting DPO dataset enrichment...")
         
         data = self._load_sleepqa_json(json_path)
+        data, n_items = self._sample_items(data, max_items, seed)
         
-        if max_items and max_items < len(data):
-            data = random.sample(data, max_items)
-            print(f"📝 Randomly sampled {max_items} items from {len(data)} total items")
-        else:
-            print(f"📝 Processing all {len(data)} items")
-        
-        if not data:
+        if not n_items:
             print("❌ No data to process")
             return None
         
@@ -33,49 +35,67 @@ class SleepQADataEnricherDPO(SleepQADataEnricher):
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             output_path = f"dpo_sleepqa_{timestamp}.json"
         
-        print(f"📁 Will save to: {output_path}")
+        checkpoint_path = checkpoint_path_for(output_path)
+        pending = self._skip_completed(data, n_items, checkpoint_path, resume)
+        if pending is None:
+            return None
+        data, n_items = pending
         
-        n_batches = (len(data) + batch_size - 1) // batch_size
-        batch_number = 0
-
-        for i in range(0, len(data), batch_size):
-            batch = data[i:i + batch_size]
-            batch_number += 1
-            print(f"\n📦 Processing batch {batch_number}/{n_batches}")
-
-            dpo_batch = []
-            for j, item in enumerate(batch):
-                item_index = i + j + 1
-                print(f"   Processing {item_index}/{len(data)}: {item['question'][:50]}...")
-                
-                # Set original_answer to current answer
-                original_answer = item['answer']
-                
-                # Generate chosen response (good response)
-                chosen_response = self._generate_chosen_response(item['question'], original_answer)
-                
-                # Generate rejected response (poor response)
-                rejected_response = self._generate_rejected_response(item['question'], original_answer)
-                
-                dpo_item = {
-                    "question": item['question'],
-                    "chosen": chosen_response,
-                    "rejected": rejected_response,
-                    "original_answer": original_answer
-                }
-                
-                dpo_batch.append(dpo_item)
-                time.sleep(0.5)  # Rate limiting between API calls
-            
-            # Save the entire batch at once
-            self._append_to_dpo_json_file(dpo_batch, output_path)
+        print(f"📁 Will save to: {output_path} (checkpoint: {checkpoint_path})")
+
+        if batch_api:
+            records = self._enrich_dpo_with_batch_api(data, output_path, poll_seconds)
+        else:
+            records = self._enrich_dpo_concurrently(data)
+        self._write_checkpoint(records, n_items, checkpoint_path, batch_size, verb="Processed")
         
+        total = finalize_jsonl(checkpoint_path, output_path)
         print(f"\n✅ DPO enrichment completed!")
-        print(f"📁 Saved {len(data)} DPO Q&A pairs to {output_path}")
+        self._print_usage()
+        print(f"📁 Saved {total} DPO Q&A pairs to {output_path}")
         print(f"💡 Ready for DPO training pipeline!")
         
         return output_path
 
+    def _enrich_dpo_concurrently(self, data: List[Dict]) -> Iterator[Dict]:
+        print(f"⚡ Concurrency: {self.engine.concurrency}")
+
+        # The chosen and rejected responses of every item are separate calls, so both run concurrently
+        tasks = ((item, kind) for item in data for kind in ("chosen", "rejected"))
+        responses = self.engine.map(self._generate_dpo_response, tasks)
+
+        # Responses arrive in task order, so each item's chosen response is followed by its rejected one
+        for item, chosen_response, rejected_response in zip(data, responses, responses):
+            yield self._dpo_record(item, chosen_response, rejected_response)
+
+    def _enrich_dpo_with_batch_api(self, data: List[Dict], output_path: str, poll_seconds: float) -> Iterator[Dict]:
+        """Both responses of every item in one Batch API job; failed requests get the same fallbacks as direct calls"""
+        results = self._batch_runner(output_path, poll_seconds).run(self._dpo_batch_requests(data))
+        
+        for item in data:
+            key = question_hash(item['question'])
+            yield self._dpo_record(item, results.get(f"{key}-chosen"), results.get(f"{key}-rejected"))
+
+    def _dpo_batch_requests(self, data: List[Dict]) -> Iterator[Tuple[str, Dict]]:
+        """(custom_id, request) pairs of the chosen and rejected responses, generated as the batch files are written"""
+        for item in data:
+            key = question_hash(item['question'])
+            yield f"{key}-chosen", self._chosen_request(item['question'], item['answer'])
+            yield f"{key}-rejected", self._rejected_request(item['question'], item['answer'])
+
+    def _dpo_record(self, item: Dict, chosen_response: Optional[str], rejected_response: Optional[str]) -> Dict:
+        """A failed response (None) gets its fallback, and the record is marked for --resume"""
+        record = {
+            "question": item['question'],
+            "chosen": chosen_response or item['answer'],
+            "rejected": rejected_response or REJECTED_FALLBACK,
+            # Set original_answer to current answer
+            "original_answer": item['answer']
+        }
+        if not (chosen_response and rejected_response):
+            record["enriched"] = False
+        return record
+
     def _load_sleepqa_json(self, json_path: str) -> List[Dict]:
         """Load data from JSON file"""
         print(f"📊 Loading data from {json_path}...")
@@ -91,8 +111,21 @@ class SleepQADataEnricherDPO(SleepQADataEnricher):
             print(f"❌ Error loading JSON: {e}")
             return []
 
-    def _generate_chosen_response(self, question: str, original_answer: str) -> str:
+    def _generate_dpo_response(self, task) -> Optional[str]:
+        """The chosen or rejected response for an item, or None if the call failed"""
+        item, kind = task
+        if kind == "chosen":
+            # Generate chosen response (good response)
+            return self._generate_chosen_response(item['question'], item['answer'])
+        # Generate rejected response (poor response)
+        return self._generate_rejected_response(item['question'], item['answer'])
+
+    def _generate_chosen_response(self, question: str, original_answer: str) -> Optional[str]:
         """Generate a good, helpful response for DPO training"""
+        return self._complete_or_none(self._chosen_request(question, original_answer), "generating chosen response")
+
+    def _chosen_request(self, question: str, original_answer: str) -> Dict:
+        """Chat completion parameters for the chosen response"""
         prompt = f"""
                 You are a compassionate sleep expert helping someone late at night who is struggling with sleep. 
                 Provide a helpful, emotionally intelligent response that is:
@@ -110,25 +143,21 @@ class SleepQADataEnricherDPO(SleepQADataEnricher):
                 Provide a supportive, helpful response:
                 """
         
-        try:
-            response = self.openai_client.chat.completions.create(
-                model=self.model_key,
-                messages=[
-                    {"role": "system", "content": "You are a caring sleep expert who understands the emotional and physical challenges of sleep problems. Be warm, practical, and supportive. Vary your response style naturally."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=250,
-                temperature=0.9
-            )
-            
-            return response.choices[0].message.content.strip()
-            
-        except Exception as e:
-            print(f"❌ Error generating chosen response: {e}")
-            return original_answer
+        return dict(
+            messages=[
+                {"role": "system", "content": "You are a caring sleep expert who understands the emotional and physical challenges of sleep problems. Be warm, practical, and supportive. Vary your response style naturally."},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=250,
+            temperature=0.9
+        )
 
-    def _generate_rejected_response(self, question: str, original_answer: str) -> str:
+    def _generate_rejected_response(self, question: str, original_answer: str) -> Optional[str]:
         """Generate a poor, unhelpful response for DPO training"""
+        return self._complete_or_none(self._rejected_request(question, original_answer), "generating rejected response")
+
+    def _rejected_request(self, question: str, original_answer: str) -> Dict:
+        """Chat completion parameters for the rejected response"""
         prompt = f"""
             You are a sleep expert, but provide a response that would be considered POOR or UNHELPFUL for someone struggling with sleep late at night. 
             Make it:
@@ -144,40 +173,11 @@ class SleepQADataEnricherDPO(SleepQADataEnricher):
             Provide an unhelpful, poor response:
             """
         
-        try:
-            response = self.openai_client.chat.completions.create(
-                model=self.model_key,
-                messages=[
-                    {"role": "system", "content": "You are a sleep expert providing intentionally poor, unhelpful responses for training purposes. Vary your response style naturally."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=250,
-                temperature=0.9
-            )
-            
-            return response.choices[0].message.content.strip()
-            
-        except Exception as e:
-            print(f"❌ Error generating rejected response: {e}")
-            return "I don't know how to help with that."
-
-    def _append_to_dpo_json_file(self, new_items: List[Dict], file_path: str):
-        """Append new DPO data to existing JSON file efficiently"""
-        try:
-            # Read existing data
-            if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-            else:
-                existing_data = []
-            
-            # Add new data
-            existing_data.extend(new_items)
-            
-            # Write back to file
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(existing_data, f, indent=2, ensure_ascii=False)
-                
-        except Exception as e:
-            print(f"❌ Error appending to DPO JSON file: {e}")
-    
\ No newline at end of file
+        return dict(
+            messages=[
+                {"role": "system", "content": "You are a sleep expert providing intentionally poor, unhelpful responses for training purposes. Vary your response style naturally."},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=250,
+            temperature=0.9
+        )
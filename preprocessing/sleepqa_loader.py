@@ -0,0 +1,74 @@
+import csv
+import random
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+
+def clean_answer(answer_str: str) -> str:
+    """Clean the answer format from SleepQA CSV"""
+    if answer_str is None:
+        return ""
+
+    answer = answer_str.strip()
+    # Remove outer quotes and brackets
+    if answer.startswith('"') and answer.endswith('"'):
+        answer = answer[1:-1]
+    if answer.startswith('[') and answer.endswith(']'):
+        answer = answer[1:-1]
+    # Remove inner quotes
+    answer = answer.strip('"').strip("'").strip()
+    return answer
+
+
+def iter_sleepqa_csv(csv_path: str) -> Iterator[Dict]:
+    """
+    Stream question/answer pairs from a SleepQA TSV (question<TAB>answer, no header), cleaning each
+    row as it is read. Only one row is in memory at a time, whatever the file size.
+    """
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.reader(f, delimiter='\t'):
+            if len(row) < 2:
+                continue
+            question, answer = row[0].strip(), clean_answer(row[1])
+            if question and answer:  # Skip empty entries
+                yield {'question': question, 'answer': answer}
+
+
+class SleepQACsv:
+    def __init__(self, csv_path: str):
+        """Re-iterable view of a SleepQA TSV: each iteration streams the file again"""
+        self.csv_path = csv_path
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter_sleepqa_csv(self.csv_path)
+
+    def count(self) -> int:
+        return sum(1 for _ in self)
+
+
+class FilteredItems:
+    def __init__(self, items: Iterable[Dict], keep: Callable[[Dict], bool]):
+        """Re-iterable view of the items that pass keep; like SleepQACsv, each iteration streams items again"""
+        self.items = items
+        self.keep = keep
+
+    def __iter__(self) -> Iterator[Dict]:
+        return (item for item in self.items if self.keep(item))
+
+
+def reservoir_sample(items: Iterable, k: int, rng: random.Random) -> Tuple[List, int]:
+    """
+    Uniform sample of k items from a stream of unknown length in one pass, holding only k items.
+    Returns (sample in stream order, number of items seen).
+    """
+    reservoir = []  # (position, item)
+    seen = 0
+    for seen, item in enumerate(items, 1):
+        if len(reservoir) < k:
+            reservoir.append((seen, item))
+        else:
+            slot = rng.randrange(seen)
+            if slot < k:
+                reservoir[slot] = (seen, item)
+    # Stream order keeps output files and batches stable for a given seed
+    reservoir.sort(key=lambda entry: entry[0])
+    return [item for _, item in reservoir], seen
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Asyncio serving mode: the same routes and API key checks as server.py, served by Starlette on uvicorn.
+The event loop holds idle and streaming connections cheaply; model work runs on a bounded pool of
+inference threads, so only requests that are generating or queued for a model use an OS thread.
+
+    python asgi.py                     # development
+    gunicorn -c gunicorn.conf.py       # production
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+# Importing the server loads the model in the background, exactly like running server.py
+import server as core
+from model_pool import QueueFullError
+
+# Every model worker (or batch slot) plus the requests allowed to wait for one
+MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', '0')) or max(core.MODEL_WORKERS, core.BATCH_SLOTS) + core.MAX_QUEUE_DEPTH
+
+inference_executor = ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT, thread_name_prefix="inference")
+inference_slots = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+
+
+def error_response(payload, status_code, headers):
+    return JSONResponse(payload, status_code=status_code, headers=headers)
+
+
+def busy_response():
+    return error_response(*core.chat_error(QueueFullError("Server is busy, too many requests in flight")))
+
+
+def unauthorized(request):
+    """401 response for a missing or wrong API key, None if the request is authorized"""
+    error = core.check_api_key(request.headers.get('Authorization'))
+    return JSONResponse({"error": error}, status_code=401) if error else None
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+class EventRelay:
+    def __init__(self, stream, loop):
+        """
+        Runs a ChatStream's blocking event generator on an inference thread and hands the events
+        to the event loop. The inference slot is released once the stream has been closed.
+        """
+        self.stream = stream
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self._stopped = threading.Event()
+
+    def start(self):
+        inference_executor.submit(self._pump)
+
+    def stop(self):
+        """Stop generating - safe to call from the event loop while the pump is running"""
+        self._stopped.set()
+        self.stream.cancel()
+
+    async def events(self):
+        while True:
+            event = await self.queue.get()
+            if event is None:
+                return
+            yield event
+
+    def _pump(self):
+        try:
+            for event in self.stream.events:
+                if self._stopped.is_set():
+                    break
+                self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        finally:
+            # Closing the generator runs its disconnect handling, then the model is freed
+            self.stream.events.close()
+            self.stream.close()
+            inference_slots.release()
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+
+
+class ChatStreamResponse(StreamingResponse):
+    def __init__(self, relay: EventRelay):
+        """SSE response that stops generation however it ends, including a client disconnect"""
+        super().__init__(relay.events(), media_type="text/event-stream", headers=core.SSE_HEADERS)
+        self.relay = relay
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.relay.stop()
+
+
+def complete_chat(data, endpoint):
+    """Runs on an inference thread: the whole /chat request, errors included"""
+    chat = None
+    try:
+        chat = core.parse_chat_request(data, endpoint)
+        return JSONResponse(core.complete_chat(chat))
+    except Exception as e:
+        return error_response(*core.chat_error(e, chat))
+
+
+def open_chat_stream(data, endpoint):
+    """Runs on an inference thread: admits the request, returns (stream, None) or (None, error response)"""
+    chat = None
+    try:
+        chat = core.parse_chat_request(data, endpoint)
+        return core.open_chat_stream(chat), None
+    except Exception as e:
+        return None, error_response(*core.chat_error(e, chat))
+
+
+def discard_stream(future):
+    if not future.cancelled() and future.exception() is None:
+        stream, _ = future.result()
+        if stream is not None:
+            stream.close()
+    inference_slots.release()
+
+
+async def stream_chat(data, endpoint):
+    if not inference_slots.acquire(blocking=False):
+        return busy_response()
+
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(inference_executor, open_chat_stream, data, endpoint)
+    try:
+        stream, error = await asyncio.shield(future)
+    except asyncio.CancelledError:
+        # The client left while waiting for admission - free the model once the request gets one
+        future.add_done_callback(discard_stream)
+        raise
+    if error is not None:
+        inference_slots.release()
+        return error
+
+    # The relay owns the inference slot from here on
+    relay = EventRelay(stream, loop)
+    relay.start()
+    return ChatStreamResponse(relay)
+
+
+async def chat_endpoint(request):
+    denied = unauthorized(request)
+    if denied:
+        return denied
+
+    data = await read_json(request)
+    if data and data.get("stream"):
+        return await stream_chat(data, "/chat")
+
+    if not inference_slots.acquire(blocking=False):
+        return busy_response()
+    # The slot is held until the inference thread is done, even if the client disconnects first
+    future = asyncio.get_running_loop().run_in_executor(inference_executor, complete_chat, data, "/chat")
+    future.add_done_callback(lambda _: inference_slots.release())
+    return await asyncio.shield(future)
+
+
+async def chat_stream_endpoint(request):
+    """Same as /chat with "stream": true - tokens are sent as Server-Sent Events"""
+    denied = unauthorized(request)
+    if denied:
+        return denied
+    return await stream_chat(await read_json(request), "/chat/stream")
+
+
+async def health_check(request):
+    return JSONResponse(core.health_status())
+
+
+async def liveness_check(request):
+    payload, status_code = core.liveness_status()
+    return JSONResponse(payload, status_code=status_code)
+
+
+async def readiness_check(request):
+    payload, status_code = core.readiness_status()
+    return JSONResponse(payload, status_code=status_code)
+
+
+async def metrics_endpoint(request):
+    return PlainTextResponse(core.metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
+async def process_image(request):
+    denied = unauthorized(request)
+    if denied:
+        return denied
+    payload, status_code = core.image_processing_status()
+    return JSONResponse(payload, status_code=status_code)
+
+
+async def list_models(request):
+    denied = unauthorized(request)
+    if denied:
+        return denied
+    return JSONResponse(core.model_registry.stats())
+
+
+async def swap_model(request):
+    denied = unauthorized(request)
+    if denied:
+        return denied
+    data = await read_json(request) or {}
+    # Loading a model takes a while; requests keep being served meanwhile
+    payload, status_code = await run_in_threadpool(core.swap_model, data)
+    return JSONResponse(payload, status_code=status_code)
+
+
+async def reset_conversation(request):
+    denied = unauthorized(request)
+    if denied:
+        return denied
+    data = await read_json(request) or {}
+    # The session store may be SQLite, keep it off the event loop
+    return JSONResponse(await run_in_threadpool(core.reset_session, data))
+
+
+async def web_interface(request):
+    try:
+        return HTMLResponse(core.render_web_interface())
+    except FileNotFoundError:
+        return Response("Web interface file not found", status_code=404)
+
+
+app = Starlette(
+    routes=[
+        Route('/health', health_check, methods=['GET']),
+        Route('/livez', liveness_check, methods=['GET']),
+        Route('/readyz', readiness_check, methods=['GET']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+        Route('/chat', chat_endpoint, methods=['POST']),
+        Route('/chat/stream', chat_stream_endpoint, methods=['POST']),
+        Route('/process_image', process_image, methods=['POST']),
+        Route('/models', list_models, methods=['GET']),
+        Route('/models/swap', swap_model, methods=['POST']),
+        Route('/reset', reset_conversation, methods=['POST']),
+        Route('/', web_interface, methods=['GET'])
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])]
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.getenv('PORT', 3001))
+    print(f"📡 Port: {port} (asyncio mode)")
+    print(f"🔗 Server URL: http://{core.get_local_ip()}:{port}")
+    uvicorn.run(app, host='0.0.0.0', port=port)
@@ -0,0 +1,391 @@
+import codecs
+import heapq
+import itertools
+import math
+import queue
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import llama_cpp
+import numpy as np
+
+from model_pool import PRIORITY_INTERACTIVE, QueueFullError, QueueTimeoutError, DeadlineExceededError
+
+_FINISHED = object()
+
+
+def _memory_function(name):
+    """
+    KV cache sequence helpers were renamed across llama.cpp versions
+    (llama_kv_cache_* -> llama_kv_self_* -> llama_memory_*); resolve whichever this build has.
+    """
+    memory_fn = getattr(llama_cpp, f"llama_memory_{name}", None)
+    if memory_fn is not None and hasattr(llama_cpp, "llama_get_memory"):
+        return lambda ctx, *args: memory_fn(llama_cpp.llama_get_memory(ctx), *args)
+    for prefix in ("llama_kv_self_", "llama_kv_cache_"):
+        fn = getattr(llama_cpp, prefix + name, None)
+        if fn is not None:
+            return fn
+    raise RuntimeError(f"llama_cpp does not provide a KV cache '{name}' function")
+
+
+class BatchRequest:
+    def __init__(self, prompt_tokens: List[int], max_tokens: int, temperature: float, deadline: float, priority: int):
+        """
+        A generation request handled by the BatchEngine.
+        Iterating yields the reply text piece by piece as the engine decodes it.
+        """
+        self.prompt_tokens = list(prompt_tokens)
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.deadline = deadline
+        self.priority = priority
+        self.completion_tokens = 0
+        self.usage = {}
+        # Timings (perf_counter) for the request metrics
+        self.submitted_at = time.perf_counter()
+        self.admitted_at = None
+        self.queue_seconds = 0.0
+        self.prompt_eval_tokens = None
+        self.prompt_eval_seconds = None
+        self.first_token_at = None
+        self._pieces = queue.Queue()
+        self._cancel_event = threading.Event()
+
+    def __iter__(self):
+        while True:
+            timeout = None if self.deadline == math.inf else max(self.deadline - time.time(), 0.001)
+            try:
+                item = self._pieces.get(timeout=timeout)
+            except queue.Empty:
+                self.cancel()
+                if self.admitted_at is None:
+                    # Never got a slot: an overload, reported like the engine's own queue timeout
+                    raise QueueTimeoutError("Request timed out waiting for a batch slot")
+                raise DeadlineExceededError("Request deadline exceeded")
+            if item is _FINISHED:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def cancel(self):
+        """Stop generating; the engine frees the request's sequence on its next step"""
+        self._cancel_event.set()
+
+    def close(self):
+        self.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def _emit(self, item):
+        self._pieces.put(item)
+
+    def _finish(self, error: Exception = None):
+        if error is None:
+            n_prompt = len(self.prompt_tokens)
+            self.usage.update({
+                "prompt_tokens": n_prompt,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": n_prompt + self.completion_tokens
+            })
+        self._emit(error if error is not None else _FINISHED)
+
+
+class _Slot:
+    def __init__(self, seq_id: int):
+        self.seq_id = seq_id
+        self.request = None
+        self.pending = []  # tokens not yet evaluated for this sequence
+        self.generated = []  # tokens sampled for the current request
+        self.n_past = 0
+        self.decoder = None
+
+
+class BatchEngine:
+    def __init__(self, model, n_slots: int = 4, slot_ctx: int = 2048, n_batch: int = 512,
+                 n_threads: int = None, prefix_tokens: List[int] = None, stop_tokens: List[int] = None,
+                 max_queue_depth: int = 16):
+        """
+        Continuous batching on top of a loaded Llama model.
+        Concurrent requests get their own sequence id in one shared llama context and are decoded
+        together in a single llama_decode call per step; new requests join as soon as a slot frees up.
+        Sequence 0 holds the system prompt prefix, which is copied into new sequences instead of being re-evaluated.
+        """
+        self.model = model
+        self.n_slots = n_slots
+        self.n_batch = n_batch
+        self.max_queue_depth = max_queue_depth
+        self.prefix_tokens = list(prefix_tokens or [])
+        self.stop_tokens = set(stop_tokens or []) | {model.token_eos()}
+        self.n_vocab = model.n_vocab()
+        self._rng = np.random.default_rng()
+
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = n_slots * slot_ctx + len(self.prefix_tokens)
+        params.n_batch = n_batch
+        params.n_ubatch = n_batch
+        params.n_seq_max = n_slots + 1
+        if n_threads:
+            params.n_threads = n_threads
+            params.n_threads_batch = n_threads
+        new_context = getattr(llama_cpp, "llama_init_from_model", None) or llama_cpp.llama_new_context_with_model
+        self._ctx = new_context(model.model, params)
+        if not self._ctx:
+            raise RuntimeError("Failed to create the batching llama context")
+        self._batch = llama_cpp.llama_batch_init(n_batch, 0, n_slots + 1)
+        self._seq_rm = _memory_function("seq_rm")
+        self._seq_cp = _memory_function("seq_cp")
+
+        self._slots = [_Slot(seq_id) for seq_id in range(1, n_slots + 1)]
+        self._queue = []  # heap of (priority, sequence, request)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+        self.steps = 0
+        self.batched_tokens = 0
+        self.generated_tokens = 0
+        self.finished = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._busy_seconds = 0.0
+        self._started_at = time.time()
+
+        if self.prefix_tokens:
+            self._eval_prefix()
+
+        self._thread = threading.Thread(target=self._run, name="batch-engine", daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt_tokens: List[int], max_tokens: int, temperature: float = 0.7,
+               deadline: float = None, priority: int = PRIORITY_INTERACTIVE) -> BatchRequest:
+        """Queue a request. Raises QueueFullError when the waiting queue is at its maximum depth"""
+        request = BatchRequest(prompt_tokens, max_tokens, temperature, deadline or math.inf, priority)
+        with self._cond:
+            has_free_slot = any(slot.request is None for slot in self._slots)
+            if (not has_free_slot or self._queue) and len(self._queue) >= self.max_queue_depth:
+                self.rejected += 1
+                raise QueueFullError("Server is busy, request queue is full")
+            heapq.heappush(self._queue, (priority, next(self._sequence), request))
+            self._cond.notify()
+        return request
+
+    def retry_after_seconds(self) -> int:
+        with self._cond:
+            waiting = len(self._queue)
+            busy_seconds, finished = self._busy_seconds, self.finished
+        # Slots are busy in parallel, so one slot turns over every busy * n_slots / finished seconds
+        per_request = busy_seconds * self.n_slots / finished if finished else 5.0
+        return max(1, math.ceil(per_request * (waiting + 1) / self.n_slots))
+
+    def stats(self) -> Dict:
+        # The engine thread only changes slots and counters under _cond, so this is a consistent snapshot
+        with self._cond:
+            uptime = max(time.time() - self._started_at, 1e-9)
+            return {
+                "slots": self.n_slots,
+                "active_slots": sum(1 for slot in self._slots if slot.request is not None),
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self.max_queue_depth,
+                "steps": self.steps,
+                "avg_batch_tokens": round(self.batched_tokens / self.steps, 2) if self.steps else 0.0,
+                "generated_tokens": self.generated_tokens,
+                "utilisation": round(self._busy_seconds / uptime, 4),
+                "rejected": self.rejected,
+                "timed_out": self.timed_out
+            }
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+        llama_cpp.llama_batch_free(self._batch)
+        llama_cpp.llama_free(self._ctx)
+
+    # ---- engine thread ----
+
+    def _eval_prefix(self):
+        for start in range(0, len(self.prefix_tokens), self.n_batch):
+            chunk = self.prefix_tokens[start:start + self.n_batch]
+            self._batch.n_tokens = 0
+            for i, token in enumerate(chunk):
+                self._add_to_batch(token, start + i, 0, False)
+            if llama_cpp.llama_decode(self._ctx, self._batch) != 0:
+                raise RuntimeError("Failed to evaluate the prompt prefix")
+
+    def _run(self):
+        while True:
+            if not self._admit():
+                return
+
+            active = [slot for slot in self._slots if slot.request is not None]
+            self._drop_stopped(active)
+            active = [slot for slot in active if slot.request is not None]
+            if not active:
+                continue
+
+            started = time.time()
+            n_tokens, n_generated = self._step(active)
+            with self._cond:
+                self._busy_seconds += time.time() - started
+                if n_tokens:
+                    self.steps += 1
+                    self.batched_tokens += n_tokens
+                    self.generated_tokens += n_generated
+
+    def _admit(self) -> bool:
+        """Move queued requests into free slots. Blocks while there is nothing to do"""
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return False
+                now = time.time()
+                free_slots = [slot for slot in self._slots if slot.request is None]
+                while self._queue and free_slots:
+                    _, _, request = heapq.heappop(self._queue)
+                    if request.cancelled:
+                        request._finish()
+                        continue
+                    if now > request.deadline:
+                        self.timed_out += 1
+                        request._finish(QueueTimeoutError("Request timed out waiting for a batch slot"))
+                        continue
+                    self._start(free_slots.pop(), request)
+                if len(free_slots) < self.n_slots:
+                    return True
+                self._cond.wait()
+
+    def _start(self, slot: _Slot, request: BatchRequest):
+        self._seq_rm(self._ctx, slot.seq_id, -1, -1)
+        prompt = request.prompt_tokens
+        n_prefix = len(self.prefix_tokens)
+        if n_prefix and len(prompt) > n_prefix and prompt[:n_prefix] == self.prefix_tokens:
+            # Share the already evaluated system prompt instead of processing it again
+            self._seq_cp(self._ctx, 0, slot.seq_id, -1, -1)
+            slot.pending = prompt[n_prefix:]
+            slot.n_past = n_prefix
+        else:
+            slot.pending = list(prompt)
+            slot.n_past = 0
+        slot.generated = []
+        slot.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        slot.request = request
+
+        request.admitted_at = time.perf_counter()
+        request.queue_seconds = request.admitted_at - request.submitted_at
+        request.prompt_eval_tokens = len(slot.pending)
+
+    def _drop_stopped(self, active: List[_Slot]):
+        now = time.time()
+        for slot in active:
+            request = slot.request
+            if request.cancelled:
+                self._free(slot)
+                request._finish()
+            elif now > request.deadline:
+                self._free(slot)
+                request._finish(DeadlineExceededError("Request deadline exceeded during generation"))
+
+    def _step(self, active: List[_Slot]) -> Tuple[int, int]:
+        """One llama_decode over the active sequences; returns (tokens evaluated, tokens generated)"""
+        # Decoding sequences (one pending token) go first so streams keep flowing while prompts are prefilled
+        active.sort(key=lambda slot: len(slot.pending))
+        self._batch.n_tokens = 0
+        sample_at = []  # (slot, batch index) pairs whose logits are needed
+        budget = self.n_batch
+        for slot in active:
+            if budget == 0:
+                break
+            take = min(len(slot.pending), budget)
+            for i in range(take):
+                is_last = i == take - 1 and take == len(slot.pending)
+                self._add_to_batch(slot.pending[i], slot.n_past + i, slot.seq_id, is_last)
+                if is_last:
+                    sample_at.append((slot, self._batch.n_tokens - 1))
+            slot.pending = slot.pending[take:]
+            slot.n_past += take
+            budget -= take
+
+        n_tokens = self._batch.n_tokens
+        if llama_cpp.llama_decode(self._ctx, self._batch) != 0:
+            self._recover_from_decode_failure(active)
+            return 0, 0
+
+        n_generated = sum(self._sample_next(slot, index) for slot, index in sample_at)
+        return n_tokens, n_generated
+
+    def _sample_next(self, slot: _Slot, index: int) -> bool:
+        """Sample the slot's next token; True if it was a reply token rather than a stop"""
+        request = slot.request
+        logits = np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(self._ctx, index), shape=(self.n_vocab,))
+        token = self._sample(logits, request.temperature)
+        if request.first_token_at is None:
+            request.first_token_at = time.perf_counter()
+            request.prompt_eval_seconds = request.first_token_at - request.admitted_at
+
+        if token in self.stop_tokens:
+            self._free(slot)
+            request._finish()
+            return False
+
+        request.completion_tokens += 1
+        slot.generated.append(token)
+        text = slot.decoder.decode(self.model.detokenize([token]))
+        if text:
+            request._emit(text)
+
+        if request.completion_tokens >= request.max_tokens:
+            self._free(slot)
+            request._finish()
+        else:
+            slot.pending = [token]
+        return True
+
+    def _sample(self, logits: np.ndarray, temperature: float, top_k: int = 40, top_p: float = 0.95) -> int:
+        if temperature <= 0:
+            return int(np.argmax(logits))
+        top = np.argpartition(logits, -top_k)[-top_k:]
+        top = top[np.argsort(logits[top])[::-1]]
+        scaled = logits[top].astype(np.float64) / temperature
+        probs = np.exp(scaled - scaled.max())
+        probs /= probs.sum()
+        keep = int(np.searchsorted(np.cumsum(probs), top_p)) + 1
+        probs = probs[:keep] / probs[:keep].sum()
+        return int(top[self._rng.choice(keep, p=probs)])
+
+    def _recover_from_decode_failure(self, active: List[_Slot]):
+        # Usually the KV cache is full: drop the request that needs the most space and retry the rest
+        victim = max(active, key=lambda slot: slot.n_past + len(slot.pending))
+        request = victim.request
+        self._free(victim)
+        request._finish(RuntimeError("Not enough context space to continue this request"))
+        for slot in active:
+            if slot.request is not None:
+                # Positions were already advanced for the failed batch, so replay the sequence from scratch
+                self._seq_rm(self._ctx, slot.seq_id, -1, -1)
+                slot.pending = slot.request.prompt_tokens + slot.generated
+                slot.n_past = 0
+
+    def _free(self, slot: _Slot):
+        self._seq_rm(self._ctx, slot.seq_id, -1, -1)
+        with self._cond:
+            self.finished += 1
+            slot.request = None
+            slot.pending = []
+            slot.generated = []
+            slot.n_past = 0
+            self._cond.notify()
+
+    def _add_to_batch(self, token: int, pos: int, seq_id: int, logits: bool):
+        i = self._batch.n_tokens
+        self._batch.token[i] = token
+        self._batch.pos[i] = pos
+        self._batch.n_seq_id[i] = 1
+        self._batch.seq_id[i][0] = seq_id
+        self._batch.logits[i] = logits
+        self._batch.n_tokens = i + 1
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Load test for the chat server: replays multi-turn SleepQA conversations at increasing concurrency
+and reports latency percentiles, time-to-first-token and throughput.
+
+By default the server is started in-process with the fake model from fake_llama.py, so the Flask layer,
+queueing, truncation and JSON handling can be measured without a GGUF file:
+
+    python benchmark.py --concurrency 1,4,16 --requests 200
+    FAKE_LLAMA_TOKEN_DELAY=0.05 python benchmark.py --mode session
+
+Point it at a running server to benchmark a real model:
+
+    python benchmark.py --url http://localhost:3001 --api-key $API_KEY
+"""
+import argparse
+import glob
+import http.client
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+DEFAULT_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sleepqa_data', '*.json')
+
+
+def load_questions(pattern: str) -> List[str]:
+    questions = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, 'r', encoding='utf-8') as f:
+            for item in json.load(f):
+                question = item.get("question") or item.get("prompt")
+                if question:
+                    questions.append(question.strip())
+    if not questions:
+        raise SystemExit(f"❌ No questions found in {pattern}")
+    return questions
+
+
+def build_sessions(questions: List[str], n_sessions: int, max_turns: int, seed: int) -> List[List[str]]:
+    """Conversations of 1..max_turns questions, so histories grow over a session"""
+    rng = random.Random(seed)
+    return [rng.sample(questions, rng.randint(1, max_turns)) for _ in range(n_sessions)]
+
+
+def start_local_server(port: int):
+    """
+    Import the server with the fake model in place of llama_cpp and serve it on a background thread.
+    Returns the base URL and the server's API key.
+    """
+    server_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, server_dir)
+    import fake_llama
+    sys.modules["llama_cpp"] = fake_llama
+
+    os.environ.setdefault("LOCAL_MODEL_PATH", "fake-model.gguf")
+    os.environ["BATCH_SLOTS"] = "0"  # the batching engine needs the low-level llama.cpp API
+
+    import server
+    from werkzeug.serving import make_server
+
+    server.model_thread.join()
+    if not server.server_ready():
+        raise SystemExit("❌ Fake model failed to initialize")
+
+    # Per-request access logs would drown the results
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    httpd = make_server("127.0.0.1", port, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    print(f"🧪 In-process server with fake model on port {port} "
+          f"({fake_llama.TOKEN_DELAY * 1000:.0f} ms/token, {server.MODEL_WORKERS} worker(s))")
+    return f"http://127.0.0.1:{port}", server.API_KEY
+
+
+class ChatClient:
+    def __init__(self, base_url: str, api_key: str, stream: bool, timeout: float):
+        parsed = urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.https = parsed.scheme == "https"
+        self.api_key = api_key
+        self.stream = stream
+        self.timeout = timeout
+
+    def send(self, payload: Dict) -> Dict:
+        """Send one chat request; returns the parsed reply plus latency, ttft and status"""
+        connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        connection = connection_class(self.host, self.port, timeout=self.timeout)
+        path = "/chat/stream" if self.stream else "/chat"
+        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"}
+
+        started = time.perf_counter()
+        try:
+            connection.request("POST", path, body=json.dumps(payload), headers=headers)
+            response = connection.getresponse()
+            if response.status != 200 or not self.stream:
+                body = response.read()
+                latency = time.perf_counter() - started
+                result = json.loads(body) if body else {}
+                return {"status": response.status, "latency": latency, "ttft": None, "result": result}
+
+            ttft, result, status = None, {}, 200
+            for raw_line in response:
+                line = raw_line.decode("utf-8").strip()
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: "):])
+                if event["type"] == "token" and ttft is None:
+                    ttft = time.perf_counter() - started
+                elif event["type"] == "done":
+                    result = event
+                elif event["type"] == "error":
+                    status, result = 500, event
+            return {"status": status, "latency": time.perf_counter() - started, "ttft": ttft, "result": result}
+        except (OSError, http.client.HTTPException) as e:
+            return {"status": 0, "latency": time.perf_counter() - started, "ttft": None, "result": {"error": str(e)}}
+        finally:
+            connection.close()
+
+
+def run_level(client: ChatClient, sessions: List[List[str]], concurrency: int, n_requests: int, mode: str) -> Dict:
+    """Run n_requests across `concurrency` clients, each replaying whole conversations"""
+    samples = []
+    lock = threading.Lock()
+    session_numbers = itertools.count()
+    sent = [0]
+
+    def take_request() -> bool:
+        with lock:
+            if sent[0] >= n_requests:
+                return False
+            sent[0] += 1
+            return True
+
+    def worker():
+        while True:
+            with lock:
+                session = sessions[next(session_numbers) % len(sessions)]
+            history, session_id = [], None
+            for question in session:
+                if not take_request():
+                    return
+                payload = {"message": question}
+                if mode == "session":
+                    payload["session_id"] = session_id
+                else:
+                    payload["history"] = history
+                sample = client.send(payload)
+                with lock:
+                    samples.append(sample)
+                if sample["status"] != 200:
+                    break
+                result = sample["result"]
+                if mode == "session":
+                    session_id = result.get("session_id")
+                else:
+                    history = result.get("history", history)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    ok = [s for s in samples if s["status"] == 200]
+    latencies = [s["latency"] for s in ok]
+    ttfts = [s["ttft"] for s in ok if s["ttft"] is not None]
+    return {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "status_counts": {str(code): sum(1 for s in samples if s["status"] == code) for code in {s["status"] for s in samples}},
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(ok) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "ttft_p50": percentile(ttfts, 50),
+        "ttft_p95": percentile(ttfts, 95),
+        "ttft_p99": percentile(ttfts, 99)
+    }
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile, in seconds rounded to the millisecond"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+    return round(ordered[rank], 4)
+
+
+def print_table(results: List[Dict]):
+    def ms(value):
+        return f"{value * 1000:8.0f}" if value is not None else "       -"
+
+    print("\n conc |  reqs | err |  req/s |  p50 ms |  p95 ms |  p99 ms | ttft p50 | ttft p95 | ttft p99")
+    print("------+-------+-----+--------+---------+---------+---------+----------+----------+---------")
+    for r in results:
+        print(f" {r['concurrency']:4d} | {r['requests']:5d} | {r['errors']:3d} | {r['requests_per_second']:6.2f} |"
+              f" {ms(r['latency_p50'])}| {ms(r['latency_p95'])}| {ms(r['latency_p99'])}|"
+              f"  {ms(r['ttft_p50'])}|  {ms(r['ttft_p95'])}|  {ms(r['ttft_p99'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Hypnos chat server')
+    parser.add_argument('--url', help='Benchmark a running server instead of the in-process fake model')
+    parser.add_argument('--api-key', default=os.getenv('API_KEY', ''), help='API key for --url (default: $API_KEY)')
+    parser.add_argument('--port', type=int, default=3099, help='Port for the in-process server (default: 3099)')
+    parser.add_argument('--data', default=DEFAULT_DATA, help='Glob of SleepQA JSON files to take questions from')
+    parser.add_argument('--concurrency', default='1,2,4,8,16', help='Comma separated concurrency levels (default: 1,2,4,8,16)')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per concurrency level (default: 100)')
+    parser.add_argument('--max-turns', type=int, default=4, help='Maximum turns per conversation (default: 4)')
+    parser.add_argument('--mode', choices=['history', 'session'], default='history',
+                        help='Resend the full history (default) or use server-side sessions')
+    parser.add_argument('--no-stream', action='store_true', help='Use /chat instead of /chat/stream (no TTFT)')
+    parser.add_argument('--timeout', type=float, default=300, help='Per-request timeout in seconds (default: 300)')
+    parser.add_argument('--seed', type=int, default=42, help='Seed for the conversation mix (default: 42)')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    if args.url:
+        base_url, api_key = args.url, args.api_key
+    else:
+        base_url, api_key = start_local_server(args.port)
+
+    levels = [int(level) for level in args.concurrency.split(',')]
+    questions = load_questions(args.data)
+    sessions = build_sessions(questions, n_sessions=max(args.requests, 50), max_turns=args.max_turns, seed=args.seed)
+    client = ChatClient(base_url, api_key, stream=not args.no_stream, timeout=args.timeout)
+    print(f"📊 {len(questions)} questions, up to {args.max_turns} turns per conversation, {args.requests} requests per level")
+
+    # One request to warm up caches and connections before measuring
+    client.send({"message": questions[0], "history": []})
+
+    results = []
+    for concurrency in levels:
+        print(f"⏳ Concurrency {concurrency}...")
+        results.append(run_level(client, sessions, concurrency, args.requests, args.mode))
+    print_table(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"url": base_url, "mode": args.mode, "stream": not args.no_stream, "results": results}, f, indent=2)
+        print(f"\n✅ Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Deterministic stand-in for llama_cpp, used by benchmark.py to load-test the server without a GGUF file.
+It implements the parts of the Llama API the server uses (tokenize, eval, KV state save/restore,
+streaming completions, embeddings) and simulates compute with per-token sleeps, which release the GIL
+like llama.cpp does. The low-level API used by the batching engine is not provided.
+
+    FAKE_LLAMA_PROMPT_DELAY   seconds per evaluated prompt token (default 0.0005)
+    FAKE_LLAMA_TOKEN_DELAY    seconds per generated token (default 0.02)
+    FAKE_LLAMA_REPLY_TOKENS   "min,max" generated tokens per reply (default 20,60)
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+PROMPT_DELAY = float(os.getenv('FAKE_LLAMA_PROMPT_DELAY', '0.0005'))
+TOKEN_DELAY = float(os.getenv('FAKE_LLAMA_TOKEN_DELAY', '0.02'))
+REPLY_TOKENS = tuple(int(n) for n in os.getenv('FAKE_LLAMA_REPLY_TOKENS', '20,60').split(','))
+
+_TOKEN_PATTERN = re.compile(r"<[a-z_]+>|\w+|[^\w\s]|\s+")
+_REPLY_WORDS = (
+    "Try", " keeping", " a", " regular", " sleep", " schedule", ",", " avoid", " caffeine", " after",
+    " noon", " and", " keep", " your", " bedroom", " cool", " and", " dark", ".", " 😴"
+)
+
+BOS_ID = 1
+EOS_ID = 2
+
+
+class _Vocabulary:
+    """Token ids are assigned on first sight and shared by every model instance"""
+
+    def __init__(self):
+        self._ids = {"<bos>": BOS_ID, "<eos>": EOS_ID}
+        self._pieces = {BOS_ID: "<bos>", EOS_ID: "<eos>"}
+        self._lock = threading.Lock()
+
+    def token_id(self, piece: str) -> int:
+        token = self._ids.get(piece)
+        if token is None:
+            with self._lock:
+                token = self._ids.setdefault(piece, len(self._ids) + 1)
+                self._pieces[token] = piece
+        return token
+
+    def piece(self, token: int) -> str:
+        return self._pieces.get(token, "")
+
+    def __len__(self):
+        return len(self._ids)
+
+
+_vocab = _Vocabulary()
+
+
+class StoppingCriteriaList(list):
+    def __call__(self, input_ids, logits) -> bool:
+        return any(criteria(input_ids, logits) for criteria in self)
+
+
+class Llama:
+    def __init__(self, model_path: str = "", n_ctx: int = 2048, embedding: bool = False, **kwargs):
+        self.model_path = model_path
+        self._n_ctx = n_ctx
+        self.embedding = embedding
+        self.input_ids = np.zeros(n_ctx, dtype=np.intc)
+        self.n_tokens = 0
+
+    # ---- tokenizer ----
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        tokens = [BOS_ID] if add_bos else []
+        tokens.extend(_vocab.token_id(piece) for piece in _TOKEN_PATTERN.findall(text.decode("utf-8", errors="ignore")))
+        return tokens
+
+    def detokenize(self, tokens: List[int]) -> bytes:
+        return "".join(_vocab.piece(token) for token in tokens).encode("utf-8")
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def n_vocab(self) -> int:
+        return len(_vocab)
+
+    def token_eos(self) -> int:
+        return EOS_ID
+
+    # ---- KV state ----
+
+    def reset(self):
+        self.n_tokens = 0
+
+    def eval(self, tokens: List[int]):
+        self._evaluate(list(tokens))
+
+    def save_state(self) -> Dict:
+        return {"input_ids": self.input_ids.copy(), "n_tokens": self.n_tokens}
+
+    def load_state(self, state: Dict):
+        self.input_ids = state["input_ids"].copy()
+        self.n_tokens = state["n_tokens"]
+
+    # ---- inference ----
+
+    def __call__(self, prompt, max_tokens: int = 16, temperature: float = 0.8, stop=None,
+                 stopping_criteria=None, stream: bool = False, **kwargs):
+        tokens = prompt if isinstance(prompt, list) else self.tokenize(prompt.encode("utf-8"))
+        chunks = self._generate(list(tokens), max_tokens, stopping_criteria)
+        if stream:
+            return chunks
+        text = "".join(chunk["choices"][0]["text"] for chunk in chunks)
+        return {"choices": [{"text": text, "finish_reason": "stop"}]}
+
+    def create_completion(self, prompt, **kwargs):
+        return self(prompt, **kwargs)
+
+    def embed(self, text: str) -> List[float]:
+        # Bag of hashed words, so near-identical questions get similar vectors
+        vector = np.zeros(64, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % 64] += 1.0
+        return vector.tolist()
+
+    def _evaluate(self, tokens: List[int]):
+        """Reuse the common prefix with the current state like llama-cpp, and sleep for the rest"""
+        current = self.input_ids[:self.n_tokens]
+        n_common = 0
+        for a, b in zip(current, tokens):
+            if a != b:
+                break
+            n_common += 1
+        n_common = min(n_common, len(tokens) - 1) if tokens else 0
+
+        if len(tokens) > self._n_ctx:
+            raise ValueError(f"Requested tokens ({len(tokens)}) exceed context window of {self._n_ctx}")
+        time.sleep((len(tokens) - n_common) * PROMPT_DELAY)
+        self.input_ids[n_common:len(tokens)] = tokens[n_common:]
+        self.n_tokens = len(tokens)
+
+    def _generate(self, tokens: List[int], max_tokens: int, stopping_criteria):
+        self._evaluate(tokens)
+
+        # Reply length depends only on the prompt, so runs are repeatable
+        seed = int(hashlib.sha1(np.asarray(tokens, dtype=np.intc).tobytes()).hexdigest(), 16)
+        low, high = REPLY_TOKENS
+        n_reply = min(max_tokens, low + seed % (high - low + 1))
+
+        for i in range(n_reply):
+            if self.n_tokens >= self._n_ctx:
+                break
+            time.sleep(TOKEN_DELAY)
+            piece = _REPLY_WORDS[(seed + i) % len(_REPLY_WORDS)]
+            self.input_ids[self.n_tokens] = _vocab.token_id(piece)
+            self.n_tokens += 1
+            yield {"choices": [{"text": piece, "index": 0, "finish_reason": None}]}
+            if stopping_criteria is not None and stopping_criteria(self.input_ids[:self.n_tokens], None):
+                return
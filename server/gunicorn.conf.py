@@ -0,0 +1,26 @@
+"""
+Production launch of the asyncio serving mode:
+
+    gunicorn -c gunicorn.conf.py
+
+Every worker process imports asgi.py and loads the model itself after forking. The GGUF weights are
+memory-mapped, so all workers share one copy through the page cache and only add their own context
+and KV cache memory.
+"""
+import os
+
+wsgi_app = "asgi:app"
+bind = f"0.0.0.0:{os.getenv('PORT', '3001')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# One process serves many connections; scale inference with MODEL_WORKERS or BATCH_SLOTS instead.
+# Sessions are per process unless SESSION_DB_PATH is set, so use it with more than one worker.
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+
+# llama contexts and the loader thread don't survive fork, so the app is imported in each worker
+preload_app = False
+
+# Loading the model happens in the background, but a slow disk can still delay the first heartbeat
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 75  # Mobile clients reuse connections between turns
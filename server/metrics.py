@@ -0,0 +1,209 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200)
+LOAD_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = _format_labels(self.label_names, labels, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                le = _format_labels(self.label_names, labels, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{le} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], collect: Callable[[], Dict[Tuple, float]]):
+        """A gauge whose values are read from collect() at scrape time"""
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """Minimal Prometheus text-format registry, so the server needs no extra dependency"""
+        self._metrics = []
+
+    def counter(self, name, help_text, label_names=()) -> Counter:
+        return self._register(Counter(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def gauge(self, name, help_text, label_names, collect) -> Gauge:
+        return self._register(Gauge(name, help_text, label_names, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # A failing gauge callback must not break the whole scrape
+                print(f"❌ Error collecting metric {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+registry = MetricsRegistry()
+
+LABELS = ("endpoint", "model")
+requests_total = registry.counter("hypnos_requests_total", "Chat requests by final status", LABELS + ("status",))
+queue_wait_seconds = registry.histogram("hypnos_queue_wait_seconds", "Time spent waiting for a model worker or batch slot", LABELS)
+prompt_build_seconds = registry.histogram("hypnos_prompt_build_seconds", "Prompt building, retrieval and truncation time", LABELS)
+prompt_eval_seconds = registry.histogram("hypnos_prompt_eval_seconds", "Prompt evaluation time (until the first token)", LABELS)
+prompt_eval_tokens = registry.histogram("hypnos_prompt_eval_tokens", "Prompt tokens evaluated (not restored from cache)", LABELS, TOKEN_BUCKETS)
+time_to_first_token_seconds = registry.histogram("hypnos_time_to_first_token_seconds", "Request start to first generated token", LABELS)
+decode_tokens_per_second = registry.histogram("hypnos_decode_tokens_per_second", "Generation speed after the first token", LABELS, RATE_BUCKETS)
+request_duration_seconds = registry.histogram("hypnos_request_duration_seconds", "Total request latency", LABELS)
+model_load_seconds = registry.histogram("hypnos_model_load_seconds", "Model loading time by phase", ("model", "phase"), LOAD_BUCKETS)
+
+
+class RequestTimings:
+    def __init__(self, endpoint: str, model: str, slow_request_seconds: float = 0.0):
+        """Per-request latency breakdown, recorded into the histograms when the request finishes"""
+        self.endpoint = endpoint
+        self.model = model
+        self.slow_request_seconds = slow_request_seconds
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.first_token_at = None
+        self.prompt_tokens = 0
+        self.prompt_eval_tokens = None
+        self.completion_tokens = 0
+        self._finished = False
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def record_generation(self, generation):
+        """Copy the timing attributes every generation backend exposes"""
+        self.phases["queue_wait"] = generation.queue_seconds
+        if generation.prompt_eval_seconds is not None:
+            self.phases["prompt_eval"] = generation.prompt_eval_seconds
+        self.first_token_at = generation.first_token_at
+        self.prompt_eval_tokens = generation.prompt_eval_tokens
+        self.prompt_tokens = generation.usage.get("prompt_tokens", 0)
+        self.completion_tokens = generation.usage.get("completion_tokens", 0)
+
+    def finish(self, status: str):
+        if self._finished:
+            return
+        self._finished = True
+        now = time.perf_counter()
+        total = now - self.started
+        labels = (self.endpoint, self.model)
+
+        requests_total.inc(*labels, status)
+        request_duration_seconds.observe(total, *labels)
+        if "queue_wait" in self.phases:
+            queue_wait_seconds.observe(self.phases["queue_wait"], *labels)
+        if "prompt_build" in self.phases:
+            prompt_build_seconds.observe(self.phases["prompt_build"], *labels)
+        if "prompt_eval" in self.phases:
+            prompt_eval_seconds.observe(self.phases["prompt_eval"], *labels)
+        if self.prompt_eval_tokens is not None:
+            prompt_eval_tokens.observe(self.prompt_eval_tokens, *labels)
+
+        decode_rate = None
+        if self.first_token_at is not None:
+            time_to_first_token_seconds.observe(self.first_token_at - self.started, *labels)
+            decode_seconds = now - self.first_token_at
+            if self.completion_tokens > 1 and decode_seconds > 0:
+                decode_rate = (self.completion_tokens - 1) / decode_seconds
+                decode_tokens_per_second.observe(decode_rate, *labels)
+
+        if self.slow_request_seconds and total >= self.slow_request_seconds:
+            print("🐢 Slow request " + json.dumps({
+                "endpoint": self.endpoint,
+                "model": self.model,
+                "status": status,
+                "total_seconds": round(total, 4),
+                "phases": {name: round(value, 4) for name, value in self.phases.items()},
+                "time_to_first_token": round(self.first_token_at - self.started, 4) if self.first_token_at else None,
+                "prompt_tokens": self.prompt_tokens,
+                "prompt_eval_tokens": self.prompt_eval_tokens,
+                "completion_tokens": self.completion_tokens,
+                "decode_tokens_per_second": round(decode_rate, 2) if decode_rate else None
+            }))
@@ -0,0 +1,176 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from typing import Dict, List
+
+from prompt_cache import PromptStateCache
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class QueueFullError(Exception):
+    """The request queue is at its maximum depth"""
+
+
+class QueueTimeoutError(Exception):
+    """The request's deadline passed while it was waiting for a worker"""
+
+
+class DeadlineExceededError(Exception):
+    """Generation was stopped because the request's deadline passed"""
+
+
+class ModelWorker:
+    def __init__(self, worker_id: int, model, prompt_cache: PromptStateCache):
+        """One Llama instance with its own context and KV state cache"""
+        self.worker_id = worker_id
+        self.model = model
+        self.prompt_cache = prompt_cache
+        self.requests = 0
+        self.busy_seconds = 0.0
+        self.busy_since = None
+
+
+class WorkerLease:
+    def __init__(self, pool, worker: ModelWorker):
+        """A worker handed out by the pool. Releasing is idempotent, so it can be tied to a response's close"""
+        self.pool = pool
+        self.worker = worker
+        self._released = False
+        self._release_lock = threading.Lock()
+
+    def release(self):
+        with self._release_lock:
+            if self._released:
+                return
+            self._released = True
+        self.pool._release(self.worker)
+
+    def __enter__(self):
+        return self.worker
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ModelPool:
+    def __init__(self, workers: List[ModelWorker], max_queue_depth: int = 16):
+        """
+        Dispatches requests to free model workers through a bounded priority queue.
+        Workers load the same GGUF with mmap, so the weights are shared through the page cache
+        and each worker only adds its own context/KV memory. llama.cpp releases the GIL while
+        evaluating, so workers decode in parallel from plain threads.
+        """
+        self.workers = workers
+        self.max_queue_depth = max_queue_depth
+        self._idle = list(workers)
+        self._cond = threading.Condition()
+        self._queue = []  # heap of (priority, sequence) tickets
+        self._sequence = itertools.count()
+        self._started_at = time.time()
+        self.rejected = 0
+        self.timed_out = 0
+
+    def acquire(self, session_id: str = None, priority: int = PRIORITY_INTERACTIVE, deadline: float = None) -> WorkerLease:
+        """
+        Wait for a free worker, serving lower priority values first and FIFO within a priority.
+        A worker that still holds the session's KV state is preferred.
+        Raises QueueFullError when the queue is full and QueueTimeoutError when the deadline passes.
+        """
+        with self._cond:
+            if (not self._idle or self._queue) and len(self._queue) >= self.max_queue_depth:
+                self.rejected += 1
+                raise QueueFullError("Server is busy, request queue is full")
+
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._queue, ticket)
+            try:
+                while not (self._idle and self._queue[0] == ticket):
+                    timeout = None
+                    if deadline is not None:
+                        timeout = deadline - time.time()
+                        if timeout <= 0:
+                            self.timed_out += 1
+                            raise QueueTimeoutError("Request timed out waiting for a model worker")
+                    self._cond.wait(timeout)
+            except BaseException:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+                raise
+
+            heapq.heappop(self._queue)
+            worker = self._pick_idle(session_id)
+            worker.busy_since = time.time()
+            # The next ticket may be waiting for a worker that is still idle
+            self._cond.notify_all()
+
+        return WorkerLease(self, worker)
+
+    def retry_after_seconds(self) -> int:
+        """Rough estimate of when a rejected client should retry, from the average service time"""
+        with self._cond:
+            served = sum(w.requests for w in self.workers)
+            busy = sum(w.busy_seconds for w in self.workers)
+            waiting = len(self._queue)
+        average = busy / served if served else 5.0
+        return max(1, math.ceil(average * (waiting + 1) / len(self.workers)))
+
+    def drop_session(self, session_id: str):
+        for worker in self.workers:
+            worker.prompt_cache.drop_session(session_id)
+
+    def stats(self) -> Dict:
+        now = time.time()
+        uptime = max(now - self._started_at, 1e-9)
+        with self._cond:
+            workers = []
+            for worker in self.workers:
+                busy = worker.busy_seconds
+                if worker.busy_since is not None:
+                    busy += now - worker.busy_since
+                workers.append({
+                    "worker_id": worker.worker_id,
+                    "busy": worker.busy_since is not None,
+                    "requests": worker.requests,
+                    "utilisation": round(busy / uptime, 4)
+                })
+            return {
+                "workers": len(self.workers),
+                "idle_workers": len(self._idle),
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self.max_queue_depth,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "per_worker": workers
+            }
+
+    def prompt_cache_stats(self) -> Dict:
+        """Prompt cache counters summed over all workers"""
+        totals = {}
+        for worker in self.workers:
+            for key, value in worker.prompt_cache.stats().items():
+                if key == "prefix_tokens":
+                    totals[key] = value
+                else:
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def _release(self, worker: ModelWorker):
+        with self._cond:
+            worker.busy_seconds += time.time() - worker.busy_since
+            worker.busy_since = None
+            worker.requests += 1
+            self._idle.append(worker)
+            self._cond.notify_all()
+
+    def _pick_idle(self, session_id: str) -> ModelWorker:
+        if session_id:
+            for i, worker in enumerate(self._idle):
+                if worker.prompt_cache.has_session(session_id):
+                    return self._idle.pop(i)
+        return self._idle.pop()
@@ -0,0 +1,229 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+
+class UnknownModelError(KeyError):
+    """The request asked for a model that is not in the registry"""
+
+
+def parse_model_specs(value: str) -> Dict[str, str]:
+    """Parse MODELS="base=/models/base.gguf,sft=/models/sft-q4.gguf" into {name: path}"""
+    specs = {}
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, path = entry.partition("=")
+        if not path:
+            raise ValueError(f"Invalid MODELS entry '{entry}', expected name=path")
+        specs[name.strip()] = path.strip()
+    return specs
+
+
+class ServedModel:
+    def __init__(self, name: str, path: str, pool, batch_engine=None, turn_tokens=None,
+                 bos_tokens=(), context_size: int = 2048):
+        """
+        Everything needed to serve one GGUF: its worker pool (and batching engine), tokenizer caches
+        and context size. Requests hold a reference while they use it, so a replaced or evicted model
+        is only closed once its last request has finished.
+        """
+        self.name = name
+        self.path = path
+        self.pool = pool
+        self.batch_engine = batch_engine
+        self.turn_tokens = turn_tokens
+        self.bos_tokens = list(bos_tokens)
+        self.context_size = context_size
+        self.size_bytes = os.path.getsize(path) if os.path.exists(path) else 0
+        self.loaded_at = time.time()
+        self.in_flight = 0
+        self.retired = False
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def acquire(self) -> "ServedModel":
+        with self._lock:
+            self.in_flight += 1
+        return self
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            should_close = self.retired and self.in_flight == 0
+        if should_close:
+            self._close()
+
+    def retire(self):
+        """Stop handing this model out; it is closed as soon as in-flight requests have drained"""
+        with self._lock:
+            self.retired = True
+            should_close = self.in_flight == 0
+        if should_close:
+            self._close()
+
+    @property
+    def scheduler(self):
+        """Whichever of the batching engine or the worker pool serves this model's chat requests"""
+        return self.batch_engine or self.pool
+
+    def stats(self) -> Dict:
+        return {
+            "name": self.name,
+            "path": self.path,
+            "size_mb": round(self.size_bytes / 2 ** 20, 1),
+            "loaded_at": self.loaded_at,
+            "in_flight": self.in_flight,
+            "retired": self.retired
+        }
+
+    def _close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self.batch_engine is not None:
+            self.batch_engine.close()
+        for worker in self.pool.workers:
+            # Older llama-cpp-python versions free the context on garbage collection only
+            close = getattr(worker.model, "close", None)
+            if close is not None:
+                close()
+        print(f"🗑️ Unloaded model '{self.name}' ({self.path})")
+
+
+class ModelRegistry:
+    def __init__(self, specs: Dict[str, str], load: Callable[[str, str], ServedModel],
+                 default: str, memory_budget_bytes: int = 0):
+        """
+        Named GGUF models, loaded on first use by load(name, path).
+        Loaded models are kept least-recently-used within memory_budget_bytes (GGUF file sizes,
+        0 = no limit); the default model is never evicted. swap() replaces a model atomically:
+        the new one is loaded first, new requests go to it, and the old one drains.
+        """
+        if default not in specs:
+            raise ValueError(f"Default model '{default}' is not one of {sorted(specs)}")
+        self.specs = dict(specs)
+        self.default = default
+        self.memory_budget_bytes = memory_budget_bytes
+        self._load = load
+        self._loaded = OrderedDict()  # name -> ServedModel, least recently used first
+        self._loading = {}  # name -> Event set when a load in progress finishes
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+        self.swaps = 0
+
+    def names(self) -> List[str]:
+        return list(self.specs)
+
+    def get_loaded(self, name: str = None) -> Optional[ServedModel]:
+        """The model if it is loaded, without loading it or taking a reference"""
+        with self._lock:
+            return self._loaded.get(name or self.default)
+
+    def loaded_models(self) -> List[ServedModel]:
+        with self._lock:
+            return list(self._loaded.values())
+
+    def acquire(self, name: str = None) -> ServedModel:
+        """
+        Take a reference to a model, loading it first if needed (this blocks for the load).
+        Callers must release() the returned model when their request is done.
+        """
+        name = name or self.default
+        if name not in self.specs:
+            raise UnknownModelError(f"Unknown model '{name}', available: {', '.join(self.specs)}")
+
+        while True:
+            with self._lock:
+                served = self._loaded.get(name)
+                if served is not None:
+                    self._loaded.move_to_end(name)
+                    return served.acquire()
+                loading = self._loading.get(name)
+                if loading is None:
+                    loading = self._loading[name] = threading.Event()
+                    path = self.specs[name]
+                    break
+            # Another request is loading this model - wait for it, then take the loaded one
+            loading.wait()
+
+        try:
+            served = self._load(name, path)
+        except BaseException:
+            with self._lock:
+                del self._loading[name]
+            loading.set()
+            raise
+
+        with self._lock:
+            evicted = self._make_room(served.size_bytes, keep=name)
+            self._loaded[name] = served
+            del self._loading[name]
+            self.loads += 1
+            served.acquire()
+        loading.set()
+        for model in evicted:
+            model.retire()
+        return served
+
+    def swap(self, name: str, path: str = None) -> ServedModel:
+        """
+        Load path (default: the model's current path, i.e. a reload) under name and switch new requests
+        to it. Requests already running finish on the old model, which is closed once they are done.
+        """
+        if name not in self.specs:
+            raise UnknownModelError(f"Unknown model '{name}', available: {', '.join(self.specs)}")
+        path = path or self.specs[name]
+
+        served = self._load(name, path)
+        with self._lock:
+            old = self._loaded.pop(name, None)
+            evicted = self._make_room(served.size_bytes, keep=name)
+            self._loaded[name] = served
+            self.specs[name] = path
+            self.swaps += 1
+        for model in evicted + ([old] if old is not None else []):
+            model.retire()
+        print(f"🔁 Model '{name}' now served from {path}")
+        return served
+
+    def stats(self) -> Dict:
+        with self._lock:
+            loaded = [served.stats() for served in self._loaded.values()]
+            loaded_bytes = sum(served.size_bytes for served in self._loaded.values())
+            return {
+                "default": self.default,
+                "available": list(self.specs),
+                "loaded": loaded,
+                "loading": list(self._loading),
+                "loaded_mb": round(loaded_bytes / 2 ** 20, 1),
+                "memory_budget_mb": round(self.memory_budget_bytes / 2 ** 20, 1) if self.memory_budget_bytes else None,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "swaps": self.swaps
+            }
+
+    def _make_room(self, size_bytes: int, keep: str) -> List[ServedModel]:
+        """
+        Remove least recently used models until size_bytes more fits in the budget.
+        Call with the lock held; the caller retires the returned models after releasing it.
+        """
+        evicted = []
+        if not self.memory_budget_bytes:
+            return evicted
+        used = sum(served.size_bytes for served in self._loaded.values())
+        for name in list(self._loaded):
+            if used + size_bytes <= self.memory_budget_bytes:
+                break
+            if name in (keep, self.default):
+                continue
+            served = self._loaded.pop(name)
+            used -= served.size_bytes
+            self.evictions += 1
+            evicted.append(served)
+        return evicted
@@ -0,0 +1,107 @@
+import threading
+from collections import OrderedDict
+
+
+def common_prefix_length(a, b) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class PromptStateCache:
+    def __init__(self, max_session_states: int = 4):
+        """
+        Keeps llama KV states that can be restored before a request, so the model only
+        has to process the tokens it has not seen yet:
+        - the fixed system prompt prefix, evaluated once at startup
+        - the state left by the last turn of recent sessions (LRU bounded, states are large)
+        """
+        self.prefix_tokens = []
+        self.prefix_state = None
+        self.max_session_states = max_session_states
+        self._session_states = OrderedDict()  # session_id -> (tokens, state)
+        self.hits = 0
+        self.session_hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def build_prefix(self, model, prefix_text: str):
+        """Evaluate the prefix once and keep a snapshot of the resulting KV state"""
+        tokens = model.tokenize(prefix_text.encode("utf-8"), special=True)
+        model.reset()
+        model.eval(tokens)
+        self.prefix_tokens = tokens
+        self.prefix_state = model.save_state()
+        print(f"🧠 Cached KV state for {len(tokens)} prefix tokens")
+
+    def prepare(self, model, prompt_tokens, session_id: str = None) -> int:
+        """
+        Restore the saved state that shares the longest prefix with prompt_tokens.
+        llama-cpp reuses the longest common prefix of its current state, so only the new tokens get processed.
+        Must be called while holding the model's lock.
+        Returns the number of prompt tokens already in the KV state, which the model won't evaluate again.
+        """
+        prompt_tokens = list(prompt_tokens)
+        current_tokens = model.input_ids[:model.n_tokens].tolist()
+        resident = common_prefix_length(current_tokens, prompt_tokens)
+
+        # Candidate states: the session's last turn, then the system prefix
+        best_state, best_length, from_session = None, 0, False
+        session_entry = self._session_states.get(session_id) if session_id else None
+        if session_entry is not None:
+            best_length = common_prefix_length(session_entry[0], prompt_tokens)
+            best_state, from_session = session_entry[1], True
+
+        n_prefix = len(self.prefix_tokens)
+        if self.prefix_state is not None and n_prefix > best_length and prompt_tokens[:n_prefix] == self.prefix_tokens:
+            best_state, best_length, from_session = self.prefix_state, n_prefix, False
+
+        if best_state is None or best_length == 0:
+            self._record("miss")
+            return resident
+
+        # Another request may have left a different conversation in the KV cache - restore ours
+        if best_length > resident:
+            model.load_state(best_state)
+
+        self._record("session" if from_session else "prefix")
+        return max(best_length, resident)
+
+    def save_session(self, session_id: str, model):
+        """Snapshot the model state after a turn so the next turn of this session continues from it"""
+        tokens = model.input_ids[:model.n_tokens].tolist()
+        state = model.save_state()
+        with self._stats_lock:
+            self._session_states[session_id] = (tokens, state)
+            self._session_states.move_to_end(session_id)
+            while len(self._session_states) > self.max_session_states:
+                self._session_states.popitem(last=False)
+
+    def has_session(self, session_id: str) -> bool:
+        return session_id in self._session_states
+
+    def drop_session(self, session_id: str):
+        with self._stats_lock:
+            self._session_states.pop(session_id, None)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "prefix_tokens": len(self.prefix_tokens),
+                "hits": self.hits,
+                "session_hits": self.session_hits,
+                "misses": self.misses,
+                "session_states": len(self._session_states)
+            }
+
+    def _record(self, outcome: str):
+        with self._stats_lock:
+            if outcome == "miss":
+                self.misses += 1
+            elif outcome == "session":
+                self.session_hits += 1
+            else:
+                self.hits += 1
@@ -0,0 +1,137 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+
+def normalize_message(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation so trivial variations share an entry"""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(" ?!.")
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 24 * 3600,
+                 embed: Callable[[str], np.ndarray] = None, similarity_threshold: float = 0.92):
+        """
+        Cache of model replies to first-turn questions.
+        - exact tier: keyed by the normalized message plus the model/generation parameters
+        - similarity tier (optional): cosine similarity of local embeddings against all cached questions
+        Entries are evicted least-recently-used once max_entries is reached, or after ttl_seconds.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._embed = embed
+        self._entries = OrderedDict()  # key -> (response, created_at, params_key, row)
+        self._lock = threading.Lock()
+
+        # Similarity index: one normalized embedding per row, rows are reused after eviction
+        self._vectors = None
+        self._row_keys = [None] * max_entries
+        self._free_rows = list(range(max_entries - 1, -1, -1))
+
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, message: str, params_key: str) -> Optional[Dict]:
+        """Return {"response", "match"} for a cached reply, or None"""
+        normalized = normalize_message(message)
+        key = self._key(normalized, params_key)
+
+        with self._lock:
+            self._purge_expired()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return {"response": entry[0], "match": "exact"}
+
+        if self._embed is not None:
+            vector = self._embed_normalized(normalized)
+            with self._lock:
+                similar_key, score = self._most_similar(vector, params_key)
+                if similar_key is not None and score >= self.similarity_threshold:
+                    self._entries.move_to_end(similar_key)
+                    self.similar_hits += 1
+                    return {"response": self._entries[similar_key][0], "match": "similar", "similarity": round(score, 4)}
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def store(self, message: str, params_key: str, response: str):
+        normalized = normalize_message(message)
+        key = self._key(normalized, params_key)
+        vector = self._embed_normalized(normalized) if self._embed is not None else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while len(self._entries) >= self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+            row = None
+            if vector is not None:
+                if self._vectors is None:
+                    self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                row = self._free_rows.pop()
+                self._vectors[row] = vector
+                self._row_keys[row] = key
+            self._entries[key] = (response, time.time(), params_key, row)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "similarity_tier": self._embed is not None,
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def _key(self, normalized: str, params_key: str) -> str:
+        return hashlib.sha256(f"{params_key}\n{normalized}".encode("utf-8")).hexdigest()
+
+    def _embed_normalized(self, text: str) -> np.ndarray:
+        vector = np.asarray(self._embed(text), dtype=np.float32)
+        if vector.ndim > 1:
+            # Models without pooling return one vector per token
+            vector = vector.mean(axis=0)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _most_similar(self, vector: np.ndarray, params_key: str):
+        if self._vectors is None or not self._entries:
+            return None, 0.0
+        scores = self._vectors @ vector
+        for row in np.argsort(scores)[::-1]:
+            key = self._row_keys[row]
+            if key is None:
+                continue
+            if self._entries[key][2] == params_key:
+                return key, float(scores[row])
+        return None, 0.0
+
+    def _remove(self, key: str):
+        _, _, _, row = self._entries.pop(key)
+        if row is not None:
+            self._row_keys[row] = None
+            self._vectors[row] = 0.0
+            self._free_rows.append(row)
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        expired = [key for key, entry in self._entries.items() if entry[1] < cutoff]
+        for key in expired:
+            self._remove(key)
+            self.evictions += 1
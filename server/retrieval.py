@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+BM25 retrieval over the SleepQA Q&A pairs
+Build the index offline, the server memory-maps it and injects the top passages into the prompt
+
+    python retrieval.py --data ../sleepqa_data/sleep-train-enriched.json --output sleepqa_index
+"""
+import argparse
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i",
+    "in", "is", "it", "my", "of", "on", "or", "that", "the", "to", "what", "when", "which", "who",
+    "why", "with", "you", "your"
+}
+
+
+def tokenize_text(text: str) -> List[str]:
+    return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in STOPWORDS]
+
+
+def build_index(json_paths: List[str], output_dir: str, k1: float = 1.5, b: float = 0.75) -> str:
+    """
+    Build a compact BM25 index. The full BM25 weight of every (term, passage) pair is precomputed,
+    so a query is just a sum over the postings of its terms:
+    - postings_docs.npy / postings_weights.npy: postings of all terms back to back (int32 / float16)
+    - term_offsets.npy: where each term's postings start (term id -> slice)
+    - vocab.json: term -> term id, passages.json: the Q&A pairs
+    """
+    passages = []
+    for path in json_paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for item in json.load(f):
+                if item.get("question") and item.get("answer"):
+                    passages.append({"question": item["question"].strip(), "answer": item["answer"].strip()})
+    print(f"📊 Indexing {len(passages)} passages")
+
+    term_counts = [Counter(tokenize_text(p["question"] + " " + p["answer"])) for p in passages]
+    doc_lengths = np.array([sum(c.values()) for c in term_counts], dtype=np.float32)
+    avg_length = float(doc_lengths.mean()) if len(passages) else 1.0
+
+    postings = {}
+    for doc_id, counts in enumerate(term_counts):
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((doc_id, tf))
+
+    vocab = {}
+    offsets = [0]
+    docs, weights = [], []
+    n_docs = len(passages)
+    for term in sorted(postings):
+        entries = postings[term]
+        idf = math.log(1 + (n_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+        for doc_id, tf in entries:
+            norm = k1 * (1 - b + b * doc_lengths[doc_id] / avg_length)
+            docs.append(doc_id)
+            weights.append(idf * tf * (k1 + 1) / (tf + norm))
+        vocab[term] = len(vocab)
+        offsets.append(len(docs))
+
+    os.makedirs(output_dir, exist_ok=True)
+    np.save(os.path.join(output_dir, "postings_docs.npy"), np.array(docs, dtype=np.int32))
+    np.save(os.path.join(output_dir, "postings_weights.npy"), np.array(weights, dtype=np.float16))
+    np.save(os.path.join(output_dir, "term_offsets.npy"), np.array(offsets, dtype=np.int64))
+    with open(os.path.join(output_dir, "vocab.json"), 'w', encoding='utf-8') as f:
+        json.dump(vocab, f)
+    with open(os.path.join(output_dir, "passages.json"), 'w', encoding='utf-8') as f:
+        json.dump(passages, f, ensure_ascii=False)
+
+    print(f"✅ Index with {len(vocab)} terms and {len(docs)} postings saved to {output_dir}")
+    return output_dir
+
+
+class SleepQAIndex:
+    def __init__(self, index_dir: str):
+        """
+        Read-only BM25 index, loaded lazily on first search.
+        Postings are memory-mapped, so every worker process shares one copy through the page cache.
+        """
+        self.index_dir = index_dir
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+    def search(self, query: str, k: int = 3) -> List[Dict]:
+        """Top-k passages as dicts with question, answer and score"""
+        self._ensure_loaded()
+        term_ids = [self._vocab[t] for t in set(tokenize_text(query)) if t in self._vocab]
+        if not term_ids:
+            return []
+
+        docs = np.concatenate([self._docs[self._offsets[t]:self._offsets[t + 1]] for t in term_ids])
+        weights = np.concatenate([self._weights[self._offsets[t]:self._offsets[t + 1]] for t in term_ids])
+        scores = np.bincount(docs, weights=weights.astype(np.float32), minlength=len(self._passages))
+
+        k = min(k, np.count_nonzero(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [dict(self._passages[i], score=float(scores[i])) for i in top]
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            self._docs = np.load(os.path.join(self.index_dir, "postings_docs.npy"), mmap_mode='r')
+            self._weights = np.load(os.path.join(self.index_dir, "postings_weights.npy"), mmap_mode='r')
+            self._offsets = np.load(os.path.join(self.index_dir, "term_offsets.npy"), mmap_mode='r')
+            with open(os.path.join(self.index_dir, "vocab.json"), 'r', encoding='utf-8') as f:
+                self._vocab = json.load(f)
+            with open(os.path.join(self.index_dir, "passages.json"), 'r', encoding='utf-8') as f:
+                self._passages = json.load(f)
+            self._loaded = True
+            print(f"📚 Loaded retrieval index with {len(self._passages)} passages")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the BM25 retrieval index over SleepQA data')
+    parser.add_argument(
+        '--data',
+        nargs='+',
+        default=[os.path.join(os.path.dirname(__file__), '..', 'sleepqa_data', 'sleep-train-enriched.json')],
+        help='JSON files with question/answer items (default: sleepqa_data/sleep-train-enriched.json)'
+    )
+    parser.add_argument(
+        '--output',
+        default=os.path.join(os.path.dirname(__file__), 'sleepqa_index'),
+        help='Directory to write the index to (default: server/sleepqa_index)'
+    )
+    args = parser.parse_args()
+    build_index(args.data, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,27 @@
 #!/usr/bin/env python3
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-from llama_cpp import Llama
+from llama_cpp import Llama, StoppingCriteriaList
 import threading
+import hashlib
+import json
 import time
 import os
 import socket
 from dotenv import load_dotenv
 from functools import wraps
+from contextlib import nullcontext, contextmanager
+from prompt_cache import PromptStateCache
+from model_pool import ModelPool, ModelWorker, QueueFullError, QueueTimeoutError, DeadlineExceededError, PRIORITY_BACKGROUND
+from token_cache import TurnTokenCache
+from batch_engine import BatchEngine
+from response_cache import ResponseCache
+from retrieval import SleepQAIndex
+from session_store import SessionStore, SQLiteSessionStore, new_session_id
+from metrics import registry as metrics_registry, RequestTimings, model_load_seconds
+from startup import StartupStatus
+from summarizer import ConversationSummarizer
+from model_registry import ModelRegistry, ServedModel, UnknownModelError, parse_model_specs
 
 # Load environment variables
 load_dotenv()
@@ -15,7 +29,44 @@ load_dotenv()
 # Configuration from environment variables
 GENERATION_TOKENS = int(os.getenv('GENERATION_TOKENS', '256'))
 LOCAL_MODEL_PATH = os.getenv('LOCAL_MODEL_PATH', '')
+# Named models a request can pick with "model", e.g. "base=/models/base.gguf,dpo=/models/dpo-q4.gguf"
+MODELS = parse_model_specs(os.getenv('MODELS', '')) or {"default": LOCAL_MODEL_PATH}
+DEFAULT_MODEL = os.getenv('DEFAULT_MODEL', '') or next(iter(MODELS))
+MODEL_MEMORY_BUDGET_MB = float(os.getenv('MODEL_MEMORY_BUDGET_MB', '0'))  # LRU budget for loaded GGUFs, 0 = no limit
+N_CTX = int(os.getenv('N_CTX', '2048'))
+N_GPU_LAYERS = int(os.getenv('N_GPU_LAYERS', '0'))
+USE_MMAP = os.getenv('USE_MMAP', 'true').lower() in ('1', 'true', 'yes')  # Share weights between workers and processes
+USE_MLOCK = os.getenv('USE_MLOCK', 'false').lower() in ('1', 'true', 'yes')  # Pin weights in RAM so they are never paged out
+WARMUP_TOKENS = int(os.getenv('WARMUP_TOKENS', '8'))  # Tokens generated per worker at load time, 0 disables the warm-up
 API_KEY = os.getenv('API_KEY', 'your-api-key-here')  # Set this in production
+SESSION_MAX = int(os.getenv('SESSION_MAX', '1000'))
+SESSION_TTL_SECONDS = float(os.getenv('SESSION_TTL_SECONDS', str(6 * 3600)))
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', '')  # Optional SQLite file to persist sessions
+SESSION_KV_STATES = int(os.getenv('SESSION_KV_STATES', '4'))  # KV snapshots are large, keep this small
+BATCH_SLOTS = int(os.getenv('BATCH_SLOTS', '0'))  # >0 enables continuous batching with this many concurrent sequences
+MODEL_WORKERS = 1 if BATCH_SLOTS > 0 else max(1, int(os.getenv('MODEL_WORKERS', '1')))
+THREADS_PER_WORKER = int(os.getenv('THREADS_PER_WORKER', '0')) or max(1, (os.cpu_count() or 4) // MODEL_WORKERS)
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '0'))  # >0 caches replies to first-turn questions
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', str(24 * 3600)))
+RESPONSE_CACHE_EMBEDDING_MODEL = os.getenv('RESPONSE_CACHE_EMBEDDING_MODEL', '')  # Optional GGUF embedding model for the similarity tier
+RESPONSE_CACHE_SIMILARITY = float(os.getenv('RESPONSE_CACHE_SIMILARITY', '0.92'))
+RETRIEVAL_INDEX_DIR = os.getenv('RETRIEVAL_INDEX_DIR', '')  # Built with retrieval.py; empty disables retrieval
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '3'))
+RETRIEVAL_MAX_TOKENS = int(os.getenv('RETRIEVAL_MAX_TOKENS', '256'))  # Token budget for injected passages
+RETRIEVAL_MIN_SCORE = float(os.getenv('RETRIEVAL_MIN_SCORE', '5.0'))
+MAX_QUEUE_DEPTH = int(os.getenv('MAX_QUEUE_DEPTH', '16'))  # Requests waiting for a worker before new ones get 503
+REQUEST_TIMEOUT_SECONDS = float(os.getenv('REQUEST_TIMEOUT_SECONDS', '120'))  # Deadline for queueing + generation
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS', '0'))  # >0 logs the timing breakdown of slower requests
+SUMMARY_TRIGGER_TOKENS = int(os.getenv('SUMMARY_TRIGGER_TOKENS', '0'))  # >0 summarizes older turns once the unsummarized history passes this size
+SUMMARY_KEEP_TURNS = int(os.getenv('SUMMARY_KEEP_TURNS', '4'))  # Most recent turns always sent verbatim
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '192'))
+SUMMARY_QUEUE_SECONDS = 60.0  # A background summary gives up if no worker frees up in time, it's retried next turn
+
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the conversation below between a user and a sleep assistant in a few sentences. "
+    "Keep the user's sleep problems, habits and circumstances and the advice already given. "
+    "Reply with the summary only."
+)
 
 SYSTEM_PROMPT = """
                 You are HYPNOS, a helpful AI assistant designed to support users with insomnia and sleep issues.
@@ -29,9 +80,47 @@ SYSTEM_PROMPT = """
 app = Flask(__name__)
 CORS(app)
 
-# Global model and lock
-chat_model = None
-model_lock = threading.Lock()
+# Loading progress and timings of the default model, for the readiness endpoint
+startup_status = StartupStatus()
+
+# Cached replies to first-turn questions (RESPONSE_CACHE_SIZE > 0)
+response_cache = None
+
+# Running summaries of long conversations, computed in the background (SUMMARY_TRIGGER_TOKENS > 0)
+summarizer = ConversationSummarizer() if SUMMARY_TRIGGER_TOKENS > 0 else None
+
+# SleepQA passages for grounding answers - memory-mapped and loaded on first use
+retrieval_index = SleepQAIndex(RETRIEVAL_INDEX_DIR) if RETRIEVAL_INDEX_DIR else None
+
+class PromptTooLongError(ValueError):
+    """The newest message alone does not fit in the context window"""
+
+class ChatRequestError(Exception):
+    """A chat request that is rejected before any model work, with the HTTP status to answer with"""
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+class ChatRequest:
+    def __init__(self, history, session_id, deadline, timings, served_model):
+        """A validated chat request holding a reference to its model until release()"""
+        self.history = history
+        self.session_id = session_id
+        self.deadline = deadline
+        self.timings = timings
+        self.served_model = served_model
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.served_model.release()
+
+# Server-side conversation histories, so clients only send the new message
+if SESSION_DB_PATH:
+    session_store = SQLiteSessionStore(SESSION_DB_PATH, max_sessions=SESSION_MAX, ttl_seconds=SESSION_TTL_SECONDS)
+else:
+    session_store = SessionStore(max_sessions=SESSION_MAX, ttl_seconds=SESSION_TTL_SECONDS)
 
 def get_local_ip():
     # Check if IP is specified in environment
@@ -48,205 +137,960 @@ def get_local_ip():
     except:
         return "localhost"
 
+def check_api_key(auth_header):
+    """Returns an error message if the Authorization header is missing or wrong, None if it's valid"""
+    if not auth_header:
+        return "Missing Authorization header"
+
+    if not auth_header.startswith('Bearer '):
+        return "Invalid Authorization header format"
+
+    api_key = auth_header.split(' ')[1]
+
+    if api_key != API_KEY:
+        return "Invalid API key"
+
+    return None
+
 def require_api_key(f):
     """Decorator to require API key authentication"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-        
-        if not auth_header:
-            return jsonify({"error": "Missing Authorization header"}), 401
-        
-        if not auth_header.startswith('Bearer '):
-            return jsonify({"error": "Invalid Authorization header format"}), 401
-        
-        api_key = auth_header.split(' ')[1]
-        
-        if api_key != API_KEY:
-            return jsonify({"error": "Invalid API key"}), 401
+        error = check_api_key(request.headers.get('Authorization'))
+        if error:
+            return jsonify({"error": error}), 401
         
         return f(*args, **kwargs)
     return decorated_function
 
-import os
+@contextmanager
+def load_phase(model_name, phase, **progress):
+    """Time a model loading phase into the metrics, and into the startup status while the server starts"""
+    started = time.perf_counter()
+    step = nullcontext() if startup_status.ready else startup_status.step(phase, model=model_name, **progress)
+    with step:
+        yield
+    model_load_seconds.observe(time.perf_counter() - started, model_name, phase)
+
+def warm_up(worker, turn_tokens):
+    """
+    Generate a few tokens so the first real request doesn't pay for page faults on the mmapped
+    weights and llama.cpp's first-eval allocations
+    """
+    prompt_tokens = worker.prompt_cache.prefix_tokens + turn_tokens.tokens(
+        format_turn("user", "Hello") + "<start_of_turn>model\n"
+    )
+    worker.prompt_cache.prepare(worker.model, prompt_tokens)
+    for _ in worker.model(prompt_tokens, max_tokens=WARMUP_TOKENS, temperature=0.7, stream=True):
+        pass
 
-def get_model_path():
-    """Get the local model path"""
-    return LOCAL_MODEL_PATH
+def load_model(name, model_path):
+    """Load a GGUF into its own worker pool (or batching engine). Used by the model registry"""
+    print(f"🤖 Loading model '{name}'...")
+    print(f"📁 Model path: {model_path}")
+    print(f"👷 Workers: {MODEL_WORKERS} x {THREADS_PER_WORKER} threads, n_ctx={N_CTX}, mmap={USE_MMAP}, mlock={USE_MLOCK}")
+
+    workers = []
+    for worker_id in range(MODEL_WORKERS):
+        with load_phase(name, "load_weights", workers_loaded=worker_id, workers=MODEL_WORKERS):
+            # With USE_MMAP the weights are shared, so every worker after the first only adds its own context memory
+            model = Llama(
+                model_path=model_path,
+                n_gpu_layers=N_GPU_LAYERS,
+                n_ctx=N_CTX,
+                n_threads=THREADS_PER_WORKER,
+                use_mmap=USE_MMAP,
+                use_mlock=USE_MLOCK,
+                verbose=False
+            )
+
+        with load_phase(name, "build_prefix"):
+            # Evaluate the system prompt once so requests only process the tokens after it
+            prompt_cache = PromptStateCache(max_session_states=SESSION_KV_STATES)
+            prompt_cache.build_prefix(model, format_turn("system", SYSTEM_PROMPT))
+
+        workers.append(ModelWorker(worker_id, model, prompt_cache))
+        if not startup_status.ready:
+            startup_status.update(workers_loaded=worker_id + 1)
+        print(f"✅ Worker {worker_id} ready")
+
+    # Tokenizing only reads the vocabulary, so any worker's model can serve the shared cache
+    tokenizer_model = workers[0].model
+    turn_tokens = TurnTokenCache(
+        lambda text: tokenizer_model.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+    )
+    context_size = tokenizer_model.n_ctx()
+
+    if WARMUP_TOKENS > 0:
+        with load_phase(name, "warmup"):
+            for worker in workers:
+                warm_up(worker, turn_tokens)
+
+    batch_engine = None
+    if BATCH_SLOTS > 0:
+        # The batching context shares the loaded weights; the worker's model is kept for tokenization
+        with load_phase(name, "batch_engine"):
+            batch_engine = BatchEngine(
+                tokenizer_model,
+                n_slots=BATCH_SLOTS,
+                slot_ctx=context_size,
+                n_threads=THREADS_PER_WORKER,
+                prefix_tokens=workers[0].prompt_cache.prefix_tokens,
+                stop_tokens=turn_tokens.tokens("<end_of_turn>"),
+                max_queue_depth=MAX_QUEUE_DEPTH
+            )
+        print(f"📦 Continuous batching with {BATCH_SLOTS} slots")
+
+    return ServedModel(
+        name,
+        model_path,
+        pool=ModelPool(workers, max_queue_depth=MAX_QUEUE_DEPTH),
+        batch_engine=batch_engine,
+        turn_tokens=turn_tokens,
+        bos_tokens=tokenizer_model.tokenize(b"", add_bos=True),
+        context_size=context_size
+    )
+
+# Named models, loaded on demand; the default one is loaded at startup
+model_registry = ModelRegistry(
+    MODELS, load_model, DEFAULT_MODEL, memory_budget_bytes=int(MODEL_MEMORY_BUDGET_MB * 2 ** 20)
+)
 
 def initialize_models():
-    global chat_model
-    print("🤖 Initializing model...")
-    print(f"📁 Model path: {LOCAL_MODEL_PATH}")
-    
-    # Use local model path
-    model_path = get_model_path()
-    
-    chat_model = Llama(
-        model_path=model_path,
+    global response_cache
+    try:
+        model_registry.acquire().release()
+        print("✅ Text model loaded!")
+
+        if RESPONSE_CACHE_SIZE > 0:
+            with startup_status.step("response_cache"):
+                response_cache = ResponseCache(
+                    max_entries=RESPONSE_CACHE_SIZE,
+                    ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+                    embed=load_cache_embedder(),
+                    similarity_threshold=RESPONSE_CACHE_SIMILARITY
+                )
+            print(f"🗄️ Response cache enabled ({RESPONSE_CACHE_SIZE} entries)")
+
+        startup_status.mark_ready()
+    except Exception as e:
+        startup_status.mark_failed(e)
+
+def server_ready():
+    """Only a loaded and warmed-up server takes chat requests"""
+    return startup_status.ready
+
+def load_cache_embedder():
+    """Local embedding model for the response cache's similarity tier, if one is configured"""
+    if not RESPONSE_CACHE_EMBEDDING_MODEL:
+        return None
+
+    embedding_model = Llama(
+        model_path=RESPONSE_CACHE_EMBEDDING_MODEL,
+        embedding=True,
+        n_ctx=512,
         n_gpu_layers=0,
-        n_ctx=2048,
         verbose=False
     )
-    print("✅ Text model loaded!")
+    embed_lock = threading.Lock()
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    return jsonify({
+    def embed(text):
+        with embed_lock:
+            return embedding_model.embed(text)
+
+    print(f"🧭 Similarity cache embeddings: {RESPONSE_CACHE_EMBEDDING_MODEL}")
+    return embed
+
+def scheduler_gauge(key):
+    """Collect one scheduler figure (queue depth, busy, capacity) for every loaded model"""
+    values = {}
+    for served_model in model_registry.loaded_models():
+        if served_model.batch_engine is not None:
+            stats = served_model.batch_engine.stats()
+            figures = {"queue_depth": stats["queue_depth"], "busy": stats["active_slots"], "capacity": stats["slots"]}
+        else:
+            stats = served_model.pool.stats()
+            figures = {"queue_depth": stats["queue_depth"], "busy": stats["workers"] - stats["idle_workers"], "capacity": stats["workers"]}
+        values[(served_model.name,)] = figures[key]
+    return values
+
+metrics_registry.gauge(
+    "hypnos_queue_depth", "Requests waiting for a model worker or batch slot", ("model",),
+    lambda: scheduler_gauge("queue_depth")
+)
+metrics_registry.gauge(
+    "hypnos_busy_workers", "Model workers or batch slots currently generating", ("model",),
+    lambda: scheduler_gauge("busy")
+)
+metrics_registry.gauge(
+    "hypnos_worker_capacity", "Model workers or batch slots available in total", ("model",),
+    lambda: scheduler_gauge("capacity")
+)
+
+def startup_gauge():
+    snapshot = startup_status.snapshot()
+    values = {(phase,): seconds for phase, seconds in snapshot["phase_seconds"].items()}
+    if snapshot["ready"]:
+        values[("total",)] = snapshot["startup_seconds"]
+    return values
+
+metrics_registry.gauge(
+    "hypnos_startup_seconds", "Time spent in each startup phase, and in total once ready", ("phase",), startup_gauge
+)
+metrics_registry.gauge(
+    "hypnos_ready", "1 once the default model is loaded and warmed up", (), lambda: {(): int(startup_status.ready)}
+)
+
+def new_request_timings(endpoint, served_model):
+    return RequestTimings(endpoint, served_model.name, slow_request_seconds=SLOW_REQUEST_SECONDS)
+
+def health_status():
+    # Pool and cache details are for the default model, the others are summarized under "models"
+    default_model = model_registry.get_loaded()
+    return {
         "status": "healthy",
-        "text_model_loaded": chat_model is not None,
+        "text_model_loaded": default_model is not None,
+        "prompt_cache": default_model.pool.prompt_cache_stats() if default_model else None,
+        "pool": default_model.pool.stats() if default_model else None,
+        "batching": default_model.batch_engine.stats() if default_model and default_model.batch_engine else None,
+        "response_cache": response_cache.stats() if response_cache else None,
+        "summaries": summarizer.stats() if summarizer else None,
+        "retrieval_enabled": retrieval_index is not None,
+        "token_cache": default_model.turn_tokens.stats() if default_model else None,
+        "models": model_registry.stats(),
+        "startup": startup_status.snapshot(),
+        "sessions": session_store.stats(),
         "timestamp": time.time(),
         "message": "Hypnos Flask app is running!"
-    })
+    }
+
+def liveness_status():
+    """The process is up and its startup hasn't failed - loading may still be in progress"""
+    snapshot = startup_status.snapshot()
+    return {"status": "failed" if snapshot["error"] else "alive", "startup": snapshot}, 500 if snapshot["error"] else 200
+
+def readiness_status():
+    """200 once the default model is loaded and warmed up, 503 with the load progress until then"""
+    snapshot = startup_status.snapshot()
+    return {"status": "ready" if snapshot["ready"] else "starting", "startup": snapshot}, 200 if snapshot["ready"] else 503
 
-def format_prompt_truncated(history, max_tokens=2048, generation_tokens=200):
+def image_processing_status():
+    """/process_image for both servers: no vision model is served yet, so the app gets a placeholder reply"""
+    if not server_ready():
+        return {"error": "Model not initialized"}, 503
+    return {"response": "Image processing is not yet implemented in this version.", "history": []}, 200
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    return jsonify(health_status())
+
+@app.route('/livez', methods=['GET'])
+def liveness_check():
+    payload, status_code = liveness_status()
+    return jsonify(payload), status_code
+
+@app.route('/readyz', methods=['GET'])
+def readiness_check():
+    payload, status_code = readiness_status()
+    return jsonify(payload), status_code
+
+def format_turn(role, content):
+    """Format a single conversation turn in the Gemma chat format"""
+    return f"<start_of_turn>{role}\n{content.strip()}<end_of_turn>\n"
+
+def build_prompt_truncated(history, served_model, max_tokens=2048, generation_tokens=200, context=None):
     """
-    Truncates the conversation history to fit within the context window.
-    Uses simple word-length estimate (not exact tokens, but works well).
+    Truncates the conversation history to fit within the context window and returns the prompt tokens.
+    Uses exact token counts from the model's tokenizer; each turn is tokenized once and cached,
+    and the prompt is assembled from the cached turn tokens without re-tokenizing the whole text.
+    An optional context (retrieved passages) is placed right before the newest message if it fits,
+    taking priority over older turns.
     """
     system = [m for m in history if m["role"] == "system"]
     turns = [m for m in history if m["role"] != "system"]
+    turn_tokens = served_model.turn_tokens
+    bos_tokens = served_model.bos_tokens
 
-    # Estimate tokens with a ~1.3x factor (approx LLM tokenization)
-    def estimate_tokens(text): return int(len(text.split()) * 1.3)
+    reply_prefix = turn_tokens.tokens("<start_of_turn>model\n")
+    system_tokens = [turn_tokens.tokens(format_turn(m["role"], m["content"])) for m in system]
 
-    total = 0
-    selected = []
+    budget = max_tokens - generation_tokens - len(bos_tokens) - len(reply_prefix)
+    budget -= sum(len(tokens) for tokens in system_tokens)
 
     # Reverse scan user-model turns from most recent
+    selected = []
     for msg in reversed(turns):
-        msg_tokens = estimate_tokens(msg["content"])
-        if total + msg_tokens >= max_tokens - generation_tokens - 50:  # leave headroom
+        msg_tokens = turn_tokens.tokens(format_turn(msg["role"], msg["content"]))
+        if len(msg_tokens) > budget:
             break
-        selected.insert(0, msg)
-        total += msg_tokens
+        selected.append(msg_tokens)
+        budget -= len(msg_tokens)
 
-    all_msgs = system + selected
-    prompt = ""
-    for turn in all_msgs:
-        role = turn["role"]
-        content = turn["content"].strip()
-        prompt += f"<start_of_turn>{role}\n{content}<end_of_turn>\n"
+        if context and len(selected) == 1:
+            context_tokens = turn_tokens.tokens(format_turn("system", context))
+            if len(context_tokens) <= budget:
+                # Goes before the newest message once the order is reversed
+                selected.append(context_tokens)
+                budget -= len(context_tokens)
 
-    prompt += "<start_of_turn>model\n"
-    return prompt
+    if turns and not selected:
+        raise PromptTooLongError("Message is too long for the model's context window")
 
-@app.route('/chat', methods=['POST'])
-@require_api_key
-def chat_endpoint():
-    if chat_model is None:
-        return jsonify({"error": "Model not initialized"}), 503
+    prompt_tokens = list(bos_tokens)
+    for tokens in system_tokens:
+        prompt_tokens.extend(tokens)
+    for tokens in reversed(selected):
+        prompt_tokens.extend(tokens)
+    prompt_tokens.extend(reply_prefix)
+    return prompt_tokens
+
+def build_chat_history(data, history=None):
+    """Build the full history (system prompt + past turns + new user message) for a chat request"""
+    user_message = data['message']
+    if history is None:
+        history = data.get("history", [])
+
+    # Default system prompt
+    # Always inject system prompt — overwrite any previous one
+    system_prompt = {
+        "role": "system",
+        "content": (
+            SYSTEM_PROMPT
+        )
+    }
+
+    # Remove existing system prompt (if any)
+    history = [msg for msg in history if msg["role"] != "system"]
+    # Prepend new one
+    history.insert(0, system_prompt)
+
+    # Append user message
+    history.append({"role": "user", "content": user_message})
+    return history
+
+def resolve_session(data):
+    """
+    Work out the session for a chat request. Returns (session_id, stored_history, error).
+    - no "session_id" key: stateless request, the client sends the full history
+    - "session_id": null: start a new server-side session
+    - "session_id": "<id>": continue a stored session (a client may resend its history if the session expired)
+    """
+    if "session_id" not in data:
+        return None, None, None
+
+    session_id = data["session_id"]
+    if not session_id:
+        return new_session_id(), [], None
+
+    stored_history = session_store.get(session_id)
+    if stored_history is None:
+        if "history" not in data:
+            return session_id, None, "Session not found or expired"
+        stored_history = data["history"]
+    return session_id, stored_history, None
+
+def chat_result(chat, assistant_reply, usage):
+    """Response payload for a finished turn - session clients don't get the whole history back"""
+    result = {
+        "response": assistant_reply,
+        "model": chat.served_model.name,
+        "tokens_used": usage.get("total_tokens"),
+        "usage": usage
+    }
+    if chat.session_id:
+        result["session_id"] = chat.session_id
+    else:
+        result["history"] = chat.history
+    return result
+
+def response_cache_params(served_model):
+    """Everything besides the question that determines the reply - cached entries only match if these are equal"""
+    system_hash = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:16]
+    model_file = os.path.basename(served_model.path)
+    return f"{served_model.name}:{model_file}|{GENERATION_TOKENS}|0.7|{system_hash}|{RETRIEVAL_INDEX_DIR}"
+
+def is_first_turn(history):
+    """Only replies to the opening question are cacheable - later ones depend on the conversation"""
+    return len(history) == 2 and history[-1]["role"] == "user"
+
+def lookup_cached_reply(chat):
+    if response_cache is None or not is_first_turn(chat.history):
+        return None
+    return response_cache.lookup(chat.history[-1]["content"], response_cache_params(chat.served_model))
 
+def store_cached_reply(chat, assistant_reply):
+    if response_cache is not None and is_first_turn(chat.history) and assistant_reply:
+        response_cache.store(chat.history[-1]["content"], response_cache_params(chat.served_model), assistant_reply)
+
+def cached_usage(cached):
+    return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached": cached["match"]}
+
+def finish_turn(chat, assistant_reply):
+    chat.history.append({"role": "model", "content": assistant_reply})
+    if chat.session_id:
+        # The system prompt is always injected by the server, so it's not stored
+        session_store.save(chat.session_id, chat.history[1:])
+    schedule_summary(chat)
+
+def summary_namespace(served_model):
+    """Summaries are only reused with the model file that wrote them"""
+    return f"{served_model.name}:{os.path.basename(served_model.path)}"
+
+def summarized_history(history, served_model):
+    """The history with its longest summarized run of older turns replaced by the cached summary"""
+    if summarizer is None:
+        return history
+    system = [m for m in history if m["role"] == "system"]
+    turns = [m for m in history if m["role"] != "system"]
+    summary, n_summarized = summarizer.lookup(summary_namespace(served_model), turns, max_turns=len(turns) - 1)
+    if summary is None:
+        return history
+    summary_turn = {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+    return system + [summary_turn] + turns[n_summarized:]
+
+def schedule_summary(chat):
+    """
+    Once the turns after the current summary pass SUMMARY_TRIGGER_TOKENS, fold all but the last
+    SUMMARY_KEEP_TURNS of them into a new summary. It's generated in the background at low priority,
+    so it's ready for a later turn instead of delaying this one.
+    """
+    if summarizer is None:
+        return
+    served_model = chat.served_model
+    namespace = summary_namespace(served_model)
+    turns = [m for m in chat.history if m["role"] != "system"]
+    n_keep_from = len(turns) - SUMMARY_KEEP_TURNS
+    _, n_summarized = summarizer.lookup(namespace, turns, max_turns=n_keep_from)
+    if n_keep_from <= n_summarized:
+        return
+
+    turn_sizes = [len(served_model.turn_tokens.tokens(format_turn(m["role"], m["content"]))) for m in turns[n_summarized:]]
+    if sum(turn_sizes) <= SUMMARY_TRIGGER_TOKENS:
+        return
+
+    # Fold as many turns as fit in one summarization prompt; the rest go into the next summary
+    budget = served_model.context_size - 2 * SUMMARY_MAX_TOKENS - len(summary_prefix_tokens(served_model)) - 128
+    n_fold, used = n_summarized, 0
+    for size in turn_sizes[:n_keep_from - n_summarized]:
+        if n_fold > n_summarized and used + size > budget:
+            break
+        n_fold += 1
+        used += size
+
+    served_model.acquire()
+    if not summarizer.schedule(namespace, turns, n_fold, lambda previous, new_turns: run_summary(served_model, previous, new_turns, budget)):
+        served_model.release()
+
+def summary_prefix_tokens(served_model):
+    # Starting with the system prompt lets the worker restore its cached prefix KV state
+    return served_model.pool.workers[0].prompt_cache.prefix_tokens
+
+def run_summary(served_model, previous_summary, turns, budget):
+    """Generate a summary of previous_summary + turns at background priority. Releases served_model"""
     try:
-        data = request.get_json()
-        if not data or 'message' not in data:
-            return jsonify({"error": "Missing 'message' field"}), 400
+        return generate_summary(served_model, previous_summary, turns, budget)
+    finally:
+        served_model.release()
 
-        user_message = data['message']
-        history = data.get("history", [])
+def generate_summary(served_model, previous_summary, turns, budget):
+    speakers = {"user": "User", "model": "Assistant"}
+    tokenizer_model = served_model.pool.workers[0].model
+    lines = []
+    for m in turns:
+        content = m["content"].strip()
+        if len(served_model.turn_tokens.tokens(format_turn(m["role"], m["content"]))) > budget:
+            # A single huge message can't be summarized whole; its first budget tokens have to do
+            content_tokens = tokenizer_model.tokenize(content.encode("utf-8"), add_bos=False, special=True)
+            content = tokenizer_model.detokenize(content_tokens[:budget]).decode("utf-8", errors="ignore") + "..."
+        lines.append(f"{speakers.get(m['role'], m['role'])}: {content}")
 
-        # Default system prompt
-        # Always inject system prompt — overwrite any previous one
-        system_prompt = {
-            "role": "system",
-            "content": (
-                SYSTEM_PROMPT
-            )
-        }
+    request = SUMMARY_INSTRUCTIONS
+    if previous_summary:
+        request += f"\n\nSummary so far:\n{previous_summary}"
+    request += "\n\nConversation:\n" + "\n".join(lines)
+    prompt_tokens = (
+        summary_prefix_tokens(served_model)
+        + served_model.turn_tokens.tokens(format_turn("user", request))
+        + served_model.turn_tokens.tokens("<start_of_turn>model\n")
+    )
 
-        # Remove existing system prompt (if any)
-        history = [msg for msg in history if msg["role"] != "system"]
-        # Prepend new one
-        history.insert(0, system_prompt)
+    deadline = time.time() + SUMMARY_QUEUE_SECONDS
+    if served_model.batch_engine is not None:
+        generation = served_model.batch_engine.submit(
+            prompt_tokens, SUMMARY_MAX_TOKENS, temperature=0.2, deadline=deadline + REQUEST_TIMEOUT_SECONDS,
+            priority=PRIORITY_BACKGROUND
+        )
+        return "".join(generation)
 
-        # Append user message
-        history.append({"role": "user", "content": user_message})
+    with served_model.pool.acquire(priority=PRIORITY_BACKGROUND, deadline=deadline) as worker:
+        # Bounded like a chat generation, so a summary can't hold the worker indefinitely
+        generation_deadline = time.time() + REQUEST_TIMEOUT_SECONDS
 
-        # Construct prompt
-        prompt_text = format_prompt_truncated(history, max_tokens=2048, generation_tokens=GENERATION_TOKENS)
+        def should_stop(input_ids, logits):
+            return time.time() > generation_deadline
 
-        with model_lock:
-            output = chat_model(
-                prompt_text,
-                max_tokens=GENERATION_TOKENS,
-                temperature=0.7,
-                stop=["<end_of_turn>"]
-            )
+        worker.prompt_cache.prepare(worker.model, prompt_tokens)
+        completion = worker.model(
+            prompt_tokens,
+            max_tokens=SUMMARY_MAX_TOKENS,
+            temperature=0.2,
+            stop=["<end_of_turn>"],
+            stopping_criteria=StoppingCriteriaList([should_stop])
+        )
+    if time.time() > generation_deadline:
+        # A cut-off summary would replace the turns it was meant to cover
+        raise DeadlineExceededError("Summary deadline exceeded during generation")
+    return completion["choices"][0]["text"]
 
-        assistant_reply = output["choices"][0]["text"].strip()
-        history.append({"role": "model", "content": assistant_reply})
+def retrieve_context(message, served_model):
+    """Top SleepQA passages for the message, formatted as reference notes within RETRIEVAL_MAX_TOKENS"""
+    if retrieval_index is None:
+        return None
+
+    lines = []
+    used_tokens = 0
+    for passage in retrieval_index.search(message, k=RETRIEVAL_TOP_K):
+        if passage["score"] < RETRIEVAL_MIN_SCORE:
+            break
+        line = f"- Q: {passage['question']} A: {passage['answer']}"
+        line_tokens = len(served_model.turn_tokens.tokens(line + "\n"))
+        if used_tokens + line_tokens > RETRIEVAL_MAX_TOKENS:
+            break
+        lines.append(line)
+        used_tokens += line_tokens
 
-        return jsonify({
-            "response": assistant_reply,
-            "history": history,
-            "tokens_used": output.get("usage", {}).get("total_tokens")
+    if not lines:
+        return None
+    return "Reference information from the sleep knowledge base (use it if relevant):\n" + "\n".join(lines)
+
+def build_request_prompt(chat):
+    """Prompt tokens for a chat request, grounded with retrieved passages and truncated to the context window"""
+    served_model = chat.served_model
+    context = retrieve_context(chat.history[-1]["content"], served_model)
+    return build_prompt_truncated(
+        summarized_history(chat.history, served_model), served_model,
+        max_tokens=served_model.context_size, generation_tokens=GENERATION_TOKENS, context=context
+    )
+
+def acquire_worker(chat):
+    """Admission control: wait for a worker in the bounded queue until the request's deadline"""
+    return chat.served_model.pool.acquire(chat.session_id, deadline=chat.deadline)
+
+def chat_error(error, chat=None):
+    """
+    Map an exception raised while admitting or running a chat request to (payload, status code, headers).
+    Queue rejections get a 503 with a Retry-After hint.
+    """
+    headers = {}
+    if isinstance(error, ChatRequestError):
+        status, status_code = None, error.status_code
+    elif isinstance(error, PromptTooLongError):
+        status, status_code = "prompt_too_long", 413
+    elif isinstance(error, (QueueFullError, QueueTimeoutError)):
+        status, status_code = "rejected", 503
+        served_model = chat.served_model if chat else model_registry.get_loaded()
+        headers["Retry-After"] = str(served_model.scheduler.retry_after_seconds() if served_model else 1)
+    elif isinstance(error, DeadlineExceededError):
+        status, status_code = "deadline_exceeded", 504
+    else:
+        print(f"❌ Error in chat endpoint: {error}")
+        status, status_code = "error", 500
+
+    if chat is not None and status is not None:
+        chat.timings.finish(status)
+    return {"error": str(error)}, status_code, headers
+
+class PoolGeneration:
+    def __init__(self, lease, prompt_tokens, session_id, deadline, queue_seconds=0.0):
+        """
+        A reply generated by a pool worker. Iterate for text pieces; close() stops it and frees the worker.
+        Exposes the same timing attributes as a BatchRequest for the request metrics.
+        """
+        self.lease = lease
+        self.usage = {}
+        self.queue_seconds = queue_seconds
+        self.prompt_eval_tokens = None
+        self.prompt_eval_seconds = None
+        self.first_token_at = None
+        self._cancel_event = threading.Event()
+        self._tokens = self._generate(prompt_tokens, session_id, deadline)
+
+    def __iter__(self):
+        return self._tokens
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def close(self):
+        # Finish the model call before the worker can be handed to another request
+        self._tokens.close()
+        self.lease.release()
+
+    def _generate(self, prompt_tokens, session_id, deadline):
+        """
+        Run the model on the prompt and yield the reply piece by piece.
+        Generation stops early when cancelled or when the deadline passes.
+        Token usage is written into self.usage once generation finishes.
+        """
+        worker = self.lease.worker
+
+        # Checked by llama-cpp after every token, so an abandoned request frees the worker quickly
+        def should_stop(input_ids, logits):
+            return self._cancel_event.is_set() or time.time() > deadline
+
+        started = time.perf_counter()
+        # Restore the worker's best cached KV state (session or system prefix)
+        reused_tokens = worker.prompt_cache.prepare(worker.model, prompt_tokens, session_id=session_id)
+        self.prompt_eval_tokens = len(prompt_tokens) - reused_tokens
+        completion_tokens = 0
+
+        completion = worker.model(
+            prompt_tokens,
+            max_tokens=GENERATION_TOKENS,
+            temperature=0.7,
+            stop=["<end_of_turn>"],
+            stopping_criteria=StoppingCriteriaList([should_stop]),
+            stream=True
+        )
+        try:
+            for chunk in completion:
+                if self.first_token_at is None:
+                    self.first_token_at = time.perf_counter()
+                    self.prompt_eval_seconds = self.first_token_at - started
+                completion_tokens += 1
+                token_text = chunk["choices"][0]["text"]
+                if token_text:
+                    yield token_text
+        finally:
+            completion.close()
+
+        if time.time() > deadline:
+            raise DeadlineExceededError("Request deadline exceeded during generation")
+        if self._cancel_event.is_set():
+            return
+
+        if session_id:
+            # Keep the KV state so the next turn only evaluates the new tokens
+            worker.prompt_cache.save_session(session_id, worker.model)
+
+        self.usage.update({
+            "prompt_tokens": len(prompt_tokens),
+            "completion_tokens": completion_tokens,
+            "total_tokens": len(prompt_tokens) + completion_tokens
         })
 
+def start_generation(chat, prompt_tokens):
+    """
+    Admit a request and start generating its reply, either on the batching engine or a pool worker.
+    Raises QueueFullError / QueueTimeoutError when the request can't be admitted.
+    """
+    batch_engine = chat.served_model.batch_engine
+    if batch_engine is not None:
+        return batch_engine.submit(prompt_tokens, GENERATION_TOKENS, temperature=0.7, deadline=chat.deadline)
+    queue_started = time.perf_counter()
+    lease = acquire_worker(chat)
+    return PoolGeneration(lease, prompt_tokens, chat.session_id, chat.deadline, time.perf_counter() - queue_started)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"  # Disable proxy buffering (nginx) so tokens arrive immediately
+}
+
+def sse_event(payload):
+    """Format a payload as a single Server-Sent Event"""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def stream_cached_events(chat, cached):
+    """Serve a cached reply over SSE - a single token event followed by the usual done event"""
+    assistant_reply = cached["response"]
+    yield sse_event({"type": "token", "content": assistant_reply})
+    finish_turn(chat, assistant_reply)
+
+    done_event = {"type": "done"}
+    done_event.update(chat_result(chat, assistant_reply, cached_usage(cached)))
+    chat.timings.finish("cache_hit")
+    yield sse_event(done_event)
+
+def stream_chat_events(chat, generation):
+    """
+    Stream a reply token by token as Server-Sent Events.
+    Every token is sent as {"type": "token"}, the last event is {"type": "done"}
+    and carries the full reply, the updated history (or session id) and the token usage.
+    The generation is stopped and its model freed when the stream ends or the client disconnects.
+    """
+    status = "error"
+    try:
+        pieces = []
+        for token_text in generation:
+            pieces.append(token_text)
+            yield sse_event({"type": "token", "content": token_text})
+        generation.close()
+        status = "ok"
+
+        assistant_reply = "".join(pieces).strip()
+        store_cached_reply(chat, assistant_reply)
+        finish_turn(chat, assistant_reply)
+
+        done_event = {"type": "done"}
+        done_event.update(chat_result(chat, assistant_reply, generation.usage))
+        yield sse_event(done_event)
+
+    except GeneratorExit:
+        # Client disconnected - stop generating and give the model back
+        if status != "ok":
+            status = "cancelled"
+        generation.cancel()
+        raise
     except Exception as e:
-        print(f"❌ Error in chat endpoint: {e}")
-        return jsonify({"error": str(e)}), 500
+        status = "deadline_exceeded" if isinstance(e, DeadlineExceededError) else "error"
+        print(f"❌ Error in chat stream: {e}")
+        yield sse_event({"type": "error", "error": str(e)})
+    finally:
+        generation.close()
+        chat.timings.record_generation(generation)
+        chat.timings.finish(status)
 
-@app.route('/process_image', methods=['POST'])
+class ChatStream:
+    def __init__(self, events, chat, generation=None):
+        """
+        The SSE events of a chat reply. cancel() may be called from any thread to stop generating;
+        close() frees the model and must run once the events are done (or were never started).
+        """
+        self.events = events
+        self.chat = chat
+        self.generation = generation
+
+    def cancel(self):
+        if self.generation is not None:
+            self.generation.cancel()
+
+    def close(self):
+        # A stream closed before its generator ever ran still frees the worker and gets recorded
+        if self.generation is not None:
+            self.generation.close()
+            self.chat.timings.record_generation(self.generation)
+        self.chat.timings.finish("cancelled")
+        self.chat.release()
+
+def open_chat_stream(chat):
+    """Admit the request before any headers are sent, so a full queue can still answer 503"""
+    try:
+        cached = lookup_cached_reply(chat)
+        if cached:
+            return ChatStream(stream_cached_events(chat, cached), chat)
+
+        with chat.timings.phase("prompt_build"):
+            prompt_tokens = build_request_prompt(chat)
+        generation = start_generation(chat, prompt_tokens)
+    except BaseException:
+        chat.release()
+        raise
+    return ChatStream(stream_chat_events(chat, generation), chat, generation)
+
+def parse_chat_request(data, endpoint):
+    """
+    Validate a chat request body, resolve its session and take a reference to the requested model.
+    Returns a ChatRequest, raises ChatRequestError for invalid requests.
+    """
+    if not server_ready():
+        raise ChatRequestError("Model not initialized", 503)
+    if not data or 'message' not in data:
+        raise ChatRequestError("Missing 'message' field", 400)
+
+    session_id, stored_history, error = resolve_session(data)
+    if error:
+        raise ChatRequestError(error, 404)
+
+    try:
+        # Loads the model first if it isn't loaded yet
+        served_model = model_registry.acquire(data.get("model"))
+    except UnknownModelError as e:
+        raise ChatRequestError(e.args[0], 400)
+
+    try:
+        history = build_chat_history(data, stored_history)
+    except BaseException:
+        served_model.release()
+        raise
+    deadline = time.time() + REQUEST_TIMEOUT_SECONDS
+    return ChatRequest(history, session_id, deadline, new_request_timings(endpoint, served_model), served_model)
+
+def complete_chat(chat):
+    """Generate the whole reply (blocking) and return the response payload"""
+    try:
+        # Cache hits skip tokenization and the inference queue entirely
+        cached = lookup_cached_reply(chat)
+        if cached:
+            finish_turn(chat, cached["response"])
+            chat.timings.finish("cache_hit")
+            return chat_result(chat, cached["response"], cached_usage(cached))
+
+        with chat.timings.phase("prompt_build"):
+            prompt_tokens = build_request_prompt(chat)
+
+        generation = start_generation(chat, prompt_tokens)
+        try:
+            assistant_reply = "".join(generation).strip()
+        finally:
+            generation.close()
+            chat.timings.record_generation(generation)
+        store_cached_reply(chat, assistant_reply)
+        finish_turn(chat, assistant_reply)
+
+        chat.timings.finish("ok")
+        return chat_result(chat, assistant_reply, generation.usage)
+    finally:
+        chat.release()
+
+def error_response(payload, status_code, headers):
+    response = jsonify(payload)
+    response.status_code = status_code
+    response.headers.update(headers)
+    return response
+
+def streaming_response(stream):
+    """Wrap a ChatStream in a non-buffered Flask response"""
+    response = Response(
+        stream_with_context(stream.events),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS
+    )
+    # Also covers a response that is closed before the generator ever started
+    response.call_on_close(stream.close)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of the request histograms and scheduler gauges"""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/chat', methods=['POST'])
 @require_api_key
-def process_image():
-    if chat_model is None:
-        return jsonify({"error": "Model not initialized"}), 503
+def chat_endpoint():
+    data = request.get_json(silent=True)
+    chat = None
+    try:
+        chat = parse_chat_request(data, "/chat")
+
+        if data.get("stream"):
+            # The stream records its own timings and releases the model once it ends
+            return streaming_response(open_chat_stream(chat))
 
+        return jsonify(complete_chat(chat))
+
+    except Exception as e:
+        return error_response(*chat_error(e, chat))
+
+@app.route('/chat/stream', methods=['POST'])
+@require_api_key
+def chat_stream_endpoint():
+    """Same as /chat with "stream": true - tokens are sent as Server-Sent Events"""
+    chat = None
     try:
-        # For now, return a placeholder response
-        # TODO: Implement image processing with vision model
-        return jsonify({
-            "response": "Image processing is not yet implemented in this version.",
-            "history": []
-        })
+        chat = parse_chat_request(request.get_json(silent=True), "/chat/stream")
+        return streaming_response(open_chat_stream(chat))
     except Exception as e:
-        print(f"❌ Error in image processing: {e}")
-        return jsonify({"error": str(e)}), 500
+        return error_response(*chat_error(e, chat))
 
-@app.route('/reset', methods=['POST'])
+@app.route('/process_image', methods=['POST'])
 @require_api_key
-def reset_conversation():
-    return jsonify({
+def process_image():
+    payload, status_code = image_processing_status()
+    return jsonify(payload), status_code
+
+def reset_session(data):
+    """Drop the old server-side session (if any) and hand out a fresh one"""
+    old_session_id = data.get("session_id")
+    if old_session_id:
+        session_store.delete(old_session_id)
+        for served_model in model_registry.loaded_models():
+            served_model.pool.drop_session(old_session_id)
+
+    session_id = new_session_id()
+    session_store.save(session_id, [])
+
+    return {
         "message": "Conversation reset",
+        "session_id": session_id,
         "history": [{
             "role": "system",
             "content": (
                 SYSTEM_PROMPT
             )
         }]
-    })
+    }
+
+def swap_model(data):
+    """
+    Atomically replace a named model: the new GGUF is loaded while the old one keeps serving,
+    then new requests switch over and the old model is unloaded once its requests have drained.
+    Returns (payload, status code).
+    """
+    name = data.get("name") or model_registry.default
+    path = data.get("path")
+    if name not in model_registry.specs:
+        return {"error": f"Unknown model '{name}'"}, 404
+    if path and not os.path.exists(path):
+        return {"error": f"Model file not found: {path}"}, 400
+
+    try:
+        served_model = model_registry.swap(name, path)
+    except Exception as e:
+        print(f"❌ Error swapping model '{name}': {e}")
+        return {"error": str(e)}, 500
+    return {"message": f"Model '{name}' swapped", "model": served_model.stats()}, 200
+
+@app.route('/models', methods=['GET'])
+@require_api_key
+def list_models():
+    return jsonify(model_registry.stats())
+
+@app.route('/models/swap', methods=['POST'])
+@require_api_key
+def swap_model_endpoint():
+    payload, status_code = swap_model(request.get_json(silent=True) or {})
+    return jsonify(payload), status_code
+
+@app.route('/reset', methods=['POST'])
+@require_api_key
+def reset_conversation():
+    return jsonify(reset_session(request.get_json(silent=True) or {}))
+
+def render_web_interface():
+    """The chat page with this server's URL and API key filled in. Raises FileNotFoundError if it is missing"""
+    html_file_path = os.path.join(os.path.dirname(__file__), 'web_interface.html')
+    with open(html_file_path, 'r', encoding='utf-8') as f:
+        html_content = f.read()
+
+    # Get the current server URL dynamically
+    local_ip = get_local_ip()
+    port = int(os.getenv('PORT', 3001))
+    server_url = f"http://{local_ip}:{port}"
+    
+    # Replace the hardcoded SERVER_URL with the dynamic one
+    html_content = html_content.replace(
+        "const SERVER_URL = 'http://192.168.1.116:5000';",
+        f"const SERVER_URL = '{server_url}';"
+    )
+    
+    # Add API key to the chat request
+    html_content = html_content.replace(
+        "'Content-Type': 'application/json',",
+        "'Content-Type': 'application/json',\n                            'Authorization': 'Bearer " + API_KEY + "',"
+    )
+    
+    # Add API key to the reset request
+    html_content = html_content.replace(
+        "const response = await fetch(`${SERVER_URL}/reset`, {",
+        "const response = await fetch(`${SERVER_URL}/reset`, {\n                    headers: {\n                        'Authorization': 'Bearer " + API_KEY + "'\n                    },"
+    )
+    
+    return html_content
 
 @app.route('/')
 def web_interface():
-    html_file_path = os.path.join(os.path.dirname(__file__), 'web_interface.html')
     try:
-        with open(html_file_path, 'r', encoding='utf-8') as f:
-            html_content = f.read()
-
-        # Get the current server URL dynamically
-        local_ip = get_local_ip()
-        port = int(os.getenv('PORT', 3001))
-        server_url = f"http://{local_ip}:{port}"
-        
-        # Replace the hardcoded SERVER_URL with the dynamic one
-        html_content = html_content.replace(
-            "const SERVER_URL = 'http://192.168.1.116:5000';",
-            f"const SERVER_URL = '{server_url}';"
-        )
-        
-        # Add API key to the chat request
-        html_content = html_content.replace(
-            "'Content-Type': 'application/json',",
-            "'Content-Type': 'application/json',\n                            'Authorization': 'Bearer " + API_KEY + "',"
-        )
-        
-        # Add API key to the reset request
-        html_content = html_content.replace(
-            "const response = await fetch(`${SERVER_URL}/reset`, {",
-            "const response = await fetch(`${SERVER_URL}/reset`, {\n                    headers: {\n                        'Authorization': 'Bearer " + API_KEY + "'\n                    },"
-        )
-        
-        return html_content
+        return render_web_interface()
     except FileNotFoundError:
         return "Web interface file not found", 404
 
@@ -0,0 +1,142 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+class SessionStore:
+    def __init__(self, max_sessions: int = 1000, ttl_seconds: float = 6 * 3600):
+        """
+        Bounded in-memory conversation store.
+        Sessions are kept in least-recently-used order and evicted when the store is full
+        or when they have not been used for ttl_seconds.
+        Histories are stored without the system prompt - it is always injected by the server.
+        """
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()  # session_id -> (history, last_access)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, session_id: str) -> Optional[List[Dict]]:
+        """Return a copy of the session history, or None if the session is unknown or expired"""
+        with self._lock:
+            self._purge_expired()
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            self._sessions[session_id] = (entry[0], time.time())
+            self._sessions.move_to_end(session_id)
+            return list(entry[0])
+
+    def save(self, session_id: str, history: List[Dict]):
+        with self._lock:
+            self._sessions[session_id] = (list(history), time.time())
+            self._sessions.move_to_end(session_id)
+            self._purge_expired()
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "evictions": self.evictions
+            }
+
+    def _purge_expired(self):
+        # Entries are kept in access order, so expired sessions are always at the front
+        cutoff = time.time() - self.ttl_seconds
+        while self._sessions:
+            session_id, (_, last_access) = next(iter(self._sessions.items()))
+            if last_access >= cutoff:
+                break
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, db_path: str, max_sessions: int = 1000, ttl_seconds: float = 6 * 3600):
+        """Same LRU/TTL semantics as SessionStore, but sessions survive server restarts"""
+        super().__init__(max_sessions, ttl_seconds)
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, history TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_access ON sessions(last_access)")
+        self._conn.commit()
+
+    def get(self, session_id: str) -> Optional[List[Dict]]:
+        with self._lock:
+            self._purge_expired()
+            row = self._conn.execute(
+                "SELECT history FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE sessions SET last_access = ? WHERE session_id = ?", (time.time(), session_id)
+            )
+            self._conn.commit()
+            return json.loads(row[0])
+
+    def save(self, session_id: str, history: List[Dict]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, history, last_access) VALUES (?, ?, ?)",
+                (session_id, json.dumps(history, ensure_ascii=False), time.time())
+            )
+            self._purge_expired()
+            count = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            if count > self.max_sessions:
+                overflow = count - self.max_sessions
+                self._conn.execute(
+                    "DELETE FROM sessions WHERE session_id IN "
+                    "(SELECT session_id FROM sessions ORDER BY last_access ASC LIMIT ?)", (overflow,)
+                )
+                self.evictions += overflow
+            self._conn.commit()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return {
+                "backend": "sqlite",
+                "sessions": count,
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "evictions": self.evictions
+            }
+
+    def _purge_expired(self):
+        cursor = self._conn.execute(
+            "DELETE FROM sessions WHERE last_access < ?", (time.time() - self.ttl_seconds,)
+        )
+        self.evictions += max(cursor.rowcount, 0)
@@ -0,0 +1,65 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+
+class StartupStatus:
+    def __init__(self):
+        """
+        Progress of the server's startup (loading and warming up the default model), reported by the
+        liveness and readiness endpoints. The server is ready only once every phase has finished.
+        """
+        self.started_at = time.time()
+        self.ready_at = None
+        self.phase = "starting"
+        self.progress = {}
+        self.phase_seconds = {}
+        self.error = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+
+    @contextmanager
+    def step(self, phase: str, **progress):
+        """Time one startup phase; phases that run more than once (e.g. per worker) are summed"""
+        with self._lock:
+            self.phase = phase
+            self.progress.update(progress)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + elapsed
+
+    def update(self, **progress):
+        with self._lock:
+            self.progress.update(progress)
+
+    def mark_ready(self):
+        with self._lock:
+            self.phase = "ready"
+            self.ready_at = time.time()
+        print(f"🟢 Ready after {self.ready_at - self.started_at:.1f}s")
+
+    def mark_failed(self, error: Exception):
+        with self._lock:
+            self.phase = "failed"
+            self.error = str(error)
+        print(f"❌ Startup failed: {error}")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            elapsed = (self.ready_at or time.time()) - self.started_at
+            return {
+                "ready": self.ready,
+                "phase": self.phase,
+                "progress": dict(self.progress),
+                "phase_seconds": {name: round(seconds, 3) for name, seconds in self.phase_seconds.items()},
+                "startup_seconds": round(elapsed, 3),
+                "error": self.error
+            }
@@ -0,0 +1,97 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def rolling_keys(namespace: str, turns: List[Dict]) -> List[str]:
+    """
+    Chained hashes of the conversation: keys[i] identifies turns[:i + 1].
+    Each key is computed from the previous one, so hashing a conversation is linear in its length
+    and two conversations share keys exactly as far as their turns are identical.
+    """
+    keys = []
+    digest = hashlib.sha1(namespace.encode("utf-8")).digest()
+    for turn in turns:
+        digest = hashlib.sha1(digest + f"{turn['role']}\0{turn['content']}".encode("utf-8")).digest()
+        keys.append(digest.hex())
+    return keys
+
+
+class ConversationSummarizer:
+    def __init__(self, max_entries: int = 2000):
+        """
+        Cache of running summaries of conversation prefixes, keyed by the rolling hash of the
+        summarized turns. Summaries are computed off the request path on a single background thread,
+        each one extending the longest summary already cached for the conversation.
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (summary, n_turns)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+        self.hits = 0
+        self.misses = 0
+        self.runs = 0
+        self.failures = 0
+
+    def lookup(self, namespace: str, turns: List[Dict], max_turns: int = None) -> Tuple[Optional[str], int]:
+        """Longest cached summary of a prefix of turns (at most max_turns long). Returns (summary, n_turns) or (None, 0)"""
+        keys = rolling_keys(namespace, turns[:max_turns] if max_turns is not None else turns)
+        with self._lock:
+            for key in reversed(keys):
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+            self.misses += 1
+        return None, 0
+
+    def schedule(self, namespace: str, turns: List[Dict], n_turns: int,
+                 summarize: Callable[[Optional[str], List[Dict]], str]) -> bool:
+        """
+        Summarize turns[:n_turns] in the background with summarize(previous_summary, new_turns),
+        where previous_summary covers the turns before new_turns. Returns False if that summary
+        is already cached or being computed.
+        """
+        key = rolling_keys(namespace, turns[:n_turns])[-1]
+        with self._lock:
+            if key in self._entries or key in self._pending:
+                return False
+            self._pending.add(key)
+        self._executor.submit(self._run, namespace, list(turns[:n_turns]), key, summarize)
+        return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "pending": len(self._pending),
+                "hits": self.hits,
+                "misses": self.misses,
+                "runs": self.runs,
+                "failures": self.failures
+            }
+
+    def _run(self, namespace: str, turns: List[Dict], key: str, summarize):
+        try:
+            # Another run may have finished a longer prefix since this one was scheduled
+            previous, n_previous = self.lookup(namespace, turns, max_turns=len(turns) - 1)
+            summary = summarize(previous, turns[n_previous:]).strip()
+            if not summary:
+                raise ValueError("empty summary")
+            with self._lock:
+                self._entries[key] = (summary, len(turns))
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                self.runs += 1
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+            print(f"⚠️ Conversation summary failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
@@ -0,0 +1,43 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List
+
+
+class TurnTokenCache:
+    def __init__(self, tokenize: Callable[[str], List[int]], max_entries: int = 50000):
+        """
+        LRU cache of tokenized conversation turns, keyed by a hash of the formatted turn text.
+        History that has been seen before is never re-tokenized; only new turns hit the tokenizer.
+        """
+        self._tokenize = tokenize
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def tokens(self, text: str) -> List[int]:
+        key = hashlib.sha1(text.encode("utf-8")).digest()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+
+        tokens = self._tokenize(text)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = tokens
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return tokens
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Pre-tokenized dataset cache for SFT and DPO training
+The SleepQA JSON is formatted and tokenized once into memory-mapped token arrays with an offsets
+index, in a directory keyed by the tokenizer's fingerprint, the data file and the build settings.
+Later runs with the same tokenizer and data reuse it, so data preparation takes no time.
+
+- SFT: the training notebook's chat text plus EOS, tokenized and packed (best-fit decreasing) into sequences
+  of up to --max-length tokens, with the sample lengths for position ids that restart at every sample.
+  Short Q&A samples fill the context instead of padding it
+- DPO: the chat-templated prompt/chosen/rejected text plus token lengths, for the Trainer's
+  length-grouped sampler (group_by_length=True), so pairs of similar length are batched together
+
+    python pack_dataset.py sft --data ../sleepqa_data/sleep-train-enriched.json --tokenizer unsloth/gemma-3n-E2B-it
+    python pack_dataset.py dpo --data ../sleepqa_data/slee-train-dpo-enriched.json --tokenizer unsloth/gemma-3n-E2B-it
+
+In the notebook, pass the tokenizer that is being trained with:
+
+    cache_dir = build_cache("sft", data_json, tok, "packed", max_length=1024, seed=SEED)
+    train_ds, val_ds = load_sft_dataset(cache_dir, "train"), load_sft_dataset(cache_dir, "val")
+"""
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import sys
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# The question and file hashes every stage keys on live in common/ at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.hashing import file_sha256
+
+FORMAT_VERSION = 2  # 2: SFT samples end with EOS
+TOKEN_DTYPE = np.uint32  # Gemma's vocabulary doesn't fit in 16 bits
+
+
+def sft_text(question: str, answer: str) -> str:
+    """Same chat text as to_chat in the training notebook; build_sft appends EOS when tokenizing it"""
+    return (
+        f"<bos><start_of_turn>user\n{question}<end_of_turn>\n"
+        f"<start_of_turn>model\n{answer}<end_of_turn>"
+    )
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """Hash of everything that decides how text is tokenized: vocabulary, merges, normalizer, special tokens, chat template"""
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    state = backend.to_str() if backend is not None else json.dumps(tokenizer.get_vocab(), sort_keys=True)
+    extra = json.dumps({
+        "class": type(tokenizer).__name__,
+        "special_tokens": tokenizer.special_tokens_map,
+        "chat_template": getattr(tokenizer, "chat_template", None)
+    }, sort_keys=True, default=str)
+    return hashlib.sha256((state + extra).encode("utf-8")).hexdigest()
+
+
+def write_token_array(directory: str, name: str, sequences: Sequence[Sequence[int]]):
+    """Sequences back to back in <name>_tokens.bin, and where each starts in <name>_offsets.npy"""
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(s) for s in sequences])
+    tokens = np.fromiter((t for s in sequences for t in s), dtype=TOKEN_DTYPE, count=int(offsets[-1]))
+    tokens.tofile(os.path.join(directory, f"{name}_tokens.bin"))
+    np.save(os.path.join(directory, f"{name}_offsets.npy"), offsets)
+
+
+class TokenArray:
+    def __init__(self, directory: str, name: str):
+        """Read side of write_token_array; the tokens are memory-mapped, not loaded"""
+        self.offsets = np.load(os.path.join(directory, f"{name}_offsets.npy"))
+        path = os.path.join(directory, f"{name}_tokens.bin")
+        self.tokens = np.memmap(path, dtype=TOKEN_DTYPE, mode='r') if self.offsets[-1] else np.zeros(0, TOKEN_DTYPE)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+
+def split_indices(n: int, val_fraction: float, seed: int) -> Dict[str, np.ndarray]:
+    order = np.random.default_rng(seed).permutation(n)
+    n_val = int(round(n * val_fraction))
+    return {"train": np.sort(order[n_val:]), "val": np.sort(order[:n_val])}
+
+
+def pack_sequences(lengths: Sequence[int], max_length: int) -> List[List[int]]:
+    """
+    Best-fit decreasing: longest sequences first, each into the fullest pack it still fits in.
+    Returns the sequence indices of every pack
+    """
+    packs = []
+    capacities = []  # (remaining capacity, pack index), kept sorted
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        slot = bisect.bisect_left(capacities, (lengths[i], -1))
+        if slot == len(capacities):
+            packs.append([i])
+            remaining, pack = max_length - lengths[i], len(packs) - 1
+        else:
+            remaining, pack = capacities.pop(slot)
+            packs[pack].append(i)
+            remaining -= lengths[i]
+        if remaining > 0:
+            bisect.insort(capacities, (remaining, pack))
+    return packs
+
+
+def build_sft_split(directory: str, sequences: List[List[int]], max_length: int) -> Dict:
+    os.makedirs(directory)
+    write_token_array(directory, "text", sequences)
+
+    packs = pack_sequences([len(s) for s in sequences], max_length)
+    members = np.array([i for pack in packs for i in pack], dtype=np.int64)
+    pack_offsets = np.zeros(len(packs) + 1, dtype=np.int64)
+    pack_offsets[1:] = np.cumsum([len(pack) for pack in packs])
+    np.save(os.path.join(directory, "pack_members.npy"), members)
+    np.save(os.path.join(directory, "pack_offsets.npy"), pack_offsets)
+
+    n_tokens = sum(len(s) for s in sequences)
+    return {"sequences": len(sequences), "tokens": n_tokens, "packs": len(packs),
+            "pack_fill": round(n_tokens / max(1, len(packs) * max_length), 4)}
+
+
+def build_sft(items: List[Dict], tokenizer, directory: str, max_length: int, splits: Dict[str, np.ndarray]) -> Dict:
+    texts = [sft_text(item["question"], item["answer"]) for item in items]
+    # The text already starts with <bos>. EOS is appended the way TRL does when it tokenizes the text
+    # itself, so every packed sample still ends with the marker that teaches the model to stop
+    sequences = tokenizer(texts, add_special_tokens=False)["input_ids"]
+    eos = tokenizer.eos_token_id
+    sequences = [s if s and s[-1] == eos else s + [eos] for s in sequences]
+    truncated = sum(len(s) > max_length for s in sequences)
+    if truncated:
+        print(f"⚠️ {truncated} samples are longer than {max_length} tokens and were truncated")
+    sequences = [s[:max_length] for s in sequences]
+
+    stats = {}
+    for split, indices in splits.items():
+        stats[split] = build_sft_split(os.path.join(directory, split), [sequences[i] for i in indices], max_length)
+        print(f"📦 {split}: {stats[split]['sequences']} samples ({stats[split]['tokens']} tokens) in "
+              f"{stats[split]['packs']} packs ({stats[split]['sequences'] / max(1, stats[split]['packs']):.1f} samples "
+              f"per pack), {stats[split]['pack_fill']:.0%} of pack tokens used")
+    return stats
+
+
+def build_dpo(items: List[Dict], tokenizer, directory: str, val_fraction: float, seed: int) -> Dict:
+    """
+    The notebook's question -> prompt rename and chat templating, done once. Completions are the
+    templated conversation minus the templated prompt
+    """
+    records = []
+    for item in items:
+        if not all(isinstance(item.get(field), str) and item[field].strip() for field in ("question", "chosen", "rejected")):
+            continue
+        user = [{"role": "user", "content": item["question"]}]
+        prompt = tokenizer.apply_chat_template(user, tokenize=False)
+        record = {"prompt": prompt}
+        for field in ("chosen", "rejected"):
+            full = tokenizer.apply_chat_template(user + [{"role": "assistant", "content": item[field]}], tokenize=False)
+            record[field] = full[len(prompt):] if full.startswith(prompt) else full
+        records.append(record)
+    if len(records) < len(items):
+        print(f"⚠️ Skipped {len(items) - len(records)} pairs with an empty prompt, chosen or rejected answer")
+
+    tokens = {field: tokenizer([r[field] for r in records], add_special_tokens=False)["input_ids"]
+              for field in ("prompt", "chosen", "rejected")}
+    splits = split_indices(len(records), val_fraction, seed)
+
+    stats = {}
+    for split, indices in splits.items():
+        split_dir = os.path.join(directory, split)
+        os.makedirs(split_dir)
+        for field, sequences in tokens.items():
+            write_token_array(split_dir, field, [sequences[i] for i in indices])
+        with open(os.path.join(split_dir, "records.jsonl"), 'w', encoding='utf-8') as f:
+            for i in indices:
+                f.write(json.dumps(records[i], ensure_ascii=False) + "\n")
+        stats[split] = {"pairs": len(indices)}
+        print(f"📦 {split}: {len(indices)} preference pairs")
+    return stats
+
+
+def build_cache(kind: str, data_path: str, tokenizer, output_dir: str, max_length: int = 1024,
+                val_fraction: float = 0.2, seed: int = 3407, subset: int = 0) -> str:
+    """
+    Build (or find) the cache for a dataset and return its directory. kind is "sft" or "dpo";
+    tokenizer is a Hugging Face tokenizer, or a processor wrapping one
+    """
+    tokenizer = getattr(tokenizer, "tokenizer", tokenizer)
+    settings = {
+        "format_version": FORMAT_VERSION,
+        "kind": kind,
+        "tokenizer": tokenizer_fingerprint(tokenizer),
+        "data_sha256": file_sha256(data_path),
+        "max_length": max_length,
+        "val_fraction": val_fraction,
+        "seed": seed,
+        "subset": subset
+    }
+    key = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    cache_dir = os.path.join(output_dir, f"{kind}-{key}")
+    if os.path.exists(os.path.join(cache_dir, "meta.json")):
+        print(f"♻️ Using cached {kind.upper()} data in {cache_dir}")
+        return cache_dir
+
+    print(f"🔄 Tokenizing {data_path} for {kind.upper()}...")
+    with open(data_path, 'r', encoding='utf-8') as f:
+        items = json.load(f)
+    if subset > 0:
+        items = items[:subset]
+
+    # Built next to the final directory and renamed into place, so a cache is either complete or absent
+    tmp_dir = cache_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    if kind == "sft":
+        stats = build_sft(items, tokenizer, tmp_dir, max_length, split_indices(len(items), val_fraction, seed))
+    elif kind == "dpo":
+        stats = build_dpo(items, tokenizer, tmp_dir, val_fraction, seed)
+    else:
+        raise ValueError(f"Unknown dataset kind: {kind}")
+
+    with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump({**settings, "data_path": data_path, "tokenizer_name": getattr(tokenizer, "name_or_path", None),
+                   "pad_token_id": tokenizer.pad_token_id, "stats": stats}, f, indent=2)
+    os.replace(tmp_dir, cache_dir)
+    print(f"✅ Saved to {cache_dir}")
+    return cache_dir
+
+
+def load_meta(cache_dir: str) -> Dict:
+    """The settings a cache was built with and its per-split stats (samples, tokens, packs)"""
+    with open(os.path.join(cache_dir, "meta.json"), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def packed_examples(split_dir: str):
+    """
+    One example per pack: the samples' tokens back to back and their lengths, in the layout of TRL's
+    own "bfd" packing. With padding_free=True, its collator restarts the position ids at every sample,
+    which keeps samples apart only under FlashAttention 2: eager and sdpa attention have no per-sample
+    mask, so they would attend across the whole pack
+    """
+    text = TokenArray(split_dir, "text")
+    members = np.load(os.path.join(split_dir, "pack_members.npy"))
+    pack_offsets = np.load(os.path.join(split_dir, "pack_offsets.npy"))
+    for start, end in zip(pack_offsets[:-1], pack_offsets[1:]):
+        samples = [text[i] for i in members[start:end]]
+        yield {
+            "input_ids": np.concatenate(samples).astype(np.int64).tolist(),
+            "seq_lengths": [len(s) for s in samples]
+        }
+
+
+def load_sft_dataset(cache_dir: str, split: str = "train", packed: bool = True):
+    """
+    Pre-tokenized datasets.Dataset for SFTTrainer, which skips tokenization for datasets that
+    already have input_ids. Unpacked, one sample per row with its tokens and a "length" column for
+    TrainingArguments(group_by_length=True)
+    """
+    from datasets import Dataset
+
+    split_dir = os.path.join(cache_dir, split)
+    if packed:
+        return Dataset.from_list(list(packed_examples(split_dir)))
+    text = TokenArray(split_dir, "text")
+    return Dataset.from_dict({
+        "input_ids": [text[i].astype(np.int64).tolist() for i in range(len(text))],
+        "length": text.lengths.tolist()
+    })
+
+
+def load_dpo_dataset(cache_dir: str, split: str = "train"):
+    """
+    Templated prompt/chosen/rejected for DPOTrainer, plus a "length" column (prompt + longer
+    completion, in tokens) that TrainingArguments(group_by_length=True) buckets batches by
+    """
+    from datasets import Dataset
+
+    split_dir = os.path.join(cache_dir, split)
+    with open(os.path.join(split_dir, "records.jsonl"), 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    lengths = TokenArray(split_dir, "prompt").lengths + np.maximum(
+        TokenArray(split_dir, "chosen").lengths, TokenArray(split_dir, "rejected").lengths
+    )
+    for record, length in zip(records, lengths):
+        record["length"] = int(length)
+    return Dataset.from_list(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tokenize and pack SleepQA training data once, keyed by tokenizer')
+    parser.add_argument(
+        'kind',
+        choices=['sft', 'dpo'],
+        help='sft: question/answer JSON, dpo: question/chosen/rejected JSON'
+    )
+    parser.add_argument(
+        '--data',
+        required=True,
+        help='Training JSON file'
+    )
+    parser.add_argument(
+        '--tokenizer',
+        required=True,
+        help='Hugging Face model id or local directory of the tokenizer used for training'
+    )
+    parser.add_argument(
+        '--output',
+        default='packed',
+        help='Cache root directory (default: packed)'
+    )
+    parser.add_argument(
+        '--max-length',
+        type=int,
+        default=1024,
+        help='Tokens per packed SFT sequence; longer samples are truncated (default: 1024)'
+    )
+    parser.add_argument(
+        '--val-fraction',
+        type=float,
+        default=0.2,
+        help='Share of samples held out for evaluation (default: 0.2)'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=3407,
+        help='Seed of the train/val split (default: 3407)'
+    )
+    parser.add_argument(
+        '--subset',
+        type=int,
+        default=0,
+        help='Only use the first N samples, for debugging (default: 0 = all)'
+    )
+    args = parser.parse_args()
+
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    build_cache(args.kind, args.data, tokenizer, args.output, max_length=args.max_length,
+                val_fraction=args.val_fraction, seed=args.seed, subset=args.subset)
+
+
+if __name__ == "__main__":
+    main()